@@ -10,20 +10,20 @@ class PostAdmin(admin.ModelAdmin):
     date_hierarchy = 'publish_date'
     search_fields = ('title', 'intro', 'body', 'blog__name')
     list_select_related = ('blog',)
-    list_filter = ('categories', 'blog')
-    list_display = ('title', 'blog', 'publish_date')
+    list_filter = ('is_published', 'categories', 'blog')
+    list_display = ('title', 'blog', 'publish_date', 'is_published')
     save_as = True
 
 
 @admin.register(Blog)
 class BlogAdmin(admin.ModelAdmin):
     list_select_related = ('owner',)
-    list_display = ('name', 'owner')
+    list_display = ('name', 'owner', 'posts_count', 'published_posts_count', 'last_published_at')
     search_fields = ('name', 'owner__first_name', 'owner__last_name', 'owner__email', 'owner__username')
 
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ('name',)
+    list_display = ('name', 'posts_count', 'published_posts_count')
     search_fields = ('name',)
 
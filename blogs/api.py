@@ -1,22 +1,39 @@
 # -*- coding: utf-8 -*-
-from blogs.filters import PostFilter
-from blogs.models import Blog, Post
+import os
+import re
+
+from blogs.bulk import create_posts
+from blogs.cache import fragment_cache_stats
+from blogs.conditional import ConditionalGetMixin
+from blogs.export import export_posts, gzip_stream
+from blogs.filters import PostFilter, IndexedSearchFilter
+from blogs.models import Blog, Category, Post
+from blogs.pagination import TimelinePagination
 from blogs.permissions import PostPermissions
-from blogs.serializers import BlogSerializer, BlogPostsSerializer, PostSerializer, PostListSerializer
-from django.db.models import Q, Count
-from django.utils import timezone
+from blogs.serializers import (
+    BlogSerializer, BlogPostsSerializer, PostBulkSerializer, PostSerializer, PostListSerializer
+)
+from blogs.settings import BULK_POSTS_MAX
+from django.db.models import Q, Count, Max
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.encoding import force_text
+from rest_framework import status
+from rest_framework.decorators import detail_route, list_route
+from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet, ModelViewSet
 from rest_framework.mixins import ListModelMixin, RetrieveModelMixin
-from rest_framework.filters import SearchFilter, OrderingFilter, DjangoFilterBackend
-from rest_framework.permissions import IsAuthenticatedOrReadOnly
+from rest_framework.filters import OrderingFilter, DjangoFilterBackend
+from rest_framework.permissions import IsAdminUser, IsAuthenticatedOrReadOnly
+from rest_framework.views import APIView
 
 
-class BlogsViewSet(GenericViewSet, ListModelMixin, RetrieveModelMixin):
-    queryset = Blog.objects.select_related('owner').annotate(posts_count=Count('posts')).all().order_by('name')
+class BlogsViewSet(ConditionalGetMixin, GenericViewSet, ListModelMixin, RetrieveModelMixin):
+    queryset = Blog.objects.select_related('owner').all().order_by('name')
     serializer_class = BlogSerializer
-    filter_backends = (SearchFilter, OrderingFilter)
+    filter_backends = (IndexedSearchFilter, OrderingFilter)
     search_fields = ('name', 'description', 'owner__username')
-    ordering_fields = ('name', 'owner', 'created_at')
+    ordering_fields = ('name', 'owner', 'created_at', 'posts_count', 'published_posts_count', 'last_published_at')
 
     def get_serializer_class(self):
         """
@@ -24,14 +41,66 @@ class BlogsViewSet(GenericViewSet, ListModelMixin, RetrieveModelMixin):
         """
         return self.serializer_class if self.action != 'retrieve' else BlogPostsSerializer
 
+    def get_list_validators(self):
+        """
+        Every blog change (including its counters) touches its modified_at, deletions change the count
+        """
+        blogs = Blog.objects.aggregate(count=Count('id'), last=Max('modified_at'))
+        return '{count}:{last}'.format(**blogs), blogs['last']
+
+    def get_object_validators(self):
+        """
+        The blog detail includes the blog's published posts, which touch its modified_at when they change or go live
+        """
+        try:
+            modified_at = Blog.objects.filter(pk=self.kwargs.get('pk')).values_list('modified_at', flat=True).first()
+        except (TypeError, ValueError):
+            return None
+        return None if modified_at is None else (force_text(modified_at), modified_at)
+
+    @detail_route()
+    def export(self, request, pk=None):
+        """
+        Streams the blog's posts as JSON lines: all of them to its owner and superusers, the published ones to others
+        """
+        blog = self.get_object()
+        posts = Post.objects.filter(blog=blog)
+        if not request.user.is_superuser and request.user.pk != blog.owner_id:
+            posts = posts.filter(is_published=True)
+        return self.export_response(request, posts.order_by('publish_date', 'id'), blog.owner.username)
 
-class PostsViewSet(ModelViewSet):
+    @list_route(url_path='export')
+    def export_all(self, request):
+        """
+        Streams the posts of every blog as JSON lines, only to superusers
+        """
+        if not request.user.is_superuser:
+            self.permission_denied(request)
+        return self.export_response(request, Post.objects.order_by('blog', 'publish_date', 'id'), 'wordplease')
+
+    def export_response(self, request, posts, name):
+        """
+        The response is streamed while the posts are read (see blogs.export) and gzipped if the client accepts it
+        """
+        content = export_posts(posts)
+        gzipped = re.search(r'\bgzip\b', request.META.get('HTTP_ACCEPT_ENCODING', '')) is not None
+        response = StreamingHttpResponse(gzip_stream(content) if gzipped else content,
+                                         content_type='application/x-ndjson')
+        if gzipped:
+            response['Content-Encoding'] = 'gzip'
+        response['Content-Disposition'] = 'attachment; filename="{0}.jsonl"'.format(name)
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
+class PostsViewSet(ConditionalGetMixin, ModelViewSet):
     queryset = Post.objects.select_related('blog__owner').all().order_by('-publish_date')
     serializer_class = PostSerializer
-    filter_backends = (SearchFilter, OrderingFilter, DjangoFilterBackend)
+    filter_backends = (IndexedSearchFilter, OrderingFilter, DjangoFilterBackend)
     filter_class = PostFilter
     search_fields = ('title', 'intro', 'body')
     ordering_fields = ('title', 'publish_date')
+    pagination_class = TimelinePagination
     permission_classes = (IsAuthenticatedOrReadOnly, PostPermissions)
 
     def get_serializer_class(self):
@@ -46,12 +115,9 @@ class PostsViewSet(ModelViewSet):
         If user is authenticated and not superuser, returns all its posts and published posts from others
         If user is superuser, returns all posts
         """
-        if self.action == 'retrieve':  # retrieves blog's info in the same db query
-            self.queryset.select_related('blog')
-
         # if not authenticated, returns only published posts
         if not self.request.user.is_authenticated():
-            return self.queryset.filter(publish_date__lte=timezone.now())
+            return self.queryset.filter(is_published=True)
 
         # if is superuser, returns all
         elif self.request.user.is_superuser:
@@ -60,12 +126,95 @@ class PostsViewSet(ModelViewSet):
         # if is not superuser, returns their own posts and others published
         else:
             return self.queryset.filter(
-                Q(blog=self.request.user.blog) | Q(publish_date__lte=timezone.now())
+                Q(blog=self.request.user.blog) | Q(is_published=True)
             )
 
+    def get_list_validators(self):
+        """
+        Post changes (including scheduled posts going live) touch their blog's modified_at, so blogs describe the list
+        """
+        blogs = Blog.objects.aggregate(count=Count('id'), last=Max('modified_at'))
+        return '{count}:{last}'.format(**blogs), blogs['last']
+
+    def get_object_validators(self):
+        """
+        The post detail includes its blog (and its counters)
+        """
+        try:
+            validators = self.get_queryset().filter(pk=self.kwargs.get('pk')).values_list(
+                'modified_at', 'blog__modified_at'
+            ).first()
+        except (TypeError, ValueError):
+            return None
+        return None if validators is None else ('{0}:{1}'.format(*validators), max(validators))
+
     def perform_create(self, serializer):
         """
         Force the post's blog to be the auth user's blog
         """
         serializer.save(blog=self.request.user.blog)
         return serializer
+
+    @list_route(methods=['post'])
+    def bulk(self, request):
+        """
+        Creates up to BULK_POSTS_MAX posts in the auth user's blog from a list. Every item is validated and the valid
+        ones are created together (see blogs.bulk.create_posts), the invalid ones are returned with their index and
+        errors: 201 if all were created, 207 if some were and 400 if none
+        """
+        if not isinstance(request.data, list):
+            return Response({'detail': 'Expected a list of posts.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(request.data) > BULK_POSTS_MAX:
+            return Response(
+                {'detail': 'No more than {0} posts per request.'.format(BULK_POSTS_MAX)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        valid, errors = [], []
+        for index, item in enumerate(request.data):
+            serializer = PostBulkSerializer(data=item)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+            else:
+                errors.append({'index': index, 'errors': serializer.errors})
+
+        names = set(name for index, data in valid for name in data.get('categories', []))
+        existing = set(Category.objects.filter(pk__in=names).values_list('pk', flat=True)) if names else set()
+        items = []
+        for index, data in valid:
+            categories = data.pop('categories', [])
+            missing = sorted(set(categories) - existing)
+            if missing:
+                errors.append({'index': index, 'errors': {'categories': [
+                    'Invalid pk "{0}" - object does not exist.'.format(name) for name in missing
+                ]}})
+            else:
+                items.append((index, Post(**data), categories))
+
+        created = create_posts(request.user.blog, [(post, categories) for index, post, categories in items]) \
+            if items else []
+        errors.sort(key=lambda error: error['index'])
+        return Response({
+            'created': [
+                {'index': index, 'id': post.pk, 'url': post.get_absolute_url()}
+                for (index, item, categories), post in zip(items, created)
+            ],
+            'errors': errors
+        }, status=status.HTTP_201_CREATED if not errors else (
+            status.HTTP_207_MULTI_STATUS if created else status.HTTP_400_BAD_REQUEST
+        ))
+
+
+class FragmentCacheStatsView(APIView):
+    """
+    Returns the fragment cache hits, misses and hit ratio per fragment. The counters are kept by every process, so
+    they are the ones of the process answering (its pid is returned too) since it started or was reset
+    """
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response({'pid': os.getpid(), 'fragments': fragment_cache_stats.as_dict()})
+
+    def delete(self, request):
+        fragment_cache_stats.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
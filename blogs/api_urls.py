@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from blogs.api import BlogsViewSet, PostsViewSet
+from blogs.api import BlogsViewSet, FragmentCacheStatsView, PostsViewSet
 from django.conf.urls import url, include
 from rest_framework.routers import DefaultRouter
 
@@ -9,4 +9,5 @@ router.register('posts', PostsViewSet)
 
 urlpatterns = (
     url(r'^1.0/', include(router.urls)),
+    url(r'^1.0/stats/fragment-cache/$', FragmentCacheStatsView.as_view(), name='fragment_cache_stats'),
 )
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+import bisect
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from blogs.cache import blog_scope, bump_fragment_versions
+from blogs.models import IMAGE_DOWNLOADS_ENABLED, Blog, Category, Post, needs_image_download
+from blogs.search import get_search_backend
+from blogs.tasks import queue_image_download
+
+WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et dolore '
+    'magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris nisi aliquip ex ea commodo '
+    'consequat duis aute irure in reprehenderit voluptate velit esse cillum eu fugiat nulla pariatur excepteur sint '
+    'occaecat cupidatat non proident sunt culpa qui officia deserunt mollit anim id est laborum'
+).split()
+
+
+class BulkInserter(object):
+    """
+    Inserts rows with bulk_create in batches. Their primary keys are needed for the related rows, but bulk_create
+    only sets them on backends that return them (PostgreSQL): elsewhere the inserter assigns them itself after
+    MAX(pk), so a concurrent insert makes the transaction fail with an IntegrityError (on SQLite, a prior write in the
+    transaction holds the write lock and prevents it). Call reset_sequences() once done so the database sequences
+    continue after the assigned keys
+    """
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.next_pks = {}
+        self.models = set()
+
+    def insert(self, model, objects):
+        if connection.features.can_return_ids_from_bulk_insert:
+            self.bulk_create(model, objects)
+            return objects
+        if model not in self.next_pks:
+            self.next_pks[model] = (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+        for obj in objects:
+            obj.pk = self.next_pks[model]
+            self.next_pks[model] += 1
+        self.bulk_create(model, objects)
+        self.models.add(model)
+        return objects
+
+    def bulk_create(self, model, objects):
+        """
+        bulk_create in batches of batch_size rows, or fewer if the database limits the parameters of a query
+        """
+        batch_size = min(self.batch_size, max(1, connection.ops.bulk_batch_size(model._meta.concrete_fields, objects)))
+        model.objects.bulk_create(objects, batch_size=batch_size)
+
+    def reset_sequences(self):
+        statements = connection.ops.sequence_reset_sql(no_style(), list(self.models))
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+
+def insert_posts(inserter, posts):
+    """
+    Inserts the (post, category names) pairs with their category links, without sending any signal. Returns the
+    number of links inserted
+    """
+    through = Post.categories.through
+    inserter.insert(Post, [post for post, categories in posts])
+    links = [through(post_id=post.pk, category_id=name) for post, categories in posts for name in set(categories)]
+    inserter.bulk_create(through, links)
+    return len(links)
+
+
+def create_posts(blog, posts):
+    """
+    Creates the (post, category names) pairs in the blog in one transaction: one INSERT per batch of posts and of
+    category links instead of a save() and its receivers per post. Counters and the search index are updated once,
+    and the image downloads of the whole batch are queued together on commit. Returns the posts, with their pks
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        Blog.objects.filter(pk=blog.pk).update(modified_at=now)  # the first write, see BulkInserter
+        for post, categories in posts:
+            post.blog = blog
+            post.is_published = post.publish_date <= now
+        insert_posts(BulkInserter(), posts)
+        Blog.update_counters([blog.pk])
+        Category.update_counters(set(name for post, categories in posts for name in categories))
+        get_search_backend().index_posts([post for post, categories in posts])
+        transaction.on_commit(lambda: bump_fragment_versions('posts', blog_scope(blog.pk)))
+        if IMAGE_DOWNLOADS_ENABLED:
+            for post, categories in posts:
+                if needs_image_download(post):
+                    queue_image_download(post.pk)  # flushed in IMAGE_BATCH_SIZE batches on commit
+    return [post for post, categories in posts]
+
+
+class WeightedChoice(object):
+    """
+    Picks items with the given weights in O(log n), with the caller's Random
+    """
+
+    def __init__(self, items, weights):
+        self.items = list(items)
+        self.cumulative = []
+        total = 0
+        for weight in weights:
+            total += weight
+            self.cumulative.append(total)
+
+    def __call__(self, rand):
+        return self.items[bisect.bisect_right(self.cumulative, rand.random() * self.cumulative[-1])]
+
+
+class Seeder(object):
+    """
+    Generates synthetic users with their blogs, posts and categories, deterministically for a given seed: the same
+    seed gives the same content whatever the batch size, and the same dates relative to when it runs. Posts per
+    blog and categories follow long tailed distributions and post bodies have log-normal lengths. Rows are inserted
+    with bulk_create, so no post_save receiver (image downloads, search index, counters) runs: callers rebuild the
+    counters and the search index afterwards (see the seed_data command)
+    """
+
+    def __init__(self, seed=0, categories=50, batch_size=1000, scheduled_ratio=0.05, image_ratio=0.0, days=365,
+                 prefix='seed', password='wordplease'):
+        self.rand = random.Random(seed)
+        self.category_count = categories
+        self.inserter = BulkInserter(batch_size)
+        self.batch_size = batch_size
+        self.scheduled_ratio = scheduled_ratio
+        self.image_ratio = image_ratio
+        self.days = days
+        self.prefix = prefix
+        self.password = make_password(password)  # hashed once, every seeded user shares it
+        # text is picked from pools generated once, generating it word by word would dominate the run time
+        self.titles = [self.sentences(1)[:80] for i in range(1000)]
+        self.intros = [self.sentences(2)[:250] for i in range(1000)]
+        self.paragraphs = [self.sentences(self.rand.randint(3, 8)) for i in range(200)]
+
+    def sentences(self, count):
+        return ' '.join(
+            ' '.join(self.rand.choice(WORDS) for i in range(self.rand.randint(6, 18))).capitalize() + '.'
+            for i in range(count)
+        )
+
+    def body(self):
+        paragraphs = max(1, min(40, int(self.rand.lognormvariate(1.5, 0.6))))  # ~4 paragraphs, a few long posts
+        return '\n\n'.join(self.rand.choice(self.paragraphs) for i in range(paragraphs))
+
+    def posts_per_blog(self, blogs, posts):
+        """
+        Splits posts among the blogs following a Pareto distribution: most blogs have a few posts, some many
+        """
+        weights = [self.rand.paretovariate(1.2) for i in range(blogs)]
+        total = sum(weights)
+        counts = [int(posts * weight / total) for weight in weights]
+        for i in range(posts - sum(counts)):
+            counts[i % blogs] += 1
+        return counts
+
+    def create_categories(self):
+        names = ['Category {0}'.format(i) for i in range(self.category_count)]
+        existing = set(Category.objects.filter(name__in=names).values_list('name', flat=True))
+        Category.objects.bulk_create([Category(name=name) for name in names if name not in existing])
+        return WeightedChoice(names, [1.0 / (rank + 1) for rank in range(len(names))])  # Zipf: a few are popular
+
+    def run(self, blogs, posts, progress=None):
+        """
+        Creates blogs users (one blog each) and posts posts among them. progress is called with the number of posts
+        inserted after every batch. Returns the number of (users, posts, category links) inserted
+        """
+        now = timezone.now()
+        choose_category = self.create_categories()
+        users = self.inserter.insert(User, [
+            User(
+                username='{0}{1}'.format(self.prefix, i), first_name='Seed', last_name=str(i),
+                email='{0}{1}@wordplease.com'.format(self.prefix, i), password=self.password
+            ) for i in range(blogs)
+        ])
+        blog_objects = self.inserter.insert(Blog, [
+            Blog(owner=user, name='{0} blog'.format(user.username), description=self.sentences(1)[:250])
+            for user in users
+        ])
+
+        inserted = links = 0
+        batch = []
+        for blog, count in zip(blog_objects, self.posts_per_blog(blogs, posts)):
+            for i in range(count):
+                if self.rand.random() < self.scheduled_ratio:
+                    publish_date = now + timedelta(seconds=self.rand.randint(60, 30 * 24 * 3600))
+                else:
+                    publish_date = now - timedelta(seconds=self.rand.randint(0, self.days * 24 * 3600))
+                post = Post(
+                    blog=blog, title=self.rand.choice(self.titles), intro=self.rand.choice(self.intros),
+                    body=self.body(),
+                    image_url='https://picsum.photos/seed/{0}/1600/1200'.format(self.rand.randint(1, 10 ** 6))
+                    if self.rand.random() < self.image_ratio else None,
+                    publish_date=publish_date, is_published=publish_date <= now
+                )
+                categories = set(choose_category(self.rand) for i in range(self.rand.choice((0, 1, 1, 1, 1, 2, 2, 3))))
+                batch.append((post, sorted(categories)))
+                if len(batch) == self.batch_size:
+                    links += self.insert_posts(batch)
+                    inserted += len(batch)
+                    batch = []
+                    if progress:
+                        progress(inserted)
+        if batch:
+            links += self.insert_posts(batch)
+            inserted += len(batch)
+            if progress:
+                progress(inserted)
+        self.inserter.reset_sequences()
+        return len(users), inserted, links
+
+    def insert_posts(self, batch):
+        """
+        Inserts a batch of (post, category names) in one transaction. Returns the category links inserted
+        """
+        with transaction.atomic():
+            return insert_posts(self.inserter, batch)
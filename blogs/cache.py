@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from itertools import islice
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.encoding import force_bytes, force_text
+
+from blogs.settings import FRAGMENT_CACHE_ALIAS
+
+_lru_caches = {}
+_missing = object()
+
+
+class LRUCache(LocMemCache):
+    """
+    Local memory cache that evicts the least recently used entries when MAX_ENTRIES is reached (Django's LocMemCache
+    culls entries without looking at how recently they were used)
+    """
+
+    def __init__(self, name, params):
+        super(LRUCache, self).__init__(name, params)
+        self._cache = _lru_caches.setdefault(name, OrderedDict())
+
+    def get(self, key, default=None, version=None, acquire_lock=True):
+        value = super(LRUCache, self).get(key, _missing, version, acquire_lock)
+        if value is _missing:
+            return default
+        if acquire_lock:
+            with self._lock.writer():
+                self._touch(self.make_key(key, version=version))
+        else:
+            self._touch(self.make_key(key, version=version))
+        return value
+
+    def _touch(self, key):
+        value = self._cache.pop(key, _missing)
+        if value is not _missing:
+            self._cache[key] = value
+
+    def _set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        self._cache.pop(key, None)
+        super(LRUCache, self)._set(key, value, timeout)
+
+    def _cull(self):
+        if self._cull_frequency == 0:
+            self.clear()
+        else:
+            for key in list(islice(self._cache, max(1, len(self._cache) // self._cull_frequency))):
+                self._delete(key)
+
+
+class FragmentCacheStats(object):
+    """
+    Per fragment hit/miss counters of this process, to tune the fragment cache size and timeout
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.hits = defaultdict(int)
+            self.misses = defaultdict(int)
+
+    def record(self, name, hit):
+        with self._lock:
+            (self.hits if hit else self.misses)[name] += 1
+
+    def as_dict(self):
+        """
+        Returns {fragment name: {'hits': n, 'misses': n, 'hit_ratio': float}}
+        """
+        with self._lock:
+            names = set(self.hits) | set(self.misses)
+            return {
+                name: {
+                    'hits': self.hits[name],
+                    'misses': self.misses[name],
+                    'hit_ratio': float(self.hits[name]) / (self.hits[name] + self.misses[name]),
+                } for name in names
+            }
+
+
+fragment_cache_stats = FragmentCacheStats()
+
+
+def get_fragment_cache():
+    return caches[FRAGMENT_CACHE_ALIAS]
+
+
+def blog_scope(pk):
+    return 'blog:{0}'.format(pk)
+
+
+def scope_key(scope):
+    """
+    Fragments are versioned by scope: a Blog instance or a global name such as 'posts' or 'categories'
+    """
+    if hasattr(scope, '_meta'):
+        return blog_scope(scope.pk)
+    return force_text(scope)
+
+
+def get_fragment_versions(*scopes):
+    """
+    Returns the current version of every scope. Missing versions start from the current time in milliseconds so an
+    evicted counter never comes back to a version that may still have fragments cached
+    """
+    cache = get_fragment_cache()
+    keys = ['fragment-version:{0}'.format(scope_key(scope)) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, int(time.time() * 1000), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_fragment_versions(*scopes):
+    """
+    Invalidates every fragment cached for the given scopes
+    """
+    cache = get_fragment_cache()
+    for scope in set(scope_key(scope) for scope in scopes):
+        key = 'fragment-version:{0}'.format(scope)
+        try:
+            cache.incr(key)
+        except ValueError:  # not set yet or evicted
+            cache.set(key, int(time.time() * 1000), None)
+
+
+def fragment_cache_key(name, scope, vary_on):
+    version, = get_fragment_versions(scope)
+    vary_hash = hashlib.md5(force_bytes(':'.join(force_text(value) for value in vary_on))).hexdigest()
+    return 'fragment:{0}:{1}:{2}:{3}'.format(name, scope_key(scope), version, vary_hash)
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import tempfile
+
+
+def read_checkpoint(filename):
+    """
+    Returns the data saved by write_checkpoint, or None if there is no (readable) checkpoint
+    """
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def write_checkpoint(filename, data):
+    """
+    Saves the progress of a long running command as JSON. The file is written aside and renamed, so a killed run
+    never leaves a half written checkpoint
+    """
+    if not os.path.isdir(os.path.dirname(os.path.abspath(filename))):
+        os.makedirs(os.path.dirname(os.path.abspath(filename)))
+    fd, temp_filename = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)))
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.rename(temp_filename, filename)
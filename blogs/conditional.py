@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import calendar
+import hashlib
+
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.encoding import force_bytes, force_text
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from blogs.settings import API_CACHE_ALIAS, API_CACHE_TIMEOUT
+
+
+class ConditionalGetMixin(object):
+    """
+    Adds ETag and Last-Modified validators to list and retrieve. Validators come from cheap queries
+    (get_list_validators and get_object_validators), so a 304 is answered before the objects are loaded or serialized.
+    Anonymous response data is also cached server side under its ETag
+    """
+
+    def get_list_validators(self):
+        """
+        Returns a (version, last_modified) tuple describing the list, or None to skip conditional handling
+        """
+        return None
+
+    def get_object_validators(self):
+        """
+        Returns a (version, last_modified) tuple describing the requested object, or None if it is not visible
+        """
+        return None
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            self.get_list_validators(), super(ConditionalGetMixin, self).list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            self.get_object_validators(), super(ConditionalGetMixin, self).retrieve, request, *args, **kwargs
+        )
+
+    def get_etag(self, request, version):
+        user = request.user
+        viewer = 'superuser:{0}'.format(user.pk) if user.is_superuser else (
+            'user:{0}'.format(user.pk) if user.is_authenticated() else 'anonymous'
+        )
+        return hashlib.md5(force_bytes('|'.join([
+            force_text(version), request.get_full_path(), viewer, request.META.get('HTTP_ACCEPT', '')
+        ]))).hexdigest()
+
+    def conditional_response(self, validators, handler, request, *args, **kwargs):
+        if validators is None:
+            return handler(request, *args, **kwargs)
+
+        version, last_modified = validators
+        etag = self.get_etag(request, version)
+        last_modified = calendar.timegm(last_modified.utctimetuple()) if last_modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        anonymous = not request.user.is_authenticated()
+
+        if response is None:
+            cache = caches[API_CACHE_ALIAS]
+            cache_key = 'api-response:{0}'.format(etag)
+            data = cache.get(cache_key) if anonymous else None
+            if data is not None:
+                response = Response(data)
+            else:
+                response = handler(request, *args, **kwargs)
+                if anonymous and response.status_code == 200:
+                    cache.set(cache_key, response.data, API_CACHE_TIMEOUT)
+
+        if response.status_code in (200, 304):
+            response['ETag'] = quote_etag(etag)
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Accept', 'Authorization', 'Cookie'))
+        patch_cache_control(response, max_age=0, must_revalidate=True, private=not anonymous)
+        return response
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from blogs.models import Post
+from blogs.settings import EXPORT_CHUNK_SIZE
+
+EXPORT_FIELDS = (
+    'id', 'blog__owner__username', 'title', 'intro', 'body', 'image_url', 'image_renditions', 'image_placeholder',
+    'publish_date', 'modified_at', 'is_published'
+)
+
+
+def export_posts(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields the posts of the queryset as JSON lines, in the format the import_jsonl command reads. Rows are read with
+    iterator(), so they are not cached by the queryset, and the categories are loaded with one query per chunk_size
+    posts: memory stays flat however many posts are exported
+    """
+    through = Post.categories.through
+    chunk = []
+    for post in queryset.values(*EXPORT_FIELDS).iterator():
+        chunk.append(post)
+        if len(chunk) == chunk_size:
+            for line in _export_chunk(through, chunk):
+                yield line
+            chunk = []
+    for line in _export_chunk(through, chunk):
+        yield line
+
+
+def _export_chunk(through, posts):
+    if not posts:
+        return
+    categories = {}
+    for post_id, category_id in through.objects.filter(
+        post_id__in=[post['id'] for post in posts]
+    ).order_by('category_id').values_list('post_id', 'category_id'):
+        categories.setdefault(post_id, []).append(category_id)
+    for post in posts:
+        post['type'] = 'post'
+        post['blog'] = post.pop('blog__owner__username')
+        post['image_renditions'] = json.loads(post['image_renditions']) if post['image_renditions'] else {}
+        post['categories'] = categories.get(post['id'], [])
+        yield (json.dumps(post, cls=DjangoJSONEncoder, sort_keys=True) + '\n').encode('utf-8')
+
+
+def gzip_stream(chunks, level=6):
+    """
+    Compresses a stream of bytes in the gzip format as it is consumed
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
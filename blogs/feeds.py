@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import hashlib
+
+from django.contrib.syndication.views import Feed
+from django.core.urlresolvers import reverse
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.encoding import force_bytes
+from django.utils.feedgenerator import Atom1Feed
+from django.utils.http import quote_etag, urlencode
+
+from blogs.cache import blog_scope, fragment_cache_stats, get_fragment_cache, get_fragment_versions
+from blogs.models import Blog, Category, Post
+from blogs.settings import FEED_ITEMS, FRAGMENT_CACHE_TIMEOUT
+
+
+class CachedFeed(Feed):
+    """
+    Caches the feed XML in the fragment cache under the version of its scope (see blogs.cache), which is bumped when
+    the posts of the scope change or go live, so a feed is rendered once per change. The version is also the ETag:
+    unchanged feeds are answered with a 304 after reading it, without any query for the posts
+    """
+
+    def get_scope(self, request, *args, **kwargs):
+        """
+        Returns the fragment cache scope whose version describes the feed
+        """
+        return 'posts'
+
+    def __call__(self, request, *args, **kwargs):
+        version, = get_fragment_versions(self.get_scope(request, *args, **kwargs))
+        etag = hashlib.md5(force_bytes('{0}:{1}:{2}'.format(
+            type(self).__name__, request.path, version
+        ))).hexdigest()
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            cache = get_fragment_cache()
+            key = 'feed:{0}'.format(etag)
+            cached = cache.get(key)
+            fragment_cache_stats.record('feed', cached is not None)
+            if cached is None:
+                response = super(CachedFeed, self).__call__(request, *args, **kwargs)
+                cache.set(key, (response.content, response['Content-Type']), FRAGMENT_CACHE_TIMEOUT)
+            else:
+                response = HttpResponse(cached[0], content_type=cached[1])
+        response['ETag'] = quote_etag(etag)
+        patch_cache_control(response, max_age=0, must_revalidate=True, public=True)
+        return response
+
+    def items(self, obj):
+        return self.get_posts(obj).select_related('blog__owner').prefetch_related('categories').filter(
+            is_published=True
+        ).order_by('-publish_date', '-id')[:FEED_ITEMS]
+
+    def get_posts(self, obj):
+        return Post.objects.all()
+
+    def item_title(self, item):
+        return item.title
+
+    def item_description(self, item):
+        return item.intro
+
+    def item_pubdate(self, item):
+        return item.publish_date
+
+    def item_updateddate(self, item):
+        return item.modified_at
+
+    def item_author_name(self, item):
+        return item.get_author().strip() or item.blog.owner.username
+
+    def item_categories(self, item):
+        return [category.pk for category in item.categories.all()]
+
+
+class LatestPostsFeed(CachedFeed):
+    title = 'Wordplease'
+    description = 'Latest posts'
+
+    def link(self):
+        return reverse('latest_posts')
+
+
+class BlogPostsFeed(CachedFeed):
+
+    def get_scope(self, request, username):
+        pk = Blog.objects.filter(owner__username=username).values_list('pk', flat=True).first()
+        if pk is None:
+            raise Http404('Blog not found')
+        return blog_scope(pk)
+
+    def get_object(self, request, username):
+        return get_object_or_404(Blog.objects.select_related('owner'), owner__username=username)
+
+    def get_posts(self, obj):
+        return Post.objects.filter(blog=obj)
+
+    def title(self, obj):
+        return obj.name
+
+    def description(self, obj):
+        return obj.description or obj.name
+
+    def link(self, obj):
+        return reverse('blog_detail', args=[obj.owner.username])
+
+
+class CategoryPostsFeed(CachedFeed):
+    """
+    Posts are added to and removed from categories without touching a category scope, so category feeds are
+    versioned by the global posts scope
+    """
+
+    def get_object(self, request, name):
+        return get_object_or_404(Category, pk=name)
+
+    def get_posts(self, obj):
+        return Post.objects.filter(categories=obj)
+
+    def title(self, obj):
+        return 'Wordplease: {0}'.format(obj.pk)
+
+    def description(self, obj):
+        return 'Latest posts in {0}'.format(obj.pk)
+
+    def link(self, obj):
+        return '{0}?{1}'.format(reverse('latest_posts'), urlencode({'category': obj.pk}))
+
+
+class LatestPostsAtomFeed(LatestPostsFeed):
+    feed_type = Atom1Feed
+    subtitle = LatestPostsFeed.description
+
+
+class BlogPostsAtomFeed(BlogPostsFeed):
+    feed_type = Atom1Feed
+
+    def subtitle(self, obj):
+        return self.description(obj)
+
+
+class CategoryPostsAtomFeed(CategoryPostsFeed):
+    feed_type = Atom1Feed
+
+    def subtitle(self, obj):
+        return self.description(obj)
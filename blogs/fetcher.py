@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from django.core.cache import caches
+from django.utils.six.moves.urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+
+from blogs.settings import (
+    IMAGE_BREAKER_COOLDOWN, IMAGE_BREAKER_THRESHOLD, IMAGE_CONNECT_TIMEOUT, IMAGE_DOWNLOAD_CHUNK_SIZE,
+    IMAGE_FETCH_CACHE_ALIAS, IMAGE_FETCH_DEADLINE, IMAGE_HOST_CONCURRENCY, IMAGE_HTTP_POOL_SIZE, IMAGE_MAX_BYTES,
+    IMAGE_READ_TIMEOUT
+)
+
+_http = threading.local()
+
+
+class ImageFetchError(IOError):
+    pass
+
+
+class ImageTooLarge(ImageFetchError):
+    pass
+
+
+class HostUnavailable(ImageFetchError):
+    """
+    The host is failing (circuit open) or already serving IMAGE_HOST_CONCURRENCY downloads: retry after retry_after
+    seconds instead of waiting for it
+    """
+
+    def __init__(self, host, retry_after, reason):
+        super(HostUnavailable, self).__init__('{0} is {1}, retry in {2}s'.format(host, reason, retry_after))
+        self.host = host
+        self.retry_after = retry_after
+
+
+def get_http_session():
+    """
+    Returns this thread's requests session, so every download of a worker reuses its keep-alive connections
+    """
+    session = getattr(_http, 'session', None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=IMAGE_HTTP_POOL_SIZE, pool_maxsize=IMAGE_HTTP_POOL_SIZE)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _http.session = session
+    return session
+
+
+def get_host(url):
+    return urlparse(url).netloc.lower()
+
+
+def download_image(session, image_url, filename, chunk_size=IMAGE_DOWNLOAD_CHUNK_SIZE, max_bytes=IMAGE_MAX_BYTES,
+                   timeout=(IMAGE_CONNECT_TIMEOUT, IMAGE_READ_TIMEOUT), deadline=IMAGE_FETCH_DEADLINE):
+    """
+    Streams the image to filename in chunk_size blocks. The read timeout applies to every read, the deadline to the
+    whole download, so a host trickling bytes can't hold a worker either. Returns the (SHA-256 hex digest, size) of
+    its bytes
+    """
+    started = time.time()
+    sha256, size = hashlib.sha256(), 0
+    response = session.get(image_url, stream=True, timeout=timeout)
+    try:
+        response.raise_for_status()
+        if int(response.headers.get('Content-Length') or 0) > max_bytes:
+            raise ImageTooLarge('{0} is larger than {1} bytes'.format(image_url, max_bytes))
+        with open(filename, 'wb', chunk_size) as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ImageTooLarge('{0} is larger than {1} bytes'.format(image_url, max_bytes))
+                if time.time() - started > deadline:
+                    raise requests.Timeout('{0} took more than {1}s'.format(image_url, deadline))
+                sha256.update(chunk)
+                f.write(chunk)
+    finally:
+        response.close()  # returns the connection to the pool
+    return sha256.hexdigest(), size
+
+
+class HostGuard(object):
+    """
+    Per host concurrency cap, circuit breaker and latency/failure stats, shared by every worker through the
+    IMAGE_FETCH_CACHE_ALIAS cache (it must be a shared cache, such as memcached, when several workers run).
+    A host is skipped for IMAGE_BREAKER_COOLDOWN seconds after IMAGE_BREAKER_THRESHOLD consecutive failures
+    """
+    stats_fields = ('requests', 'failures', 'rejected', 'bytes', 'time_ms')
+
+    def __init__(self, cache=None, concurrency=IMAGE_HOST_CONCURRENCY, threshold=IMAGE_BREAKER_THRESHOLD,
+                 cooldown=IMAGE_BREAKER_COOLDOWN, slot_timeout=None):
+        self.cache = cache or caches[IMAGE_FETCH_CACHE_ALIAS]
+        self.concurrency = concurrency
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.slot_timeout = slot_timeout or IMAGE_FETCH_DEADLINE + IMAGE_CONNECT_TIMEOUT  # leaked slots expire
+
+    def key(self, name, host):
+        return 'image-host:{0}:{1}'.format(name, host)
+
+    def incr(self, key, delta=1, timeout=None):
+        self.cache.add(key, 0, timeout)
+        try:
+            return self.cache.incr(key, delta)
+        except ValueError:  # expired between add and incr
+            self.cache.add(key, delta, timeout)
+            return delta
+
+    @contextmanager
+    def slot(self, host):
+        """
+        Holds one of the host's download slots or raises HostUnavailable if the circuit is open or all are taken
+        """
+        opened_until = self.cache.get(self.key('open', host))
+        if opened_until is not None:
+            self.record(host, rejected=1)
+            raise HostUnavailable(host, max(1, int(opened_until - time.time())), 'failing')
+
+        key = self.key('slots', host)
+        if self.incr(key, timeout=self.slot_timeout) > self.concurrency:
+            self.cache.decr(key)
+            self.record(host, rejected=1)
+            raise HostUnavailable(host, 1, 'busy')
+        try:
+            yield
+        finally:
+            try:
+                self.cache.decr(key)
+            except ValueError:  # the slot expired
+                pass
+
+    def success(self, host, size, seconds):
+        self.cache.delete(self.key('failures', host))
+        self.record(host, requests=1, bytes=size, time_ms=int(seconds * 1000))
+
+    def failure(self, host, seconds):
+        self.record(host, requests=1, failures=1, time_ms=int(seconds * 1000))
+        if self.incr(self.key('failures', host), timeout=self.cooldown * 10) >= self.threshold:
+            self.cache.set(self.key('open', host), time.time() + self.cooldown, self.cooldown)
+
+    def record(self, host, **values):
+        hosts = self.cache.get('image-host:hosts') or set()
+        if host not in hosts:
+            self.cache.set('image-host:hosts', hosts | {host}, None)
+        for field, value in values.items():
+            if value:
+                self.incr(self.key('stats:' + field, host), value)
+
+    def stats(self):
+        """
+        Returns {host: {'requests', 'failures', 'rejected', 'bytes', 'time_ms', 'avg_ms', 'circuit_open'}}
+        """
+        stats = {}
+        for host in sorted(self.cache.get('image-host:hosts') or []):
+            keys = dict((self.key('stats:' + field, host), field) for field in self.stats_fields)
+            values = dict((keys[key], value) for key, value in self.cache.get_many(list(keys)).items())
+            host_stats = dict((field, values.get(field, 0)) for field in self.stats_fields)
+            host_stats['avg_ms'] = host_stats['time_ms'] // host_stats['requests'] if host_stats['requests'] else 0
+            host_stats['circuit_open'] = self.cache.get(self.key('open', host)) is not None
+            stats[host] = host_stats
+        return stats
+
+    def fetch(self, session, image_url, filename, **kwargs):
+        """
+        download_image within a host slot. Connection errors, timeouts and 5xx responses count as host failures
+        """
+        host = get_host(image_url)
+        with self.slot(host):
+            started = time.time()
+            try:
+                digest, size = download_image(session, image_url, filename, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self.failure(host, time.time() - started)
+                raise
+            except ImageTooLarge:
+                self.record(host, requests=1, time_ms=int((time.time() - started) * 1000))
+                raise
+            except requests.HTTPError as exc:
+                if exc.response is not None and exc.response.status_code >= 500:
+                    self.failure(host, time.time() - started)
+                else:
+                    self.record(host, requests=1, time_ms=int((time.time() - started) * 1000))
+                raise
+            self.success(host, size, time.time() - started)
+            return digest, size
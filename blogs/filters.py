@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 from blogs.models import Post
+from blogs.search import get_search_backend
+from rest_framework.filters import SearchFilter
 import django_filters
 
 
@@ -9,3 +11,17 @@ class PostFilter(django_filters.FilterSet):
     class Meta:
         model = Post
         fields = ['category']
+
+
+class IndexedSearchFilter(SearchFilter):
+
+    def filter_queryset(self, request, queryset, view):
+        """
+        Searches through the configured search backend, falling back to DRF's LIKE lookups if it has no index for
+        the queryset model
+        """
+        search_terms = self.get_search_terms(request)
+        backend = get_search_backend()
+        if not search_terms or not backend.supports(queryset.model):
+            return super(IndexedSearchFilter, self).filter_queryset(request, queryset, view)
+        return backend.search(queryset, search_terms)
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from PIL import Image
+
+from blogs.fetcher import ImageTooLarge
+from blogs.placeholders import placeholder_from_image
+from blogs.settings import (
+    IMAGE_FORMATS, IMAGE_MAX_BYTES, IMAGE_MAX_DECODE_BYTES, IMAGE_MAX_PIXELS, IMAGE_QUALITY, IMAGE_RENDITIONS,
+    IMAGE_RESIZE_DIR, IMAGE_STORE_DIR, PLACEHOLDER_COMPONENTS
+)
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+# the image_url of the posts processed before images were content addressed: MEDIA_URL<pk>-thumbnail.<ext>, or
+# MEDIA_URL<pk>.<ext> if the thumbnail was never written. The original is MEDIA_ROOT/<pk>.<ext>
+LEGACY_IMAGE = re.compile(r'^([0-9]+)(?:-thumbnail)?\.([A-Za-z0-9]{1,10})$')
+
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp'}
+SAVE_OPTIONS = {
+    'JPEG': {'optimize': True, 'progressive': True},
+    'WEBP': {'method': 4},
+}
+
+
+def available_formats():
+    """
+    Returns the configured rendition formats this Pillow build can encode (WebP needs libwebp)
+    """
+    Image.init()
+    return [image_format for image_format in IMAGE_FORMATS if image_format in Image.SAVE]
+
+
+def blob_path(digest, suffix=''):
+    """
+    Returns the path, relative to MEDIA_ROOT, of a content addressed file: images/<2 digest chars>/<digest><suffix>
+    """
+    return '{0}/{1}/{2}{3}'.format(IMAGE_STORE_DIR, digest[:2], digest, suffix)
+
+
+def renditions_version():
+    """
+    Returns a short hash of the settings renditions depend on: images stored with another version need reprocessing
+    """
+    return hashlib.md5(repr((
+        sorted((name, tuple(size)) for name, size in IMAGE_RENDITIONS), available_formats(), IMAGE_QUALITY,
+        tuple(PLACEHOLDER_COMPONENTS)
+    )).encode('utf-8')).hexdigest()[:12]
+
+
+def rendition_url(basename):
+    return settings.BASE_URL + settings.MEDIA_URL + basename
+
+
+def fit(image, size):
+    """
+    Returns the image resized to fit in size, keeping its aspect ratio like Image.thumbnail (without upscaling), but
+    as a new image instead of resizing a copy in place
+    """
+    x, y = image.size
+    if x > size[0]:
+        y, x = int(max(y * size[0] / x, 1)), int(size[0])
+    if y > size[1]:
+        x, y = int(max(x * size[1] / y, 1)), int(size[1])
+    return image if (x, y) == image.size else image.resize((x, y), Image.LANCZOS)
+
+
+def image_bytes(image):
+    """
+    Returns the bytes of the decoded image in memory: Pillow stores 1 byte per pixel for bilevel, greyscale and
+    palette images and (at most) 4 for the other modes
+    """
+    return image.width * image.height * (1 if image.mode in ('1', 'L', 'P') else 4)
+
+
+def open_bounded(source_path, size, max_pixels=IMAGE_MAX_PIXELS, max_decode_bytes=IMAGE_MAX_DECODE_BYTES,
+                 max_bytes=IMAGE_MAX_BYTES, report=None):
+    """
+    Opens and decodes the image no larger than needed to produce size. Limits are checked on the file and on the
+    header before decoding: JPEGs are decoded at the smallest 1/2, 1/4 or 1/8 scale still covering size (draft mode),
+    so only the pixels left to decode count against max_decode_bytes. The source and decoded sizes are added to the
+    report dict if one is given
+    """
+    if os.path.getsize(source_path) > max_bytes:
+        raise ImageTooLarge('{0} is larger than {1} bytes'.format(source_path, max_bytes))
+    image = Image.open(source_path)
+    width, height = image.size
+    if width * height > max_pixels:
+        raise ImageTooLarge('{0} has more than {1} pixels ({2}x{3})'.format(source_path, max_pixels, width, height))
+    image.draft('RGB', size)  # only JPEG supports it, other formats ignore it
+    if image.size[0] * image.size[1] * 4 > max_decode_bytes:  # Pillow stores 4 bytes per RGB(A) pixel
+        raise ImageTooLarge('{0} needs more than {1} bytes to be decoded ({2}x{3})'.format(
+            source_path, max_decode_bytes, image.size[0], image.size[1]
+        ))
+    image.load()
+    if report is not None:
+        report.update(source_size=(width, height), decoded_size=image.size)
+    return image
+
+
+def save_image(image, path, image_format):
+    """
+    Writes the image to a temporary file next to path and renames it, so readers (and concurrent writers) of path
+    never see it half written: they get either the previous file or the new one
+    """
+    fd, temp_filename = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            image.save(f, image_format, quality=IMAGE_QUALITY, **SAVE_OPTIONS[image_format])
+        os.chmod(temp_filename, 0o644)  # mkstemp creates files only their owner can read
+        os.rename(temp_filename, path)
+    except Exception:
+        os.remove(temp_filename)
+        raise
+
+
+def build_renditions(source_path, prefix, renditions=None, formats=None, report=None):
+    """
+    Decodes the source image once, with bounded memory (see open_bounded), and writes every rendition in every
+    format to MEDIA_ROOT as <prefix>-<rendition>.<ext>, replacing the existing ones atomically (see save_image).
+    Renditions are resized from the next larger one instead of the source, and the ones that would not be smaller
+    than it (the source is never upscaled) share its files.
+    Returns the manifest: {rendition: {'width': w, 'height': h, 'jpeg': url, 'webp': url}}. The source and decoded
+    sizes, the BlurHash placeholder (computed from the smallest rendition) and the peak bytes of the decoded images
+    held at once (the memory of this job, unlike the process peak RSS) are added to the report dict if one is given
+    """
+    renditions = sorted(
+        renditions or IMAGE_RENDITIONS, key=lambda rendition: rendition[1][0] * rendition[1][1], reverse=True
+    )
+    formats = formats or available_formats()
+    image = open_bounded(source_path, renditions[0][1], report=report)
+    peak_bytes = image_bytes(image)
+    if image.mode != 'RGB':
+        converted = image.convert('RGB')  # JPEG has no alpha channel nor palette
+        peak_bytes += image_bytes(converted)
+        image = converted
+
+    manifest = {}
+    previous_name = None
+    for name, size in renditions:
+        resized = fit(image, size)
+        if resized is not image:
+            peak_bytes = max(peak_bytes, image_bytes(image) + image_bytes(resized))
+        image = resized  # the next rendition is resized from this one, the larger image can be freed
+        if previous_name is not None and resized.size == (manifest[previous_name]['width'],
+                                                          manifest[previous_name]['height']):
+            manifest[name] = manifest[previous_name]
+            continue
+
+        manifest[name] = {'width': resized.width, 'height': resized.height}
+        for image_format in formats:
+            basename = '{0}-{1}.{2}'.format(prefix, name, EXTENSIONS[image_format])
+            save_image(resized, os.path.join(settings.MEDIA_ROOT, basename), image_format)
+            manifest[name][image_format.lower()] = rendition_url(basename)
+        previous_name = name
+    if report is not None:
+        report.update(placeholder=placeholder_from_image(image), peak_bytes=peak_bytes)
+    return manifest
+
+
+def get_srcset(manifest, image_format='jpeg'):
+    """
+    Returns the srcset attribute value ("<url> <width>w, ...") of the given format's renditions
+    """
+    candidates = {}
+    for rendition in manifest.values():
+        if image_format in rendition:
+            candidates[rendition['width']] = rendition[image_format]
+    return ', '.join('{0} {1}w'.format(url, width) for width, url in sorted(candidates.items()))
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Holds an exclusive lock on path + '.lock', so concurrent requests for the same rendition resize it only once:
+    a flock shared by every process of the host, or a lock of this process where fcntl is not available
+    """
+    if fcntl is None:
+        with _locks_lock:
+            lock = _locks.setdefault(path, threading.Lock())
+        with lock:
+            yield
+        return
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def resized_path(name, width, height, image_format):
+    """
+    Returns the path, relative to MEDIA_ROOT, where the on the fly rendition of a media file is cached
+    """
+    return '{0}/{1}x{2}/{3}.{4}'.format(IMAGE_RESIZE_DIR, width, height, name, EXTENSIONS[image_format])
+
+
+def get_resized_image(name, width, height, image_format):
+    """
+    Returns the absolute path of the media file name resized to fit in width x height, resizing it on first use (or
+    when the source changes). The rendition is never read half written (see save_image), and requests waiting for the same rendition find it done when they get the lock
+    """
+    source = os.path.join(settings.MEDIA_ROOT, name)
+    target = os.path.join(settings.MEDIA_ROOT, resized_path(name, width, height, image_format))
+
+    def is_fresh():
+        return os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source)
+
+    if is_fresh():
+        return target
+    if not os.path.isdir(os.path.dirname(target)):
+        try:
+            os.makedirs(os.path.dirname(target))
+        except OSError:  # created by a concurrent request
+            pass
+    with file_lock(target):
+        if is_fresh():
+            return target
+        image = open_bounded(source, (width, height))
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        save_image(fit(image, (width, height)), target, image_format)
+    return target
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import io
+import shutil
+import tempfile
+import threading
+import time
+
+import requests
+from blogs.images import build_renditions
+from blogs.fetcher import HostGuard, download_image, get_http_session
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.utils.six.moves import BaseHTTPServer, socketserver
+from PIL import Image
+
+
+class ImageServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Local stand-in for the remote image hosts: serves the same JPEG on every path, with keep-alive
+    """
+    daemon_threads = True
+
+    def __init__(self, image, delay=0):
+        self.image = image
+        self.delay = delay  # seconds before the body is sent, to stand in for a slow host
+        self.requests = 0
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), ImageRequestHandler)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}/'.format(self.server_address[1])
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+class ImageRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # headers and body are written separately
+
+    def do_GET(self):
+        self.server.requests += 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(self.server.image)))
+        self.end_headers()
+        time.sleep(self.server.delay)
+        self.wfile.write(self.server.image)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_jpeg(width, height):
+    output = io.BytesIO()
+    Image.new('RGB', (width, height), (120, 60, 30)).save(output, 'JPEG', quality=90)
+    return output.getvalue()
+
+
+class Command(BaseCommand):
+    help = 'Measures the images per second a worker downloads (and resizes) from a local stand-in HTTP server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=50)
+        parser.add_argument('--size', default='1600x1200', help='WIDTHxHEIGHT of the served image')
+        parser.add_argument('--chunk-size', type=int, default=None, help='bytes per read and write')
+        parser.add_argument('--session-per-image', action='store_true', help='opens a new connection per image')
+        parser.add_argument('--download-only', action='store_true', help='skips the renditions')
+        parser.add_argument(
+            '--slow-every', type=int, default=0, help='sends every Nth image to a hanging host, through the host guard'
+        )
+        parser.add_argument('--read-timeout', type=float, default=2, help='seconds, for the hanging host downloads')
+
+    def handle(self, *args, **options):
+        try:
+            width, height = [int(value) for value in options['size'].split('x')]
+        except ValueError:
+            raise CommandError('--size must be WIDTHxHEIGHT')
+
+        server = ImageServer(make_jpeg(width, height)).start()
+        slow_server = ImageServer(server.image, delay=3600).start()
+        guard = HostGuard(cache=LocMemCache('benchmark-image-hosts', {}))  # keeps the real host stats clean
+        media_root = tempfile.mkdtemp()
+        download_kwargs = {'chunk_size': options['chunk_size']} if options['chunk_size'] else {}
+        skipped = 0
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                start = time.time()
+                for i in range(options['images']):
+                    session = requests.Session() if options['session_per_image'] else get_http_session()
+                    filename = '{0}/{1}.jpg'.format(media_root, i)
+                    if options['slow_every'] and i % options['slow_every'] == 0:
+                        try:
+                            guard.fetch(session, '{0}{1}.jpg'.format(slow_server.url, i), filename, timeout=(
+                                options['read_timeout'], options['read_timeout']
+                            ))
+                        except (requests.RequestException, IOError):
+                            skipped += 1  # a worker queues it again and moves on
+                            continue
+                    else:
+                        download_image(session, '{0}{1}.jpg'.format(server.url, i), filename, **download_kwargs)
+                    if not options['download_only']:
+                        build_renditions(filename, i)
+                    if options['session_per_image']:
+                        session.close()
+                elapsed = time.time() - start
+        finally:
+            for image_server in (server, slow_server):
+                image_server.shutdown()
+                image_server.server_close()
+            shutil.rmtree(media_root)
+
+        processed = options['images'] - skipped
+        self.stdout.write(self.style.SUCCESS('{0} images ({1} KB) in {2:.2f}s: {3:.1f} images/s{4}'.format(
+            processed, len(server.image) // 1024, elapsed, processed / elapsed,
+            ', {0} from the hanging host skipped'.format(skipped) if skipped else ''
+        )))
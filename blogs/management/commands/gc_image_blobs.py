@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import glob
+import os
+from datetime import timedelta
+
+from blogs.images import blob_path
+from blogs.models import ImageBlob
+from blogs.settings import IMAGE_BLOB_GC_GRACE
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = 'Removes the stored images (originals and renditions) that no post uses anymore'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace', type=int, default=IMAGE_BLOB_GC_GRACE,
+            help='seconds an image is kept after it was stored or its URL was last fetched, so workers still assigning '
+                 'it do not lose it'
+        )
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(seconds=options['grace'])
+        unused = ImageBlob.objects.filter(refcount=0, posts__isnull=True, created_at__lt=since).exclude(
+            remote_images__fetched_at__gte=since
+        )
+        removed = freed = 0
+        for digest in list(unused.values_list('pk', flat=True)):
+            if not options['dry_run']:
+                with transaction.atomic():
+                    # locked and checked again: a worker may have reused it since it was listed
+                    if ImageBlob.objects.select_for_update().filter(pk=digest).first() is None or \
+                            not unused.filter(pk=digest).exists():
+                        continue
+                    ImageBlob.objects.filter(pk=digest).delete()
+            for filename in glob.glob(os.path.join(settings.MEDIA_ROOT, blob_path(digest, '*'))):
+                freed += os.path.getsize(filename)
+                if not options['dry_run']:
+                    os.remove(filename)
+            removed += 1
+
+        self.stdout.write(self.style.SUCCESS('{0} {1} unused images ({2} KB)'.format(
+            'Would remove' if options['dry_run'] else 'Removed', removed, freed // 1024
+        )))
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from blogs.fetcher import HostGuard
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Shows the latency and failures of the image hosts and which ones are being skipped'
+
+    def handle(self, *args, **options):
+        stats = HostGuard().stats()
+        if not stats:
+            self.stdout.write('No image has been downloaded yet')
+        for host, host_stats in stats.items():
+            self.stdout.write(
+                '{host}: {requests} requests, {failures} failures, {rejected} rejected, {avg_ms} ms avg, '
+                '{kb} KB{circuit}'.format(
+                    host=host, kb=host_stats['bytes'] // 1024,
+                    circuit=' (circuit open)' if host_stats['circuit_open'] else '', **host_stats
+                )
+            )
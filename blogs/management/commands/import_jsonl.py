@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import time
+
+from blogs.bulk import BulkInserter, insert_posts
+from blogs.cache import blog_scope, bump_fragment_versions
+from blogs.checkpoint import read_checkpoint, write_checkpoint
+from blogs.models import IMAGE_DOWNLOADS_ENABLED, Blog, Category, Post
+from blogs.search import get_search_backend
+from blogs.tasks import backfill_post_images
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils import six
+from django.utils.dateparse import parse_datetime
+
+
+class LineError(ValueError):
+    pass
+
+
+class Command(BaseCommand):
+    help = """Imports users (with their blog), categories and posts from a JSON lines file, one object per line:
+    {"type": "user", "username": "...", "email": "...", "first_name": "...", "last_name": "...",
+     "password": "<Django password hash>", "blog": {"name": "...", "description": "..."}}
+    {"type": "category", "name": "..."}
+    {"type": "post", "blog": "<owner username>", "title": "...", "intro": "...", "body": "...",
+     "image_url": "...", "publish_date": "<ISO 8601>", "categories": ["...", ...]}
+    Users must come before their posts. The file is streamed and imported in chunks of lines, each one in a
+    transaction, and an interrupted import can be resumed after the last imported chunk"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='lines imported per transaction')
+        parser.add_argument('--batch-size', type=int, default=1000, help='rows per INSERT')
+        parser.add_argument('--checkpoint', help='progress file, PATH.checkpoint by default')
+        parser.add_argument('--resume', action='store_true', help='continue after the checkpoint offset')
+        parser.add_argument('--offset', type=int, default=0, help='byte offset of the first line to import')
+        parser.add_argument('--no-images', action='store_true', help='do not queue the image downloads')
+
+    def handle(self, *args, **options):
+        checkpoint_path = options['checkpoint'] or options['path'] + '.checkpoint'
+        checkpoint = (read_checkpoint(checkpoint_path) if options['resume'] else None) or {}
+        offset = checkpoint.get('offset', options['offset'])
+        first_post_pk = checkpoint.get('first_post_pk')
+        try:
+            size = os.path.getsize(options['path'])
+        except OSError as exc:
+            raise CommandError(exc)
+
+        self.batch_size = options['batch_size']
+        self.blogs = {}  # owner username: blog pk, loaded as posts need them
+        self.categories = set(Category.objects.values_list('pk', flat=True))
+        self.touched_categories = set()
+        self.totals = dict(users=0, posts=0, links=0, errors=0)
+        started = time.time()
+        with open(options['path'], 'rb') as f:
+            f.seek(offset)
+            chunk = []
+            while True:
+                line = f.readline()
+                if line.strip():
+                    chunk.append((offset, line))
+                offset += len(line)
+                if chunk and (len(chunk) == options['chunk_size'] or not line):
+                    post_pks = self.import_chunk(chunk)
+                    if post_pks and first_post_pk is None:
+                        first_post_pk = min(post_pks)
+                    # written once the chunk is committed: a failure before resumes from the chunk's first line
+                    write_checkpoint(checkpoint_path, {'offset': offset, 'first_post_pk': first_post_pk})
+                    chunk = []
+                    elapsed = time.time() - started
+                    self.stdout.write('{0}/{1} bytes, {2} users, {3} posts ({4:.0f} posts/s), {5} errors'.format(
+                        offset, size, self.totals['users'], self.totals['posts'],
+                        self.totals['posts'] / elapsed if elapsed else 0, self.totals['errors']
+                    ))
+                if not line:
+                    break
+
+        Category.update_counters(self.touched_categories)
+        if first_post_pk is not None and IMAGE_DOWNLOADS_ENABLED and not options['no_images']:
+            backfill_post_images.delay(first_post_pk)  # a single task queues the downloads in batches
+            self.stdout.write('Image downloads queued for the posts from #{0}'.format(first_post_pk))
+        if os.path.exists(checkpoint_path):  # only written after a chunk with lines
+            os.remove(checkpoint_path)
+        self.stdout.write(self.style.SUCCESS('Imported {users} users, {posts} posts and {links} post categories, '
+                                             '{errors} lines with errors'.format(**self.totals)))
+
+    def error(self, offset, message):
+        self.totals['errors'] += 1
+        self.stderr.write('Line at byte {0}: {1}'.format(offset, message))
+
+    def parse(self, chunk):
+        """
+        Returns the users, categories and posts of the chunk's lines, as (offset, object) lists
+        """
+        users, categories, posts = [], [], []
+        for offset, line in chunk:
+            try:
+                data = json.loads(line.decode('utf-8'))
+                kind = data.get('type')
+                if kind == 'user':
+                    users.append((offset, data))
+                elif kind == 'category':
+                    categories.append((offset, data['name'][:250]))
+                elif kind == 'post':
+                    posts.append((offset, data))
+                else:
+                    raise LineError('unknown type {0!r}'.format(kind))
+            except (ValueError, KeyError, TypeError, AttributeError) as exc:
+                self.error(offset, exc)
+        return users, categories, posts
+
+    def build_user(self, data):
+        blog = data.get('blog') or {}
+        user = User(
+            username=data['username'], email=data.get('email', ''), first_name=data.get('first_name', ''),
+            last_name=data.get('last_name', ''), password=data.get('password') or make_password(None)
+        )
+        return user, Blog(
+            owner=user, name=blog.get('name') or '{0}\'s blog'.format(user.username),
+            description=blog.get('description', '')
+        )
+
+    def build_post(self, data, now):
+        publish_date = parse_datetime(data['publish_date']) if data.get('publish_date') else now
+        if publish_date is None:
+            raise LineError('invalid publish_date {0!r}'.format(data['publish_date']))
+        if timezone.is_naive(publish_date):
+            publish_date = timezone.make_aware(publish_date)
+        categories = [name[:250] for name in data.get('categories') or []]
+        return Post(
+            title=data['title'][:250], intro=data.get('intro', ''), body=data.get('body', ''),
+            image_url=data.get('image_url') or None, publish_date=publish_date, is_published=publish_date <= now
+        ), categories
+
+    def import_chunk(self, chunk):
+        """
+        Imports the chunk's lines in one transaction. Returns the pks of the posts imported
+        """
+        users, categories, posts = self.parse(chunk)
+        now = timezone.now()
+        with transaction.atomic():
+            inserter = BulkInserter(self.batch_size)
+            existing = set(User.objects.filter(
+                username__in=[data.get('username') for offset, data in users]
+            ).values_list('username', flat=True))
+            new_users = []
+            for offset, data in users:
+                try:
+                    if data['username'] in existing:
+                        raise LineError('user {0} already exists'.format(data['username']))
+                    new_users.append(self.build_user(data))
+                    existing.add(data['username'])
+                except (ValueError, KeyError, TypeError, AttributeError) as exc:
+                    self.error(offset, exc)
+            inserter.insert(User, [user for user, blog in new_users])
+            for user, blog in new_users:
+                blog.owner = user  # sets the owner_id assigned on insert
+            inserter.insert(Blog, [blog for user, blog in new_users])
+            self.blogs.update((user.username, blog.pk) for user, blog in new_users)
+
+            missing = set(
+                data.get('blog') for offset, data in posts if isinstance(data.get('blog'), six.string_types)
+            ) - set(self.blogs)
+            if missing:
+                self.blogs.update(Blog.objects.filter(owner__username__in=missing).values_list('owner__username', 'pk'))
+            new_posts = []
+            for offset, data in posts:
+                try:
+                    if data.get('blog') not in self.blogs:
+                        raise LineError('unknown blog {0!r}'.format(data.get('blog')))
+                    post, post_categories = self.build_post(data, now)
+                    post.blog_id = self.blogs[data['blog']]
+                    new_posts.append((post, post_categories))
+                except (ValueError, KeyError, TypeError, AttributeError) as exc:
+                    self.error(offset, exc)
+
+            names = set(name for offset, name in categories)
+            names.update(name for post, post_categories in new_posts for name in post_categories)
+            Category.objects.bulk_create([Category(name=name) for name in sorted(names - self.categories)])
+            self.categories.update(names)
+            self.touched_categories.update(name for post, post_categories in new_posts for name in post_categories)
+
+            self.totals['links'] += insert_posts(inserter, new_posts)
+            inserter.reset_sequences()
+            blog_pks = set(post.blog_id for post, post_categories in new_posts)
+            Blog.update_counters(blog_pks | set(blog.pk for user, blog in new_users))
+            backend = get_search_backend()
+            if new_posts:
+                backend.index_posts([post for post, post_categories in new_posts])
+            for user, blog in new_users:
+                backend.index_blog(blog)
+            if blog_pks:
+                transaction.on_commit(lambda: bump_fragment_versions('posts', *[blog_scope(pk) for pk in blog_pks]))
+        self.totals['users'] += len(new_users)
+        self.totals['posts'] += len(new_posts)
+        return [post.pk for post, post_categories in new_posts]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from blogs.models import Blog, Category, Post
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+CHUNK_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the denormalized post counters of every blog and category'
+
+    def rebuild(self, model):
+        pks = []
+        for pk in model.objects.order_by('pk').values_list('pk', flat=True).iterator():
+            pks.append(pk)
+            if len(pks) == CHUNK_SIZE:
+                with transaction.atomic():
+                    model.update_counters(pks)
+                pks = []
+        with transaction.atomic():
+            model.update_counters(pks)
+
+    def handle(self, *args, **options):
+        now = timezone.now()  # counters count the published flag, fix it first for posts updated without save()
+        Post.objects.filter(is_published=True, publish_date__gt=now).update(is_published=False)
+        Post.objects.filter(is_published=False, publish_date__lte=now).update(is_published=True)
+        self.rebuild(Blog)
+        self.rebuild(Category)
+        self.stdout.write(self.style.SUCCESS('Post counters rebuilt'))
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+from blogs.search import get_search_backend
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the posts and blogs search index from the database'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        backend.rebuild()
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt with {0}'.format(backend.__class__.__name__)))
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import time
+
+import django
+from blogs.cache import blog_scope, bump_fragment_versions
+from blogs.checkpoint import read_checkpoint, write_checkpoint
+from blogs.images import LEGACY_IMAGE, blob_path, build_renditions, renditions_version
+from blogs.models import Blog, ImageBlob, Post
+from blogs.settings import IMAGE_STORE_DIR
+from blogs.tasks import get_blob_post_fields
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+
+def setup_worker():
+    if not apps.ready:  # spawned (not forked) workers start without Django
+        django.setup()
+
+
+def reprocess_blob(blob):
+    """
+    Rebuilds the renditions and placeholder of a stored image from its original. Runs in the worker processes, so it
+    does not touch the database: returns (digest, renditions JSON, placeholder, error)
+    """
+    digest, extension = blob
+    report = {}
+    try:
+        renditions = build_renditions(
+            os.path.join(settings.MEDIA_ROOT, blob_path(digest, '.' + extension)), blob_path(digest), report=report
+        )
+    except (IOError, ValueError) as exc:
+        return digest, None, None, str(exc)
+    return digest, json.dumps(renditions), report['placeholder'], None
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the renditions and placeholders of the stored images made with other rendition settings, ' \
+           'storing first the images of the posts processed before the image store existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=100, help='images loaded and saved at a time')
+        parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(), help='resizing processes')
+        parser.add_argument(
+            '--checkpoint', default=os.path.join(settings.MEDIA_ROOT, IMAGE_STORE_DIR, 'reprocess.checkpoint'),
+            help='file where the last processed image is saved, so an interrupted run resumes after it'
+        )
+        parser.add_argument('--reset', action='store_true', help='ignore the checkpoint and start over')
+
+    def handle(self, *args, **options):
+        version = renditions_version()
+        ingested, ingest_errors = self.ingest_legacy_images(options['chunk_size'], version)
+        self.stdout.write('{0} legacy images stored, {1} errors'.format(ingested, ingest_errors))
+        checkpoint = None if options['reset'] or ingested else read_checkpoint(options['checkpoint'])
+        last = checkpoint['last'] if checkpoint and checkpoint.get('version') == version else None  # else start over
+        pending = ImageBlob.objects.exclude(renditions_version=version)
+        total = (pending.filter(digest__gt=last) if last else pending).count()
+        self.stdout.write('{0} images to reprocess to version {1}{2}'.format(
+            total, version, ' (resuming after {0})'.format(last) if last else ''
+        ))
+
+        pool = None
+        if options['workers'] > 1:
+            connection.close()  # forked workers must not share the parent's database connection
+            pool = multiprocessing.Pool(options['workers'], initializer=setup_worker)
+        started, done, errors = time.time(), 0, 0
+        try:
+            while True:
+                chunk = list((pending.filter(digest__gt=last) if last else pending).order_by('digest').values_list(
+                    'digest', 'extension'
+                )[:options['chunk_size']])
+                if not chunk:
+                    break
+                results = pool.imap_unordered(reprocess_blob, chunk) if pool else map(reprocess_blob, chunk)
+                blog_pks = set()
+                for digest, renditions, placeholder, error in results:
+                    if error:
+                        errors += 1
+                        self.stderr.write('{0}: {1}'.format(digest, error))
+                        continue
+                    blog_pks.update(self.save_blob(digest, renditions, placeholder, version))
+                if blog_pks:  # blog responses list the post images too
+                    Blog.objects.filter(pk__in=blog_pks).update(modified_at=timezone.now())
+                    bump_fragment_versions('posts', *[blog_scope(pk) for pk in blog_pks])
+
+                last = chunk[-1][0]
+                done += len(chunk)
+                write_checkpoint(options['checkpoint'], {'version': version, 'last': last})
+                elapsed = time.time() - started
+                self.stdout.write('{0}/{1} images, {2:.1f} images/s, {3} errors'.format(
+                    done, total, done / elapsed if elapsed else 0, errors
+                ))
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+        self.stdout.write(self.style.SUCCESS('Reprocessed {0} images, {1} errors'.format(done - errors, errors)))
+
+    def ingest_legacy_images(self, chunk_size, version):
+        """
+        Stores the originals of the posts still pointing to a legacy thumbnail (see LEGACY_IMAGE) as ImageBlobs
+        without renditions, which the reprocessing then builds like any other outdated image. The legacy files are
+        copied, not moved, since their URLs may still be linked. Returns the number of (images stored, errors)
+        """
+        prefix = settings.BASE_URL + settings.MEDIA_URL
+        posts = Post.objects.filter(image_blob__isnull=True, image_url__startswith=prefix)
+        last_pk, ingested, errors, digests, blog_pks = 0, 0, 0, set(), set()
+        while True:
+            chunk = list(posts.filter(pk__gt=last_pk).order_by('pk').values_list(
+                'pk', 'blog', 'image_url'
+            )[:chunk_size])
+            if not chunk:
+                break
+            last_pk = chunk[-1][0]
+            for pk, blog_pk, image_url in chunk:
+                match = LEGACY_IMAGE.match(image_url[len(prefix):])
+                if match is None:
+                    continue
+                try:
+                    blob = self.store_legacy_image('{0}.{1}'.format(*match.groups()), match.group(2).lower())
+                except (IOError, OSError) as exc:
+                    errors += 1
+                    self.stderr.write('Post {0}: {1}'.format(pk, exc))
+                    continue
+                if blob.renditions_version == version:  # the same bytes were already stored and processed
+                    Post.objects.filter(pk=pk).update(image_blob=blob, **get_blob_post_fields(blob))
+                    blog_pks.add(blog_pk)
+                else:  # its posts are updated once the renditions are built, see save_blob
+                    Post.objects.filter(pk=pk).update(image_blob=blob)
+                digests.add(blob.pk)
+                ingested += 1
+        ImageBlob.update_refcounts(digests)
+        if blog_pks:
+            Blog.objects.filter(pk__in=blog_pks).update(modified_at=timezone.now())
+            bump_fragment_versions('posts', *[blog_scope(pk) for pk in blog_pks])
+        return ingested, errors
+
+    def store_legacy_image(self, name, extension):
+        """
+        Returns the ImageBlob of the legacy media file name, copying it to the image store if its bytes are new
+        """
+        source = os.path.join(settings.MEDIA_ROOT, name)
+        digest = hashlib.sha256()
+        with open(source, 'rb') as f:
+            for data in iter(lambda: f.read(64 * 1024), b''):
+                digest.update(data)
+        digest = digest.hexdigest()
+        blob = ImageBlob.objects.filter(pk=digest).first()
+        if blob is None:
+            original = os.path.join(settings.MEDIA_ROOT, blob_path(digest, '.' + extension))
+            if not os.path.isdir(os.path.dirname(original)):
+                os.makedirs(os.path.dirname(original))
+            shutil.copyfile(source, original)
+            blob = ImageBlob.objects.get_or_create(
+                digest=digest, defaults={'extension': extension, 'size': os.path.getsize(source)}
+            )[0]
+        return blob
+
+    def save_blob(self, digest, renditions, placeholder, version):
+        """
+        Saves the new renditions to the image and the posts using it. Returns the pks of their blogs
+        """
+        with transaction.atomic():
+            ImageBlob.objects.filter(pk=digest).update(
+                renditions=renditions, placeholder=placeholder, renditions_version=version
+            )
+            blob = ImageBlob.objects.get(pk=digest)
+            posts = Post.objects.filter(image_blob=blob)
+            blog_pks = set(posts.values_list('blog', flat=True))
+            posts.update(**get_blob_post_fields(blob))
+        return blog_pks
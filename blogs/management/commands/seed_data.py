@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import time
+
+from blogs.bulk import Seeder
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Fills the database with synthetic users, blogs, posts and categories for performance work'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--blogs', type=int, default=1000, help='users to create, with one blog each')
+        parser.add_argument('--posts', type=int, default=100000, help='posts to create among the blogs')
+        parser.add_argument('--seed', type=int, default=0, help='the same seed generates the same data')
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--batch-size', type=int, default=1000, help='rows per INSERT and per transaction')
+        parser.add_argument('--scheduled-ratio', type=float, default=0.05, help='fraction of future dated posts')
+        parser.add_argument('--image-ratio', type=float, default=0.0, help='fraction of posts with a remote image_url')
+        parser.add_argument('--prefix', default='seed', help='username prefix of the created users')
+        parser.add_argument('--password', default='wordplease', help='password of the created users')
+        parser.add_argument('--skip-index', action='store_true', help='do not rebuild the search index afterwards')
+
+    def handle(self, *args, **options):
+        if options['blogs'] < 1:
+            raise CommandError('--blogs must be at least 1')
+        if User.objects.filter(username='{0}0'.format(options['prefix'])).exists():
+            raise CommandError('Users prefixed "{0}" already exist, use another --prefix'.format(options['prefix']))
+
+        seeder = Seeder(
+            seed=options['seed'], categories=options['categories'], batch_size=options['batch_size'],
+            scheduled_ratio=options['scheduled_ratio'], image_ratio=options['image_ratio'], prefix=options['prefix'],
+            password=options['password']
+        )
+        started = time.time()
+
+        def progress(inserted):
+            if inserted % (options['batch_size'] * 10) == 0 or inserted == options['posts']:
+                elapsed = time.time() - started
+                self.stdout.write('{0}/{1} posts, {2:.0f} posts/s'.format(
+                    inserted, options['posts'], inserted / elapsed if elapsed else 0
+                ))
+
+        users, posts, links = seeder.run(options['blogs'], options['posts'], progress)
+        call_command('rebuild_post_counters', stdout=self.stdout)
+        if not options['skip_index']:
+            call_command('rebuild_search_index', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS('Created {0} blogs, {1} posts and {2} post categories in {3:.1f}s'.format(
+            users, posts, links, time.time() - started
+        )))
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from blogs.settings import SITEMAP_CHUNK_SIZE
+from blogs.sitemaps import BlogSitemap, PostSitemap, get_sitemap_dir, update_sitemaps
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Writes the sitemap files of the posts and blogs changed since the last run and the sitemap index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', help='scheme and host of the URLs, settings.BASE_URL by default')
+        parser.add_argument('--chunk-size', type=int, default=SITEMAP_CHUNK_SIZE, help='pks per sitemap file')
+        parser.add_argument('--full', action='store_true', help='write every file, e.g. after a username change')
+
+    def handle(self, *args, **options):
+        written, total = update_sitemaps(
+            base_url=options['base_url'], full=options['full'],
+            sections=(BlogSitemap(options['chunk_size']), PostSitemap(options['chunk_size']))
+        )
+        self.stdout.write(self.style.SUCCESS('{0} of {1} sitemap files written to {2}'.format(
+            written, total, get_sitemap_dir()
+        )))
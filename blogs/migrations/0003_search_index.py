@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('CREATE VIRTUAL TABLE blogs_post_search USING fts5(title, intro, body)')
+        cursor.execute('CREATE VIRTUAL TABLE blogs_blog_search USING fts5(name, description, username)')
+        # the SQL of blogs.search.populate_search_index when this migration was written, frozen here
+        cursor.execute(
+            'INSERT INTO blogs_post_search(rowid, title, intro, body) SELECT id, title, intro, body FROM blogs_post'
+        )
+        cursor.execute(
+            'INSERT INTO blogs_blog_search(rowid, name, description, username) '
+            'SELECT b.id, b.name, COALESCE(b.description, \'\'), u.username '
+            'FROM blogs_blog b INNER JOIN auth_user u ON u.id = b.owner_id'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS blogs_post_search')
+        cursor.execute('DROP TABLE IF EXISTS blogs_blog_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogs', '0002_auto_20161020_1013'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 11:51
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+from django.utils import timezone
+
+
+def populate_post_counters(apps, schema_editor):
+    Blog = apps.get_model('blogs', 'Blog')
+    Category = apps.get_model('blogs', 'Category')
+    Post = apps.get_model('blogs', 'Post')
+    now = timezone.now()
+
+    for row in Post.objects.values('blog').annotate(count=Count('id')):
+        Blog.objects.filter(pk=row['blog']).update(posts_count=row['count'])
+    for row in Post.objects.filter(publish_date__lte=now).values('blog').annotate(count=Count('id'), last=Max('publish_date')):
+        Blog.objects.filter(pk=row['blog']).update(published_posts_count=row['count'], last_published_at=row['last'])
+
+    categories = Post.categories.through.objects
+    for row in categories.values('category').annotate(count=Count('post')):
+        Category.objects.filter(pk=row['category']).update(posts_count=row['count'])
+    for row in categories.filter(post__publish_date__lte=now).values('category').annotate(count=Count('post')):
+        Category.objects.filter(pk=row['category']).update(published_posts_count=row['count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogs', '0004_timeline_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blog',
+            name='last_published_at',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='blog',
+            name='posts_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='blog',
+            name='published_posts_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='posts_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='published_posts_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_post_counters, migrations.RunPython.noop),
+    ]
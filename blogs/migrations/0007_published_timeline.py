@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 11:59
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def mark_published_posts(apps, schema_editor):
+    Post = apps.get_model('blogs', 'Post')
+    Post.objects.filter(publish_date__lte=timezone.now()).update(is_published=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogs', '0006_modified_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='is_published',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(mark_published_posts, migrations.RunPython.noop),
+        migrations.AlterIndexTogether(
+            name='post',
+            index_together=set([('blog', 'publish_date', 'id'), ('is_published', 'publish_date', 'id'), ('blog', 'is_published', 'publish_date', 'id'), ('publish_date', 'id')]),
+        ),
+    ]
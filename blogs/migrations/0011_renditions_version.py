@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 12:14
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogs', '0010_image_placeholders'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageblob',
+            name='renditions_version',
+            field=models.CharField(blank=True, default='', max_length=12),
+        ),
+    ]
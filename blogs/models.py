@@ -1,23 +1,46 @@
+import hashlib
+import json
 import sys
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import models, transaction
+from django.db.models import Count, Max
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete, m2m_changed
 from django.dispatch import receiver
 from django.utils import timezone
 
-from .tasks import download_resize_update_photo_image
+from .cache import blog_scope, bump_fragment_versions
+from .search import get_search_backend
+from .tasks import queue_image_download
 from .settings import DOWNLOAD_IMAGES
 
 
 class Category(models.Model):
 
     name = models.CharField(max_length=250, primary_key=True)
+    posts_count = models.PositiveIntegerField(default=0, editable=False)  # denormalized, see update_counters
+    published_posts_count = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         verbose_name_plural = "categories"
 
+    @classmethod
+    def update_counters(cls, pks):
+        """
+        Recomputes the denormalized post counters of the given categories
+        """
+        pks = list(pks)
+        if not pks:
+            return
+        posts = Post.categories.through.objects.filter(category__in=pks)
+        totals = dict(posts.values_list('category').annotate(Count('post')))
+        published = dict(posts.filter(post__is_published=True).values_list('category').annotate(
+            Count('post')
+        ))
+        for pk in pks:
+            cls.objects.filter(pk=pk).update(posts_count=totals.get(pk, 0), published_posts_count=published.get(pk, 0))
+
     def __unicode__(self):
         return self.name
 
@@ -27,6 +50,35 @@ class Blog(models.Model):
     name = models.CharField(max_length=250)
     description = models.CharField(max_length=250, blank=True, null=True, default="")
     created_at = models.DateTimeField(auto_now_add=True)
+    modified_at = models.DateTimeField(auto_now=True)  # also touched when its posts or owner change
+    # denormalized post counters, see update_counters
+    posts_count = models.PositiveIntegerField(default=0, editable=False)
+    published_posts_count = models.PositiveIntegerField(default=0, editable=False)
+    last_published_at = models.DateTimeField(blank=True, null=True, editable=False, db_index=True)
+
+    @classmethod
+    def update_counters(cls, pks):
+        """
+        Recomputes the denormalized post counters of the given blogs
+        """
+        pks = list(pks)
+        if not pks:
+            return
+        now = timezone.now()
+        posts = Post.objects.filter(blog__in=pks)
+        totals = dict(posts.values_list('blog').annotate(Count('id')))
+        published = {
+            row['blog']: row for row in posts.filter(is_published=True).values('blog').annotate(
+                count=Count('id'), last=Max('publish_date')
+            )
+        }
+        for pk in pks:
+            cls.objects.filter(pk=pk).update(
+                modified_at=now,
+                posts_count=totals.get(pk, 0),
+                published_posts_count=published.get(pk, {}).get('count', 0),
+                last_published_at=published.get(pk, {}).get('last')
+            )
 
     def get_absolute_url(self):
         """
@@ -39,15 +91,103 @@ class Blog(models.Model):
         return self.name
 
 
+class ImageBlob(models.Model):
+    """
+    Downloaded image stored by the SHA-256 of its bytes, with its renditions. Posts using the same image (even from
+    different URLs) share it
+    """
+    digest = models.CharField(max_length=64, primary_key=True)
+    extension = models.CharField(max_length=10)
+    size = models.PositiveIntegerField(default=0)  # bytes of the original
+    renditions = models.TextField(blank=True, default='')  # JSON manifest, see blogs.images
+    placeholder = models.CharField(max_length=100, blank=True, default='')  # BlurHash, see blogs.placeholders
+    renditions_version = models.CharField(max_length=12, blank=True, default='')  # see blogs.images
+    refcount = models.PositiveIntegerField(default=0, db_index=True)  # posts using it, see update_refcounts
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def update_refcounts(cls, digests):
+        """
+        Recomputes how many posts use the given blobs. Blobs left unused are removed by the gc_image_blobs command
+        """
+        digests = [digest for digest in set(digests) if digest]
+        if not digests:
+            return
+        counts = dict(Post.objects.filter(image_blob__in=digests).values_list('image_blob').annotate(Count('id')))
+        for digest in digests:
+            cls.objects.filter(pk=digest).update(refcount=counts.get(digest, 0))
+
+    def get_renditions(self):
+        return json.loads(self.renditions) if self.renditions else {}
+
+    def __unicode__(self):
+        return self.digest
+
+
+class RemoteImage(models.Model):
+    """
+    Index of the remote URLs already downloaded, so a repeated image_url is not downloaded again
+    """
+    url_hash = models.CharField(max_length=64, unique=True)  # image URLs may be longer than an indexable column
+    url = models.TextField()
+    blob = models.ForeignKey(ImageBlob, related_name='remote_images', on_delete=models.CASCADE)
+    fetched_at = models.DateTimeField(auto_now=True)
+
+    @staticmethod
+    def hash_url(url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def __unicode__(self):
+        return self.url
+
+
 class Post(models.Model):
     blog = models.ForeignKey(Blog, related_name="posts")  # Allows access to posts from Blogs.posts instead of Blogs.post_set
     title = models.CharField(max_length=250)
     intro = models.TextField(max_length=250)
     body = models.TextField()
     image_url = models.URLField(blank=True, null=True)
+    image_renditions = models.TextField(blank=True, default='', editable=False)  # JSON manifest, see blogs.images
+    image_placeholder = models.CharField(max_length=100, blank=True, default='', editable=False)  # BlurHash
+    image_blob = models.ForeignKey(
+        ImageBlob, blank=True, null=True, editable=False, related_name='posts', on_delete=models.SET_NULL
+    )
     publish_date = models.DateTimeField(default=timezone.now)  # Sets automatically the time to now, by let us to modify the value if we want
+    modified_at = models.DateTimeField(auto_now=True)
+    # materialized publish_date <= now: set on save and by the publish_scheduled_posts task when a scheduled post goes live
+    is_published = models.BooleanField(default=False, editable=False)
     categories = models.ManyToManyField(Category, related_name="posts")  # Allows access to posts from Category.posts instead of Blogs.category_set
 
+    class Meta:
+        index_together = (
+            ('publish_date', 'id'),  # global timeline keyset pagination
+            ('blog', 'publish_date', 'id'),  # blog timeline keyset pagination
+            ('is_published', 'publish_date', 'id'),  # published timeline
+            ('blog', 'is_published', 'publish_date', 'id'),  # published blog timeline
+        )
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remembers the loaded blog to update its counters too if the post is moved to another blog
+        """
+        instance = super(Post, cls).from_db(db, field_names, values)
+        instance._loaded_blog_id = instance.__dict__.get('blog_id')
+        instance._loaded_image_blob_id = instance.__dict__.get('image_blob_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        self.is_published = self.publish_date <= timezone.now()
+        if self.image_renditions and self.image_url != self.get_image_url():  # the image was replaced
+            self.image_renditions = self.image_placeholder = ''
+            self.image_blob = None
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'publish_date' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'is_published'}
+        super(Post, self).save(*args, **kwargs)
+        self._loaded_blog_id = self.blog_id  # post_save receivers have already seen the previous blog and image
+        self._loaded_image_blob_id = self.image_blob_id
+
     def get_absolute_url(self):
         """
         Returns the Post's absolute URL and shows a "Visit on site" button in admin's Post detail.
@@ -55,6 +195,18 @@ class Post(models.Model):
         """
         return reverse('post_detail', args=[self.blog.owner.username, self.pk])
 
+    def get_image_renditions(self):
+        """
+        Returns the manifest of the post image renditions, empty until the image has been downloaded and resized
+        """
+        return json.loads(self.image_renditions) if self.image_renditions else {}
+
+    def get_image_url(self, rendition='detail'):
+        """
+        Returns the JPEG URL of the given rendition, or the original image URL if it has not been processed yet
+        """
+        return self.get_image_renditions().get(rendition, {}).get('jpeg') or self.image_url
+
     def get_author(self):
         """
         Returns the Post's author throught the post blog's owner
@@ -65,11 +217,187 @@ class Post(models.Model):
         return self.title
 
 
+@receiver(post_save, sender=Post)
+def index_post_on_save(sender, instance, **kwargs):
+    get_search_backend().index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post_on_delete(sender, instance, **kwargs):
+    get_search_backend().remove_post(instance.pk)
+
+
+@receiver(post_save, sender=Blog)
+def index_blog_on_save(sender, instance, **kwargs):
+    get_search_backend().index_blog(instance)
+
+
+@receiver(post_delete, sender=Blog)
+def unindex_blog_on_delete(sender, instance, **kwargs):
+    get_search_backend().remove_blog(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def index_blog_on_owner_save(sender, instance, created, **kwargs):
+    """
+    Blogs are searchable by their owner's username, so it has to be reindexed when the user changes
+    """
+    if created:
+        return
+    try:
+        get_search_backend().index_blog(instance.blog)
+    except Blog.DoesNotExist:
+        pass
+
+
+@receiver(post_save, sender=Post)
+def update_counters_on_post_save(sender, instance, created, **kwargs):
+    with transaction.atomic():
+        Blog.update_counters({instance.blog_id, getattr(instance, '_loaded_blog_id', None)} - {None})
+        if not created:  # categories of a new post are counted when they are added
+            Category.update_counters(instance.categories.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Post)
+def remember_categories_on_post_delete(sender, instance, **kwargs):
+    instance._deleted_category_pks = list(instance.categories.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Post)
+def update_counters_on_post_delete(sender, instance, **kwargs):
+    with transaction.atomic():
+        Blog.update_counters([instance.blog_id])
+        Category.update_counters(getattr(instance, '_deleted_category_pks', []))
+
+
+@receiver(m2m_changed, sender=Post.categories.through)
+def update_counters_on_categories_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and not reverse:
+        instance._cleared_category_pks = list(instance.categories.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if reverse:
+            pks = [instance.pk]
+        elif action == 'post_clear':
+            pks = getattr(instance, '_cleared_category_pks', [])
+        else:
+            pks = pk_set
+        with transaction.atomic():
+            Category.update_counters(pks)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def update_image_refcounts_on_post_change(sender, instance, **kwargs):
+    ImageBlob.update_refcounts([instance.image_blob_id, getattr(instance, '_loaded_image_blob_id', None)])
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def bump_fragment_versions_on_post_change(sender, instance, **kwargs):
+    bump_fragment_versions(
+        'posts', blog_scope(instance.blog_id), blog_scope(getattr(instance, '_loaded_blog_id', None) or instance.blog_id)
+    )
+
+
+@receiver(post_save, sender=Blog)
+@receiver(post_delete, sender=Blog)
+def bump_fragment_versions_on_blog_change(sender, instance, **kwargs):
+    bump_fragment_versions('posts', blog_scope(instance.pk))
+
+
+@receiver(post_save, sender=User)
+def bump_fragment_versions_on_owner_change(sender, instance, created, **kwargs):
+    if not created:  # post lists link to blogs by their owner's username
+        bump_fragment_versions('posts', *[blog_scope(pk) for pk in Blog.objects.filter(owner=instance).values_list('pk', flat=True)])
+
+
+@receiver(pre_save, sender=User)
+def check_owner_username_change(sender, instance, update_fields=None, **kwargs):
+    """
+    Notes whether the username changes, see touch_blog_on_owner_save
+    """
+    instance._username_changed = instance.pk is not None and (update_fields is None or 'username' in update_fields) \
+        and User.objects.filter(pk=instance.pk).exclude(username=instance.username).exists()
+
+
+@receiver(post_save, sender=User)
+def touch_blog_on_owner_save(sender, instance, created, **kwargs):
+    """
+    Blogs are serialized with their owner's data, so their modified_at has to change with it. The URLs of the blog and
+    its posts include the username, so renaming the owner touches the posts too (the sitemaps describe them by it)
+    """
+    if not created:
+        now = timezone.now()
+        Blog.objects.filter(owner=instance).update(modified_at=now)
+        if getattr(instance, '_username_changed', False):
+            Post.objects.filter(blog__owner=instance).update(modified_at=now)
+
+
+@receiver(post_save, sender=Category)
+def bump_fragment_versions_on_category_save(sender, instance, **kwargs):
+    bump_fragment_versions('categories')
+
+
+@receiver(pre_delete, sender=Category)
+def bump_fragment_versions_on_category_delete(sender, instance, **kwargs):
+    """
+    Deleting a category removes its posts from the category filtered lists without sending m2m_changed
+    """
+    blog_pks = Post.objects.filter(categories=instance).values_list('blog', flat=True).distinct()
+    bump_fragment_versions('categories', 'posts', *[blog_scope(pk) for pk in blog_pks])
+
+
+@receiver(m2m_changed, sender=Post.categories.through)
+def touch_posts_on_categories_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Posts are serialized with their categories, so their modified_at (and their blogs', which describe the posts
+    list) has to change with them: the conditional GET validators are built from it
+    """
+    if action == 'pre_clear' and reverse:
+        instance._cleared_post_pks = list(instance.posts.values_list('pk', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        post_pks = [instance.pk]
+    elif action == 'post_clear':
+        post_pks = getattr(instance, '_cleared_post_pks', [])
+    else:
+        post_pks = pk_set
+    now = timezone.now()
+    posts = Post.objects.filter(pk__in=list(post_pks))
+    with transaction.atomic():
+        Blog.objects.filter(pk__in=list(posts.values_list('blog', flat=True).distinct())).update(modified_at=now)
+        posts.update(modified_at=now)
+
+
+@receiver(m2m_changed, sender=Post.categories.through)
+def bump_fragment_versions_on_categories_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        blog_pks = [instance.blog_id]
+    elif pk_set:
+        blog_pks = Post.objects.filter(pk__in=pk_set).values_list('blog', flat=True).distinct()
+    else:  # a category was cleared, its former posts are unknown
+        blog_pks = Blog.objects.values_list('pk', flat=True)
+    bump_fragment_versions('posts', *[blog_scope(pk) for pk in blog_pks])
+
+
 # avoids to set the signal if we are testing
-if settings.USE_CELERY and 'test' not in sys.argv and 'migrate' not in sys.argv and DOWNLOAD_IMAGES:
+IMAGE_DOWNLOADS_ENABLED = settings.USE_CELERY and 'test' not in sys.argv and 'migrate' not in sys.argv and DOWNLOAD_IMAGES
+
+
+def needs_image_download(post):
+    """
+    Returns whether the post image is remote, so it has to be downloaded and resized
+    """
+    return bool(post.image_url) and settings.BASE_URL not in post.image_url
+
+
+if IMAGE_DOWNLOADS_ENABLED:
 
     @receiver(post_save, sender=Post)
     def download_image_on_save(sender, **kwargs):
         post = kwargs.get('instance')
-        if post and settings.BASE_URL not in post.image_url:
-            download_resize_update_photo_image.delay(post)
+        if post and needs_image_download(post):
+            queue_image_download(post.pk)
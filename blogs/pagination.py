@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+import base64
+import binascii
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+CURSOR_QUERY_PARAM = 'cursor'
+
+
+def encode_cursor(post, reverse=False):
+    """
+    Returns an opaque cursor pointing to the post's (publish_date, id) position in the timeline
+    """
+    position = '{0}|{1}|{2}'.format(post.publish_date.isoformat(), post.pk, 'r' if reverse else 'f')
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Returns the (publish_date, id, reverse) tuple stored in a cursor or raises ValueError if it is not valid
+    """
+    try:
+        publish_date, pk, direction = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        publish_date = parse_datetime(publish_date)
+        pk = int(pk)
+    except (binascii.Error, TypeError, UnicodeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if publish_date is None or direction not in ('f', 'r'):
+        raise ValueError('Invalid cursor')
+    return publish_date, pk, direction == 'r'
+
+
+class KeysetPage(object):
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def paginate_by_keyset(queryset, cursor, page_size):
+    """
+    Returns the KeysetPage of posts after (or before, if the cursor is reversed) the cursor position, walking the
+    timeline by (-publish_date, -id). Every page is a bounded index range scan: no COUNT and no OFFSET
+    """
+    if not cursor:
+        posts = list(queryset.order_by('-publish_date', '-pk')[:page_size + 1])
+        has_next, has_previous = len(posts) > page_size, False
+        posts = posts[:page_size]
+    else:
+        publish_date, pk, reverse = decode_cursor(cursor)
+        if not reverse:
+            posts = list(queryset.filter(
+                Q(publish_date__lt=publish_date) | Q(publish_date=publish_date, pk__lt=pk)
+            ).order_by('-publish_date', '-pk')[:page_size + 1])
+            has_next, has_previous = len(posts) > page_size, True
+            posts = posts[:page_size]
+        else:
+            posts = list(queryset.filter(
+                Q(publish_date__gt=publish_date) | Q(publish_date=publish_date, pk__gt=pk)
+            ).order_by('publish_date', 'pk')[:page_size + 1])
+            has_next, has_previous = True, len(posts) > page_size
+            posts = list(reversed(posts[:page_size]))
+
+    return KeysetPage(
+        posts,
+        next_cursor=encode_cursor(posts[-1]) if has_next and posts else None,
+        previous_cursor=encode_cursor(posts[0], reverse=True) if has_previous and posts else None
+    )
+
+
+class TimelinePagination(PageNumberPagination):
+    """
+    Page number pagination by default. Sending the `cursor` parameter (empty for the first page) switches to keyset
+    pagination over the publish_date timeline: no count, just next/previous links that stay stable while posts are
+    being published. The timeline has its own order, so cursors can not be combined with ordering nor search (ranked
+    by relevance)
+    """
+    cursor_query_param = CURSOR_QUERY_PARAM
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset_page = None
+        if self.cursor_query_param not in request.query_params:
+            return super(TimelinePagination, self).paginate_queryset(queryset, request, view)
+        for param in (api_settings.ORDERING_PARAM, api_settings.SEARCH_PARAM):
+            if request.query_params.get(param):
+                raise ValidationError({param: 'Can not be combined with {0}.'.format(self.cursor_query_param)})
+
+        try:
+            self.keyset_page = paginate_by_keyset(
+                queryset, request.query_params.get(self.cursor_query_param), self.get_page_size(request)
+            )
+        except ValueError as exc:
+            raise NotFound(str(exc))
+        self.request = request
+        return list(self.keyset_page)
+
+    def get_paginated_response(self, data):
+        if self.keyset_page is None:
+            return super(TimelinePagination, self).get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_cursor_link(self, cursor):
+        if cursor is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        if self.keyset_page is None:
+            return super(TimelinePagination, self).get_next_link()
+        return self.get_cursor_link(self.keyset_page.next_cursor)
+
+    def get_previous_link(self):
+        if self.keyset_page is None:
+            return super(TimelinePagination, self).get_previous_link()
+        return self.get_cursor_link(self.keyset_page.previous_cursor)
+
+
+class KeysetPaginationMixin(object):
+    """
+    ListView mixin that paginates the timeline by cursor unless a page number is requested
+    """
+    cursor_kwarg = CURSOR_QUERY_PARAM
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.page_kwarg in self.request.GET or self.page_kwarg in self.kwargs:
+            return super(KeysetPaginationMixin, self).paginate_queryset(queryset, page_size)
+        try:
+            page = paginate_by_keyset(queryset, self.request.GET.get(self.cursor_kwarg), page_size)
+        except ValueError as exc:
+            raise Http404(str(exc))
+        return (None, page, page.object_list, page.has_other_pages())
@@ -8,4 +8,4 @@ class PostPermissions(permissions.BasePermission):
         """
         Let to access the object if action is retrieve or user is superuser or post's owner
         """
-        return view.action == 'retrieve' or request.user.is_superuser or request.user == obj.blog.owner
+        return view.action == 'retrieve' or request.user.is_superuser or request.user.pk == obj.blog.owner_id
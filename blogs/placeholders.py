@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import base64
+import io
+
+import numpy
+from PIL import Image
+
+from blogs.settings import PLACEHOLDER_COMPONENTS, PLACEHOLDER_SIZE
+
+BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+
+
+def encode_base83(value, length):
+    return ''.join(BASE83[value // 83 ** (length - i - 1) % 83] for i in range(length))
+
+
+def decode_base83(string):
+    value = 0
+    for character in string:
+        value = value * 83 + BASE83.index(character)
+    return value
+
+
+def srgb_to_linear(values):
+    values = numpy.asarray(values, dtype=numpy.float64) / 255
+    return numpy.where(values <= 0.04045, values / 12.92, ((values + 0.055) / 1.055) ** 2.4)
+
+
+def linear_to_srgb(values):
+    values = numpy.clip(values, 0, 1)
+    srgb = numpy.where(values <= 0.0031308, values * 12.92, 1.055 * values ** (1 / 2.4) - 0.055)
+    return (srgb * 255 + 0.5).astype(numpy.int64)
+
+
+def sign_pow(values, exponent):
+    return numpy.copysign(numpy.abs(values) ** exponent, values)
+
+
+def cosines(components, size):
+    """
+    Returns the (size, components) matrix of the cosine basis: cos(pi * component * position / size)
+    """
+    return numpy.cos(numpy.pi * numpy.outer(numpy.arange(size), numpy.arange(components)) / size)
+
+
+def encode_blurhash(image, components=PLACEHOLDER_COMPONENTS):
+    """
+    Returns the BlurHash (https://blurha.sh) of a PIL image: the DC and the lowest AC components of its colors in a
+    ~30 characters string. The image should be already small (a few dozens of pixels), every component is computed
+    at once over all its pixels
+    """
+    components_x, components_y = components
+    pixels = srgb_to_linear(numpy.asarray(image.convert('RGB')))  # (height, width, 3)
+    height, width = pixels.shape[:2]
+    factors = numpy.einsum('yj,xi,yxc->jic', cosines(components_y, height), cosines(components_x, width), pixels)
+    factors /= width * height
+    factors[1:, :] *= 2  # every component but the DC is normalized by 2
+    factors[0, 1:] *= 2
+    factors = factors.reshape(-1, 3)
+    dc, ac = factors[0], factors[1:]
+
+    blurhash = encode_base83((components_x - 1) + (components_y - 1) * 9, 1)
+    if len(ac):
+        quantised_maximum = int(max(0, min(82, numpy.floor(numpy.abs(ac).max() * 166 - 0.5))))
+        maximum = (quantised_maximum + 1) / 166.0
+        blurhash += encode_base83(quantised_maximum, 1)
+    else:
+        maximum = 1
+        blurhash += encode_base83(0, 1)
+
+    r, g, b = linear_to_srgb(dc)
+    blurhash += encode_base83((int(r) << 16) + (int(g) << 8) + int(b), 4)
+    quantised = numpy.clip(numpy.floor(sign_pow(ac / maximum, 0.5) * 9 + 9.5), 0, 18).astype(numpy.int64)
+    for r, g, b in quantised:
+        blurhash += encode_base83(int(r) * 19 * 19 + int(g) * 19 + int(b), 2)
+    return blurhash
+
+
+def decode_blurhash(blurhash, width, height):
+    """
+    Returns the (height, width, 3) uint8 array of the colors the BlurHash describes
+    """
+    size_flag = decode_base83(blurhash[0])
+    components_x, components_y = size_flag % 9 + 1, size_flag // 9 + 1
+    if len(blurhash) != 4 + 2 * components_x * components_y:
+        raise ValueError('Invalid BlurHash length')
+    maximum = (decode_base83(blurhash[1]) + 1) / 166.0
+
+    value = decode_base83(blurhash[2:6])
+    colors = [srgb_to_linear([value >> 16, (value >> 8) & 255, value & 255])]
+    for i in range(1, components_x * components_y):
+        value = decode_base83(blurhash[4 + i * 2:6 + i * 2])
+        quantised = numpy.array([value // (19 * 19), value // 19 % 19, value % 19], dtype=numpy.float64)
+        colors.append(sign_pow((quantised - 9) / 9, 2.0) * maximum)
+    colors = numpy.array(colors).reshape(components_y, components_x, 3)
+
+    pixels = numpy.einsum('yj,xi,jic->yxc', cosines(components_y, height), cosines(components_x, width), colors)
+    return linear_to_srgb(pixels).astype(numpy.uint8)
+
+
+def placeholder_from_image(image):
+    """
+    Returns the BlurHash of a PIL image, computed over a copy of at most PLACEHOLDER_SIZE pixels
+    """
+    small = image.copy()
+    small.thumbnail(PLACEHOLDER_SIZE)
+    return encode_blurhash(small)
+
+
+def placeholder_data_uri(blurhash, size=(16, 12)):
+    """
+    Returns the BlurHash as a tiny PNG data URI, so templates can paint it without any JavaScript decoder
+    """
+    output = io.BytesIO()
+    Image.fromarray(decode_blurhash(blurhash, size[0], size[1]), 'RGB').save(output, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(output.getvalue()).decode('ascii')
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+import re
+
+from django.db import connection
+from django.utils.module_loading import import_string
+
+from blogs.settings import SEARCH_BACKEND, SEARCH_SNIPPET_TOKENS
+
+_backend = None
+
+
+def get_search_backend():
+    """
+    Returns the configured search backend instance. If SEARCH_BACKEND is not set, uses SQLite FTS5 when the default
+    database is SQLite and plain database lookups otherwise
+    """
+    global _backend
+    if _backend is None:
+        path = SEARCH_BACKEND
+        if path is None:
+            path = 'blogs.search.SQLiteFTSSearchBackend' if connection.vendor == 'sqlite' \
+                else 'blogs.search.DatabaseSearchBackend'
+        _backend = import_string(path)()
+    return _backend
+
+
+class DatabaseSearchBackend(object):
+    """
+    Keeps no index at all: the search filter falls back to DRF's LIKE lookups over the view's search_fields
+    """
+
+    def supports(self, model):
+        return False
+
+    def search(self, queryset, terms):
+        """
+        Returns the queryset restricted to the objects matching the terms. Nothing is indexed here, so it is left as
+        is for the LIKE lookups
+        """
+        return queryset
+
+    def index_post(self, post):
+        pass
+
+    def index_posts(self, posts):
+        for post in posts:
+            self.index_post(post)
+
+    def remove_post(self, pk):
+        pass
+
+    def index_blog(self, blog):
+        pass
+
+    def remove_blog(self, pk):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class SQLiteFTSSearchBackend(DatabaseSearchBackend):
+    """
+    Keeps posts and blogs in SQLite FTS5 tables (created by the 0003_search_index migration) using the object pk as
+    rowid. Results are ranked with bm25 and come with a highlighted snippet in the `search_snippet` attribute
+    """
+
+    TABLES = {
+        'blogs.post': {
+            'table': 'blogs_post_search',
+            'weights': (10.0, 5.0, 1.0),  # title, intro, body
+        },
+        'blogs.blog': {
+            'table': 'blogs_blog_search',
+            'weights': (10.0, 2.0, 5.0),  # name, description, username
+        },
+    }
+
+    def supports(self, model):
+        return model._meta.label_lower in self.TABLES
+
+    @staticmethod
+    def build_match(terms):
+        """
+        Builds a FTS5 MATCH expression where every term must prefix-match some indexed column
+        """
+        phrases = ['"{0}"*'.format(term.replace('"', '""')) for term in terms if re.search(r'\w', term, re.UNICODE)]
+        return ' '.join(phrases)
+
+    def search(self, queryset, terms):
+        match = self.build_match(terms)
+        if not match:
+            return queryset.none()
+        table = self.TABLES[queryset.model._meta.label_lower]['table']
+        if queryset.query.group_by is not None:
+            # FTS5 auxiliary functions cannot be used in aggregated queries, so these are only restricted to matches
+            return queryset.extra(
+                where=['{0}.id IN (SELECT rowid FROM {1} WHERE {1} MATCH %s)'.format(queryset.model._meta.db_table, table)],
+                params=[match]
+            )
+        weights = ', '.join(str(weight) for weight in self.TABLES[queryset.model._meta.label_lower]['weights'])
+        return queryset.extra(
+            tables=[table],
+            where=['{0}.rowid = {1}.id'.format(table, queryset.model._meta.db_table), '{0} MATCH %s'.format(table)],
+            params=[match],
+            select={
+                'search_rank': 'bm25({0}, {1})'.format(table, weights),
+                'search_snippet': "snippet({0}, -1, '<mark>', '</mark>', '...', {1})".format(
+                    table, SEARCH_SNIPPET_TOKENS
+                ),
+            },
+        ).order_by('search_rank')
+
+    def _replace(self, table, pk, columns=None, values=None):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {0} WHERE rowid = %s'.format(table), [pk])
+            if columns:
+                cursor.execute(
+                    'INSERT INTO {0}(rowid, {1}) VALUES (%s{2})'.format(table, ', '.join(columns), ', %s' * len(columns)),
+                    [pk] + list(values)
+                )
+
+    def index_post(self, post):
+        self._replace('blogs_post_search', post.pk, ('title', 'intro', 'body'), (post.title, post.intro, post.body))
+
+    def index_posts(self, posts):
+        """
+        Indexes many new posts with one statement
+        """
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO blogs_post_search(rowid, title, intro, body) VALUES (%s, %s, %s, %s)',
+                [(post.pk, post.title, post.intro, post.body) for post in posts]
+            )
+
+    def remove_post(self, pk):
+        self._replace('blogs_post_search', pk)
+
+    def index_blog(self, blog):
+        self._replace(
+            'blogs_blog_search', blog.pk, ('name', 'description', 'username'),
+            (blog.name, blog.description or '', blog.owner.username)
+        )
+
+    def remove_blog(self, pk):
+        self._replace('blogs_blog_search', pk)
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            populate_search_index(cursor)
+
+
+def populate_search_index(cursor):
+    """
+    Fills the FTS5 tables from scratch, for the rebuild_search_index command
+    """
+    cursor.execute('DELETE FROM blogs_post_search')
+    cursor.execute(
+        'INSERT INTO blogs_post_search(rowid, title, intro, body) SELECT id, title, intro, body FROM blogs_post'
+    )
+    cursor.execute('DELETE FROM blogs_blog_search')
+    cursor.execute(
+        'INSERT INTO blogs_blog_search(rowid, name, description, username) '
+        'SELECT b.id, b.name, COALESCE(b.description, \'\'), u.username '
+        'FROM blogs_blog b INNER JOIN auth_user u ON u.id = b.owner_id'
+    )
@@ -1,8 +1,8 @@
 # -*- coding: utf-8 -*-
 from collections import OrderedDict
+from blogs.images import get_srcset
 from blogs.models import Blog, Post
 from django.contrib.auth.models import User
-from django.utils import timezone
 from rest_framework import serializers
 from rest_framework.pagination import PageNumberPagination
 
@@ -14,7 +14,19 @@ class BlogOwnerSerializer(serializers.ModelSerializer):
         fields = ('username', 'first_name', 'last_name')
 
 
-class BlogSerializer(serializers.ModelSerializer):
+class SearchResultSerializerMixin(object):
+
+    def to_representation(self, instance):
+        """
+        Adds the highlighted snippet when the instance comes from an indexed search
+        """
+        representation = super(SearchResultSerializerMixin, self).to_representation(instance)
+        if hasattr(instance, 'search_snippet'):
+            representation['search_snippet'] = instance.search_snippet
+        return representation
+
+
+class BlogSerializer(SearchResultSerializerMixin, serializers.ModelSerializer):
     owner = BlogOwnerSerializer(read_only=True)
     url = serializers.CharField(source='get_absolute_url', read_only=True)
     posts_count = serializers.ReadOnlyField()
@@ -27,22 +39,40 @@ class PostSerializer(serializers.ModelSerializer):
     blog = BlogSerializer(read_only=True)
     url = serializers.CharField(source='get_absolute_url', read_only=True)
     author = serializers.CharField(source='get_author', read_only=True)
+    image_renditions = serializers.ReadOnlyField(source='get_image_renditions')
+    image_srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Post
         read_only_fields = ('blog',)
 
+    def get_image_srcset(self, obj):
+        return get_srcset(obj.get_image_renditions()) or None
+
+
+class PostBulkSerializer(serializers.ModelSerializer):
+    """
+    Validates an item of a bulk creation without queries: categories are checked for the whole batch at once
+    """
+    categories = serializers.ListField(child=serializers.CharField(max_length=250), required=False)
+
+    class Meta:
+        model = Post
+        fields = ('title', 'intro', 'body', 'image_url', 'publish_date', 'categories')
+
 
-class PostListSerializer(PostSerializer):
+class PostListSerializer(SearchResultSerializerMixin, PostSerializer):
 
     class Meta(PostSerializer.Meta):
-        fields = ('id', 'title', 'intro', 'image_url', 'url', 'author')
+        fields = (
+            'id', 'title', 'intro', 'image_url', 'image_renditions', 'image_srcset', 'image_placeholder', 'url', 'author'
+        )
 
 
 class BlogPostListSerializer(PostSerializer):
 
     class Meta(PostSerializer.Meta):
-        fields = ('id', 'title', 'intro', 'image_url', 'url')
+        fields = ('id', 'title', 'intro', 'image_url', 'image_renditions', 'image_srcset', 'image_placeholder', 'url')
 
 
 class BlogPostsSerializer(BlogSerializer):
@@ -58,7 +88,12 @@ class BlogPostsSerializer(BlogSerializer):
         request = self.context.get('request')
         if request:
             paginator = PageNumberPagination()
-            posts = paginator.paginate_queryset(instance.posts.filter(publish_date__lte=timezone.now()), request)
+            posts = paginator.paginate_queryset(
+                instance.posts.select_related('blog__owner').filter(is_published=True).order_by(
+                    '-publish_date', '-pk'
+                ),
+                request
+            )
             serializer = BlogPostListSerializer(posts, many=True)
             representation['posts'] = OrderedDict([
                 ('count', paginator.page.paginator.count),
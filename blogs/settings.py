@@ -3,3 +3,45 @@ from django.conf import settings
 
 DOWNLOAD_IMAGES = getattr(settings, 'DOWNLOAD_IMAGES', True)
 THUMBNAIL_SIZE = getattr(settings, 'THUMBNAIL_SIZE', (800, 600))
+IMAGE_RENDITIONS = getattr(settings, 'IMAGE_RENDITIONS', (  # (name, max size) of the post image renditions
+    ('card', (400, 300)),
+    ('detail', THUMBNAIL_SIZE),
+    ('retina', (THUMBNAIL_SIZE[0] * 2, THUMBNAIL_SIZE[1] * 2)),
+))
+IMAGE_FORMATS = getattr(settings, 'IMAGE_FORMATS', ('JPEG', 'WEBP'))  # formats Pillow can't encode are skipped
+IMAGE_QUALITY = getattr(settings, 'IMAGE_QUALITY', 85)
+PLACEHOLDER_COMPONENTS = getattr(settings, 'PLACEHOLDER_COMPONENTS', (4, 3))  # BlurHash x, y components
+PLACEHOLDER_SIZE = getattr(settings, 'PLACEHOLDER_SIZE', (32, 32))  # pixels the BlurHash is computed over
+IMAGE_RESIZE_SIZES = getattr(settings, 'IMAGE_RESIZE_SIZES', [size for name, size in IMAGE_RENDITIONS] + [
+    (200, 150), (600, 450), (1200, 900)
+])  # the only sizes the on the fly resize endpoint (/media/r/<w>x<h>/<name>) accepts
+IMAGE_RESIZE_DIR = getattr(settings, 'IMAGE_RESIZE_DIR', 'r')  # its disk cache, inside MEDIA_ROOT
+IMAGE_RESIZE_MAX_AGE = getattr(settings, 'IMAGE_RESIZE_MAX_AGE', 24 * 60 * 60)  # seconds browsers may cache them
+IMAGE_BATCH_SIZE = getattr(settings, 'IMAGE_BATCH_SIZE', 50)  # post ids per download_post_images task
+IMAGE_DOWNLOAD_CHUNK_SIZE = getattr(settings, 'IMAGE_DOWNLOAD_CHUNK_SIZE', 64 * 1024)  # bytes
+IMAGE_HTTP_POOL_SIZE = getattr(settings, 'IMAGE_HTTP_POOL_SIZE', 10)  # keep-alive connections per host and worker
+IMAGE_CONNECT_TIMEOUT = getattr(settings, 'IMAGE_CONNECT_TIMEOUT', 3.05)  # seconds
+IMAGE_READ_TIMEOUT = getattr(settings, 'IMAGE_READ_TIMEOUT', 10)  # seconds between two reads
+IMAGE_FETCH_DEADLINE = getattr(settings, 'IMAGE_FETCH_DEADLINE', 60)  # seconds for a whole download
+IMAGE_MAX_BYTES = getattr(settings, 'IMAGE_MAX_BYTES', 20 * 1024 * 1024)
+IMAGE_MAX_PIXELS = getattr(settings, 'IMAGE_MAX_PIXELS', 100 * 1000 * 1000)  # width x height, checked before decoding
+IMAGE_MAX_DECODE_BYTES = getattr(settings, 'IMAGE_MAX_DECODE_BYTES', 256 * 1024 * 1024)  # after JPEG draft scaling
+IMAGE_HOST_CONCURRENCY = getattr(settings, 'IMAGE_HOST_CONCURRENCY', 4)  # downloads per host across workers
+IMAGE_BREAKER_THRESHOLD = getattr(settings, 'IMAGE_BREAKER_THRESHOLD', 5)  # consecutive failures opening a host
+IMAGE_BREAKER_COOLDOWN = getattr(settings, 'IMAGE_BREAKER_COOLDOWN', 60)  # seconds a failing host is skipped
+IMAGE_FETCH_MAX_RETRIES = getattr(settings, 'IMAGE_FETCH_MAX_RETRIES', 5)  # retries of unavailable hosts
+IMAGE_FETCH_CACHE_ALIAS = getattr(settings, 'IMAGE_FETCH_CACHE_ALIAS', 'default')  # shares host state by workers
+IMAGE_STORE_DIR = getattr(settings, 'IMAGE_STORE_DIR', 'images')  # content addressed images, inside MEDIA_ROOT
+IMAGE_BLOB_GC_GRACE = getattr(settings, 'IMAGE_BLOB_GC_GRACE', 3600)  # seconds an unused image is kept
+SEARCH_BACKEND = getattr(settings, 'SEARCH_BACKEND', None)  # None picks SQLite FTS5 or plain LIKE lookups by database
+SEARCH_SNIPPET_TOKENS = getattr(settings, 'SEARCH_SNIPPET_TOKENS', 16)
+FRAGMENT_CACHE_ALIAS = getattr(settings, 'FRAGMENT_CACHE_ALIAS', 'fragments')  # an entry of settings.CACHES
+FRAGMENT_CACHE_TIMEOUT = getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 300)  # seconds, fragments are also versioned
+API_CACHE_ALIAS = getattr(settings, 'API_CACHE_ALIAS', 'default')  # caches anonymous API responses by ETag
+API_CACHE_TIMEOUT = getattr(settings, 'API_CACHE_TIMEOUT', 300)
+BULK_POSTS_MAX = getattr(settings, 'BULK_POSTS_MAX', 500)  # posts per POST /api/1.0/posts/bulk/ request
+EXPORT_CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 500)  # posts per categories query of the NDJSON exports
+FEED_ITEMS = getattr(settings, 'FEED_ITEMS', 20)  # latest posts in the RSS and Atom feeds
+SITEMAP_DIR = getattr(settings, 'SITEMAP_DIR', 'sitemaps')  # sitemap files, inside MEDIA_ROOT
+SITEMAP_CHUNK_SIZE = getattr(settings, 'SITEMAP_CHUNK_SIZE', 10000)  # pks per sitemap file (50000 URLs at most)
+SITEMAP_GZIP_MIN_BYTES = getattr(settings, 'SITEMAP_GZIP_MIN_BYTES', 64 * 1024)  # sitemaps also written gzipped
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+import gzip
+import os
+import shutil
+import tempfile
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.db.models import Count, ExpressionWrapper, F, IntegerField, Max
+from django.utils.encoding import force_bytes
+
+from blogs.checkpoint import read_checkpoint, write_checkpoint
+from blogs.models import Blog, Post
+from blogs.settings import SITEMAP_CHUNK_SIZE, SITEMAP_DIR, SITEMAP_GZIP_MIN_BYTES
+
+SITEMAP_NAMESPACE = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+
+class SitemapSection(object):
+    """
+    The URLs of a model split in sitemap files by ranges of chunk_size primary keys. A chunk keeps its pk range, so
+    a changed object only changes its own chunk, which is described by the count and last modified_at of its objects
+    """
+    name = None
+
+    def __init__(self, chunk_size=SITEMAP_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+
+    def get_queryset(self):
+        raise NotImplementedError()
+
+    def get_urls(self, queryset):
+        """
+        Yields the (path, lastmod) of the queryset objects
+        """
+        raise NotImplementedError()
+
+    def get_chunks(self):
+        """
+        Returns {chunk: [count, last modified_at]} with one grouped query
+        """
+        chunk = ExpressionWrapper((F('pk') - 1) / self.chunk_size, output_field=IntegerField())
+        return dict(
+            (str(row['chunk']), [row['count'], row['last'].isoformat()])
+            for row in self.get_queryset().annotate(chunk=chunk).order_by().values('chunk').annotate(
+                count=Count('pk'), last=Max('modified_at')
+            )
+        )
+
+    def get_chunk_urls(self, chunk):
+        chunk = int(chunk)
+        return self.get_urls(self.get_queryset().filter(
+            pk__gt=chunk * self.chunk_size, pk__lte=(chunk + 1) * self.chunk_size
+        ).order_by('pk'))
+
+    def filename(self, chunk):
+        return 'sitemap-{0}-{1}.xml'.format(self.name, chunk)
+
+
+class PostSitemap(SitemapSection):
+    name = 'posts'
+
+    def get_queryset(self):
+        return Post.objects.filter(is_published=True)
+
+    def get_urls(self, queryset):
+        for pk, username, modified_at in queryset.values_list('pk', 'blog__owner__username', 'modified_at').iterator():
+            yield reverse('post_detail', args=[username, pk]), modified_at
+
+
+class BlogSitemap(SitemapSection):
+    name = 'blogs'
+
+    def get_queryset(self):
+        return Blog.objects.all()
+
+    def get_urls(self, queryset):
+        for username, modified_at in queryset.values_list('owner__username', 'modified_at').iterator():
+            yield reverse('blog_detail', args=[username]), modified_at
+
+
+def get_sitemap_dir():
+    return os.path.join(settings.MEDIA_ROOT, SITEMAP_DIR)
+
+
+def write_file(path, lines, gzip_min_bytes=SITEMAP_GZIP_MIN_BYTES):
+    """
+    Writes the lines aside and renames the file, so the served sitemaps are never half written. Files of at least
+    gzip_min_bytes get a precompressed .gz copy too
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        for line in lines:
+            f.write(force_bytes(line))
+    if os.path.getsize(temp_path) >= gzip_min_bytes:
+        fd, temp_gz_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with open(temp_path, 'rb') as source, os.fdopen(fd, 'wb') as f:
+            with gzip.GzipFile(fileobj=f, mode='wb') as gz:
+                shutil.copyfileobj(source, gz)
+        os.chmod(temp_gz_path, 0o644)
+        os.rename(temp_gz_path, path + '.gz')
+    elif os.path.exists(path + '.gz'):
+        os.remove(path + '.gz')
+    os.chmod(temp_path, 0o644)  # mkstemp creates files only their owner can read
+    os.rename(temp_path, path)
+
+
+def sitemap_lines(base_url, urls):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="{0}">\n'.format(SITEMAP_NAMESPACE)
+    for path, lastmod in urls:
+        yield '<url><loc>{0}</loc><lastmod>{1}</lastmod></url>\n'.format(escape(base_url + path), lastmod.isoformat())
+    yield '</urlset>\n'
+
+
+def sitemap_index_lines(base_url, sitemaps):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="{0}">\n'.format(SITEMAP_NAMESPACE)
+    for filename, lastmod in sitemaps:
+        yield '<sitemap><loc>{0}</loc><lastmod>{1}</lastmod></sitemap>\n'.format(
+            escape(base_url + reverse('sitemap', args=[filename[:-len('.xml')]])), lastmod
+        )
+    yield '</sitemapindex>\n'
+
+
+def update_sitemaps(base_url=None, full=False, sections=None, gzip_min_bytes=SITEMAP_GZIP_MIN_BYTES):
+    """
+    Writes the sitemap files of the chunks changed since the last run (all of them if full) and the sitemap index.
+    Chunk URLs are streamed from the database to the files. The chunks written are saved in manifest.json to
+    compare them with the next run. Returns the number of (sitemap files written, sitemap files)
+    """
+    base_url = (base_url or settings.BASE_URL).rstrip('/')
+    sections = sections or (BlogSitemap(), PostSitemap())
+    directory = get_sitemap_dir()
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    manifest_path = os.path.join(directory, 'manifest.json')
+    manifest = read_checkpoint(manifest_path) or {}
+    chunk_sizes = dict((section.name, section.chunk_size) for section in sections)
+    if full or manifest.get('base_url') != base_url or manifest.get('chunk_sizes') != chunk_sizes:
+        manifest = {}  # every file is written again
+
+    written, index = 0, []
+    new_manifest = {'base_url': base_url, 'chunk_sizes': chunk_sizes}
+    for section in sections:
+        previous = manifest.get(section.name, {})
+        chunks = section.get_chunks()
+        for chunk, stats in sorted(chunks.items(), key=lambda item: int(item[0])):
+            path = os.path.join(directory, section.filename(chunk))
+            if previous.get(chunk) != stats or not os.path.exists(path):
+                write_file(path, sitemap_lines(base_url, section.get_chunk_urls(chunk)), gzip_min_bytes)
+                written += 1
+            index.append((section.filename(chunk), stats[1]))
+        new_manifest[section.name] = chunks
+
+    write_file(os.path.join(directory, 'sitemap.xml'), sitemap_index_lines(base_url, index), gzip_min_bytes)
+    filenames = set(filename for filename, lastmod in index)
+    for filename in os.listdir(directory):  # chunks without published objects left, or of other chunk sizes
+        if filename.startswith('sitemap-') and filename.split('.xml')[0] + '.xml' not in filenames:
+            os.remove(os.path.join(directory, filename))
+    write_checkpoint(manifest_path, new_manifest)
+    return written, len(index)
@@ -1,36 +1,233 @@
 # -*- coding: utf-8 -*-
-from blogs.settings import THUMBNAIL_SIZE
+from blogs.cache import blog_scope, bump_fragment_versions
+from blogs.fetcher import HostGuard, HostUnavailable, get_http_session
+from blogs.images import blob_path, build_renditions, renditions_version
+from blogs.settings import IMAGE_BATCH_SIZE, IMAGE_FETCH_MAX_RETRIES, IMAGE_STORE_DIR
 from celery import shared_task
+import json
+import logging
 import os
 import requests
+import tempfile
+import threading
 from django.conf import settings
-from PIL import Image
+from django.db import IntegrityError, transaction
+from django.utils.six.moves.urllib.parse import urlparse
+from django.utils import timezone
+
+_pending = threading.local()
+logger = logging.getLogger(__name__)
+
+
+def get_extension(image_url):
+    extension = os.path.splitext(urlparse(image_url).path)[1][1:].lower()
+    return extension if extension.isalnum() and len(extension) <= 10 else 'img'
+
+
+def fetch_image_blob(session, image_url, guard=None):
+    """
+    Returns the ImageBlob of the URL. The image is only downloaded if the URL is not indexed yet, and only stored
+    and resized if no other URL had the same bytes
+    """
+    from blogs.models import ImageBlob, RemoteImage  # blogs.models imports this module
+
+    url_hash = RemoteImage.hash_url(image_url)
+    # touched before it is read, so gc_image_blobs gives the blob its grace period again instead of removing it
+    if RemoteImage.objects.filter(url_hash=url_hash).update(fetched_at=timezone.now()):
+        remote = RemoteImage.objects.select_related('blob').filter(url_hash=url_hash).first()
+        if remote is not None:
+            return remote.blob
+
+    extension = get_extension(image_url)
+    store_dir = os.path.join(settings.MEDIA_ROOT, IMAGE_STORE_DIR)
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+    fd, temp_filename = tempfile.mkstemp(suffix='.download', dir=store_dir)
+    os.close(fd)
+    try:
+        digest, size = (guard or HostGuard()).fetch(session, image_url, temp_filename)
+        blob = ImageBlob.objects.filter(pk=digest).first()
+        if blob is None:
+            original = os.path.join(settings.MEDIA_ROOT, blob_path(digest, '.' + extension))
+            if not os.path.isdir(os.path.dirname(original)):
+                os.makedirs(os.path.dirname(original))
+            os.rename(temp_filename, original)
+            report = {}
+            try:
+                renditions = build_renditions(original, blob_path(digest), report=report)
+            except (IOError, ValueError):  # unreadable or over the decode limits, not worth keeping
+                os.remove(original)
+                raise
+            logger.info(
+                'Image %s: %sx%s decoded at %sx%s, peak image memory %s KB', image_url, report['source_size'][0],
+                report['source_size'][1], report['decoded_size'][0], report['decoded_size'][1],
+                report['peak_bytes'] // 1024
+            )
+            try:
+                with transaction.atomic():
+                    blob = ImageBlob.objects.create(
+                        digest=digest, extension=extension, size=size, renditions=json.dumps(renditions),
+                        placeholder=report['placeholder'], renditions_version=renditions_version()
+                    )
+            except IntegrityError:  # another worker stored the same bytes meanwhile, its files are identical
+                blob = ImageBlob.objects.get(pk=digest)
+    finally:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+
+    RemoteImage.objects.update_or_create(url_hash=url_hash, defaults={'url': image_url, 'blob': blob})
+    return blob
+
+
+def process_post_image(session, post, guard=None):
+    """
+    Points the post to the content addressed image of its image_url and its renditions (see IMAGE_RENDITIONS). The
+    post is updated once, without sending post_save again, with the detail rendition and the renditions manifest
+    """
+    from blogs.models import ImageBlob, Post  # blogs.models imports this module
+
+    blob = fetch_image_blob(session, post.image_url, guard)
+    Post.objects.filter(pk=post.pk).update(image_blob=blob, **get_blob_post_fields(blob))
+    ImageBlob.update_refcounts([blob.pk, post.image_blob_id])
+
+
+def get_blob_post_fields(blob):
+    """
+    Returns the fields copied from the ImageBlob to the posts using it, for a queryset update
+    """
+    fields = {
+        'image_renditions': blob.renditions,
+        'image_placeholder': blob.placeholder,
+        'modified_at': timezone.now(),
+    }
+    renditions = blob.get_renditions()
+    if 'detail' in renditions:
+        fields['image_url'] = renditions['detail']['jpeg']
+    return fields
+
+
+@shared_task
+def download_post_images(post_pks, attempt=0):
+    """
+    Processes the images of a batch of posts with this worker's pooled HTTP session. A failed image is logged and
+    does not stop the batch. Posts whose host is failing or busy are not waited for: they are queued again with a
+    backoff, up to IMAGE_FETCH_MAX_RETRIES times, so slow hosts never hold the worker. Returns the number of images
+    processed
+    """
+    from blogs.models import Blog, Post  # blogs.models imports this module
+
+    session, guard = get_http_session(), HostGuard()
+    processed, blog_pks, retry_pks, retry_after = 0, set(), [], 0
+    for post in Post.objects.filter(pk__in=post_pks).exclude(image_url__isnull=True).exclude(image_url='').only(
+        'pk', 'blog', 'image_url', 'image_blob'
+    ):
+        try:
+            process_post_image(session, post, guard)
+        except HostUnavailable as exc:
+            retry_pks.append(post.pk)
+            retry_after = max(retry_after, exc.retry_after)
+        except (requests.RequestException, IOError, ValueError) as exc:  # ValueError: the image could not be decoded
+            logger.warning('Image of post %s could not be processed: %s', post.pk, exc)
+        else:
+            processed += 1
+            blog_pks.add(post.blog_id)
+
+    if retry_pks and attempt < IMAGE_FETCH_MAX_RETRIES:
+        download_post_images.apply_async((retry_pks, attempt + 1), countdown=max(retry_after, 2 ** attempt))
+    elif retry_pks:
+        logger.warning('Images of posts %s skipped, their hosts are still unavailable', retry_pks)
+
+    if blog_pks:  # blog responses list the post images too
+        Blog.objects.filter(pk__in=blog_pks).update(modified_at=timezone.now())
+        bump_fragment_versions('posts', *[blog_scope(pk) for pk in blog_pks])
+    return processed
 
 
 @shared_task  # makes this function a celery task
 def download_resize_update_photo_image(post):
-    image_url = post.image_url
-    extension = image_url.split('/')[-1].split('.')[-1]
-    file_basename = '{0}.{1}'.format(post.pk, extension)
-    filename = os.path.join(settings.MEDIA_ROOT, file_basename)
+    """
+    Kept for the tasks queued with a whole Post before download_post_images
+    """
+    download_post_images([getattr(post, 'pk', post)])
+
+
+def queue_image_download(post_pk):
+    """
+    Queues the image of the post to be processed once the current transaction commits. The posts saved in the same
+    transaction are sent together in batches of IMAGE_BATCH_SIZE: the first on_commit callback flushes them all (a
+    callback is registered every time because a rolled back transaction discards its callbacks)
+    """
+    if getattr(_pending, 'post_pks', None) is None:
+        _pending.post_pks = set()
+    _pending.post_pks.add(post_pk)
+    transaction.on_commit(flush_image_downloads)
+
+
+def flush_image_downloads():
+    post_pks = sorted(getattr(_pending, 'post_pks', None) or [])
+    _pending.post_pks = set()
+    for start in range(0, len(post_pks), IMAGE_BATCH_SIZE):
+        download_post_images.delay(post_pks[start:start + IMAGE_BATCH_SIZE])
+
+
+@shared_task
+def backfill_post_images(first_pk=0, last_pk=None):
+    """
+    Queues download_post_images, in IMAGE_BATCH_SIZE batches, for the posts of the pk range whose remote image has
+    not been downloaded yet, so bulk imports queue a single task instead of one per post. Returns the posts queued
+    """
+    from blogs.models import Post  # blogs.models imports this module
+
+    posts = Post.objects.filter(pk__gte=first_pk, image_blob__isnull=True).exclude(image_url__isnull=True).exclude(
+        image_url=''
+    )
+    if last_pk is not None:
+        posts = posts.filter(pk__lte=last_pk)
+    queued, batch = 0, []
+    for pk, image_url in posts.order_by('pk').values_list('pk', 'image_url').iterator():
+        if settings.BASE_URL in image_url:
+            continue
+        batch.append(pk)
+        if len(batch) == IMAGE_BATCH_SIZE:
+            download_post_images.delay(batch)
+            queued, batch = queued + len(batch), []
+    if batch:
+        download_post_images.delay(batch)
+        queued += len(batch)
+    return queued
 
-    r = requests.get(image_url, stream=True)
-    with open(filename, 'wb') as f:
-        for chunk in r.iter_content(chunk_size=1024):
-            if chunk:
-                f.write(chunk)
-                f.flush()
 
-    post.image_url = settings.BASE_URL + settings.MEDIA_URL + file_basename
-    post.save()
+@shared_task
+def publish_scheduled_posts():
+    """
+    Flips live the scheduled posts whose publish date has passed, so read paths can filter on the indexed
+    is_published flag instead of comparing publish_date with now(). Counters, modified_at validators and the
+    fragment cache of the affected blogs are refreshed at the same moment
+    """
+    from blogs.models import Blog, Category, Post  # blogs.models imports this module
 
-    thumb_basename = '{0}-thumbnail.{1}'.format(post.pk, extension)
-    thumb_path = os.path.join(settings.MEDIA_ROOT, thumb_basename)
+    now = timezone.now()
+    with transaction.atomic():
+        due = Post.objects.select_for_update().filter(is_published=False, publish_date__lte=now)
+        rows = list(due.values_list('pk', 'blog'))
+        if not rows:
+            return 0
+        pks = [pk for pk, blog_pk in rows]
+        blog_pks = set(blog_pk for pk, blog_pk in rows)
+        Post.objects.filter(pk__in=pks).update(is_published=True, modified_at=now)
+        Category.update_counters(set(
+            Post.categories.through.objects.filter(post__in=pks).values_list('category', flat=True)
+        ))
+        Blog.update_counters(blog_pks)  # also touches their modified_at
+        transaction.on_commit(lambda: bump_fragment_versions('posts', *[blog_scope(pk) for pk in blog_pks]))
+    return len(pks)
 
-    img = Image.open(filename)
-    img.thumbnail(THUMBNAIL_SIZE)
-    img.save(thumb_path, img.format)
 
-    post.image_url = settings.BASE_URL + settings.MEDIA_URL + thumb_basename
-    post.save()
+@shared_task
+def update_sitemaps():
+    """
+    Writes the sitemap files of the posts and blogs changed since the last run. Returns the number of files written
+    """
+    from blogs import sitemaps  # blogs.models imports this module
 
+    return sitemaps.update_sitemaps()[0]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from blogs.cache import fragment_cache_key, fragment_cache_stats, get_fragment_cache
+from blogs.settings import FRAGMENT_CACHE_TIMEOUT
+from django import template
+
+register = template.Library()
+
+
+class CachedFragmentNode(template.Node):
+
+    def __init__(self, nodelist, name, scope, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.scope = scope
+        self.vary_on = vary_on
+
+    def render(self, context):
+        key = fragment_cache_key(
+            self.name, self.scope.resolve(context), [var.resolve(context) for var in self.vary_on]
+        )
+        cache = get_fragment_cache()
+        content = cache.get(key)
+        fragment_cache_stats.record(self.name, content is not None)
+        if content is None:
+            content = self.nodelist.render(context)
+            cache.set(key, content, FRAGMENT_CACHE_TIMEOUT)
+        return content
+
+
+@register.tag
+def cachedfragment(parser, token):
+    """
+    Caches the enclosed template fragment until its scope version is bumped (see blogs.cache). Usage:
+
+        {% cachedfragment "post_list" blog request.GET.page request.GET.category %} ... {% endcachedfragment %}
+
+    where the second argument is the scope (a Blog or a global scope name) and the rest are the values it varies on
+    """
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError("'{0}' takes at least two arguments (name and scope)".format(bits[0]))
+    nodelist = parser.parse(('endcachedfragment',))
+    parser.delete_first_token()
+    name = bits[1]
+    if name[0] == name[-1] and name[0] in ('"', "'"):
+        name = name[1:-1]
+    return CachedFragmentNode(nodelist, name, parser.compile_filter(bits[2]), [parser.compile_filter(bit) for bit in bits[3:]])
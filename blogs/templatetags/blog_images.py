@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from blogs.images import get_srcset
+from blogs.placeholders import placeholder_data_uri
+from django import template
+from django.conf import settings
+from django.core.urlresolvers import reverse
+
+register = template.Library()
+
+
+@register.filter
+def image_url(post, rendition='detail'):
+    """
+    {{ post|image_url:"card" }}: URL of a rendition of the post image
+    """
+    return post.get_image_url(rendition)
+
+
+@register.filter
+def image_srcset(post, image_format='jpeg'):
+    """
+    {{ post|image_srcset:"webp" }}: srcset attribute value with every rendition of the post image in the format
+    """
+    return get_srcset(post.get_image_renditions(), image_format)
+
+
+@register.inclusion_tag('blogs/includes/post_image.html')
+def post_image(post, rendition='detail', sizes='100vw', css_class='img-responsive'):
+    """
+    {% post_image post "card" "(min-width: 992px) 33vw, 100vw" %}: lazy loaded <picture> with WebP and JPEG sources,
+    falling back to the given rendition, painted with the post's BlurHash placeholder until it loads
+    """
+    try:
+        placeholder = placeholder_data_uri(post.image_placeholder) if post.image_placeholder else None
+    except ValueError:  # not a valid BlurHash
+        placeholder = None
+    return {
+        'post': post,
+        'src': post.get_image_url(rendition),
+        'size': post.get_image_renditions().get(rendition, {}),
+        'placeholder': placeholder,
+        'webp_srcset': image_srcset(post, 'webp'),
+        'jpeg_srcset': image_srcset(post, 'jpeg'),
+        'sizes': sizes,
+        'css_class': css_class,
+    }
+
+
+@register.filter
+def resized(url, size):
+    """
+    {{ post.image_url|resized:"600x450" }}: URL of a media image resized on the fly (size must be allowed by
+    IMAGE_RESIZE_SIZES). URLs out of MEDIA_URL are returned as they are
+    """
+    for prefix in (settings.BASE_URL + settings.MEDIA_URL, settings.MEDIA_URL):
+        if url and url.startswith(prefix):
+            width, height = size.split('x')
+            return reverse('resized_image', kwargs={'width': width, 'height': height, 'name': url[len(prefix):]})
+    return url
@@ -1,11 +1,36 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import zlib
 from datetime import timedelta, datetime
 
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import override_settings
+from django.utils.six import StringIO
 from django.utils import timezone
-from blogs.models import Blog, Post, Category
+from blogs.fetcher import HostGuard, HostUnavailable, ImageTooLarge, download_image
+from blogs.images import blob_path, build_renditions, open_bounded, renditions_version
+from blogs.checkpoint import write_checkpoint
+from blogs.export import export_posts
+from blogs.cache import LRUCache, fragment_cache_stats, get_fragment_cache
+from blogs.models import Blog, Post, Category, ImageBlob, RemoteImage
+from blogs.pagination import paginate_by_keyset
+from blogs.sitemaps import BlogSitemap, PostSitemap, update_sitemaps
+from blogs.placeholders import decode_blurhash, encode_blurhash, placeholder_data_uri
+from blogs.management.commands.benchmark_image_downloads import ImageServer, make_jpeg
+from blogs.tasks import download_post_images, fetch_image_blob, publish_scheduled_posts
+from files.models import File
 from django.contrib.auth.models import User
 from rest_framework import status
 from rest_framework.test import APITestCase
+import requests
+from PIL import Image
+from wordplease.benchmark import compare, summarize, traced_peak_kb
+from wordplease.queries import QueryBudgetTestMixin
 
 
 @override_settings(ROOT_URLCONF='blogs.test_urls')
@@ -199,6 +224,28 @@ class PostListAPITests(PostsAPITests):
         response = self.client.get('/1.0/posts/?search=two+bam')
         self.assertEqual(response.data.get('count'), 0)
 
+    def test_search_results_come_with_highlighted_snippets(self):
+        """
+        Ensure that indexed search results include a snippet with the matching terms highlighted
+        """
+        response = self.client.get('/1.0/posts/?search=one+body')
+        self.assertEqual(response.data.get('count'), 1)
+        self.assertIn('<mark>body</mark>', response.data.get('results')[0].get('search_snippet'))
+
+    def test_search_index_follows_post_changes(self):
+        """
+        Ensure that updated and deleted posts are kept in sync with the search index
+        """
+        self.post1.title = 'Renamed with a brand new headline'
+        self.post1.save()
+        response = self.client.get('/1.0/posts/?search=headline')
+        self.assertEqual(response.data.get('count'), 1)
+        self.assertPostsEqual(response.data.get('results'), [self.post1.title])
+
+        self.post1.delete()
+        response = self.client.get('/1.0/posts/?search=headline')
+        self.assertEqual(response.data.get('count'), 0)
+
     def test_order_by_title_and_publish_date(self):
         """
         Ensure that can order by title and publish_date
@@ -262,6 +309,40 @@ class PostCreateAPITest(PostsAPITests):
         new_post = Post.objects.get(pk=response.data.get('id'))
         self.assertEqual(new_post.blog.pk, self.user.blog.pk)
 
+    def test_bulk_creation_returns_the_invalid_items(self):
+        """
+        Ensures that the valid posts of a batch are created with their categories and the invalid ones reported
+        """
+        self.client.login(username=self.user.username, password=self.user.raw_password)
+        future = (timezone.now() + timedelta(days=1)).isoformat()
+        data = [
+            {'title': 'Bulk one', 'intro': 'Intro', 'body': 'Body', 'categories': [self.category1.pk]},
+            {'intro': 'Intro without title', 'body': 'Body'},
+            {'title': 'Bulk two', 'intro': 'Intro', 'body': 'Body', 'categories': ['Unknown']},
+            {'title': 'Bulk three', 'intro': 'Intro', 'body': 'Body', 'publish_date': future,
+             'categories': [self.category1.pk, self.category2.pk]},
+        ]
+        with self.assertNumQueries(18):  # whatever the number of posts
+            response = self.client.post('/1.0/posts/bulk/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([item['index'] for item in response.data['created']], [0, 3])
+        self.assertEqual([(error['index'], list(error['errors'])) for error in response.data['errors']], [
+            (1, ['title']), (2, ['categories'])
+        ])
+
+        posts = Post.objects.filter(pk__in=[item['id'] for item in response.data['created']]).order_by('pk')
+        self.assertEqual([(post.title, post.blog_id, post.is_published) for post in posts], [
+            ('Bulk one', self.user.blog.pk, True), ('Bulk three', self.user.blog.pk, False)
+        ])
+        self.assertEqual(sorted(posts[1].categories.values_list('pk', flat=True)), ['Category One', 'Category Two'])
+        self.assertEqual(Blog.objects.get(pk=self.user.blog.pk).posts_count, 4)
+        self.assertEqual(Category.objects.get(pk=self.category1.pk).posts_count, 4)
+        self.assertEqual(Post.objects.create(blog=self.user.blog, title='Next', intro='', body='').pk, posts[1].pk + 1)
+
+        self.client.logout()
+        response = self.client.post('/1.0/posts/bulk/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
 
 class PostDetailAPITest(PostsAPITests):
 
@@ -489,6 +570,58 @@ class PostListFilterAPITest(PostsAPITests):
         )
 
 
+class PostTimelinePaginationTest(PostsAPITests):
+
+    def test_keyset_pages_walk_the_timeline_both_ways(self):
+        """
+        Ensure that cursor pages follow the publish_date timeline forwards and backwards
+        """
+        timeline = [self.post4, self.post2, self.post3, self.post1]
+        page = paginate_by_keyset(Post.objects.all(), None, 1)
+        self.assertFalse(page.has_previous())
+        visited = list(page)
+        while page.has_next():
+            page = paginate_by_keyset(Post.objects.all(), page.next_cursor, 1)
+            visited.extend(page)
+        self.assertEqual(visited, timeline)
+
+        page = paginate_by_keyset(Post.objects.all(), page.previous_cursor, 1)
+        self.assertEqual(list(page), [self.post3])
+        self.assertTrue(page.has_next())
+
+    def test_cursor_mode_in_posts_api(self):
+        """
+        Ensure that the posts API switches to cursor pagination without count when the cursor param is sent
+        """
+        response = self.client.get('/1.0/posts/?cursor=')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', response.data)
+        self.assertEqual([item.get('id') for item in response.data.get('results')], [self.post3.pk, self.post1.pk])
+        self.assertIsNone(response.data.get('next'))
+
+        response = self.client.get('/1.0/posts/?cursor=bad')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        for params in ('cursor=&ordering=title', 'cursor=&search=post'):
+            response = self.client.get('/1.0/posts/?' + params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+        self.assertEqual(self.client.get('/1.0/posts/?ordering=title').status_code, status.HTTP_200_OK)
+
+    @override_settings(ROOT_URLCONF='wordplease.urls')  # base.html needs the users URLs
+    def test_latest_posts_page_uses_cursor_pagination(self):
+        """
+        Ensure that the latest posts page is paginated by cursor and still accepts page numbers
+        """
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.context['paginator'])
+        self.assertEqual(list(response.context['object_list']), [self.post3, self.post1])
+
+        response = self.client.get('/?page=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.context['paginator'].count, 2)
+
+
 class PostCountAPITest(PostsAPITests):
 
     def test_post_count_in_posts_list(self):
@@ -498,3 +631,876 @@ class PostCountAPITest(PostsAPITests):
         response = self.client.get('/1.0/blogs/')
         for blog in response.data.get('results'):
             self.assertEqual(blog.get('posts_count'), Post.objects.filter(blog__id=blog.get('id')).count())
+
+    def test_blogs_can_be_ordered_by_activity(self):
+        """
+        Ensure that blogs can be sorted by their last published post without aggregating
+        """
+        response = self.client.get('/1.0/blogs/?ordering=-last_published_at')
+        self.assertEqual([blog.get('id') for blog in response.data.get('results')], [self.post3.blog.pk, self.post1.blog.pk])
+
+
+class PostCountersTest(PostsAPITests):
+
+    def assertCounters(self, obj, posts_count, published_posts_count):
+        obj.refresh_from_db()
+        self.assertEqual((obj.posts_count, obj.published_posts_count), (posts_count, published_posts_count))
+
+    def test_counters_follow_post_changes(self):
+        """
+        Ensure that blog and category counters are kept up to date when posts are updated, deleted or recategorized
+        """
+        blog = self.post1.blog
+        self.assertCounters(blog, 2, 1)
+        self.assertEqual(blog.last_published_at, self.post1.publish_date)
+        self.assertCounters(self.category1, 2, 1)
+        self.assertCounters(self.category3, 4, 2)
+
+        self.post2.publish_date = timezone.now() - timedelta(days=1)
+        self.post2.save()
+        self.assertCounters(blog, 2, 2)
+        self.assertCounters(self.category2, 2, 2)
+
+        self.post2.categories.remove(self.category2)
+        self.assertCounters(self.category2, 1, 1)
+
+        self.post1.delete()
+        self.assertCounters(blog, 1, 1)
+        self.assertCounters(self.category1, 1, 0)
+        self.assertCounters(self.category3, 3, 2)
+
+    def test_scheduled_posts_are_counted_once_live(self):
+        """
+        Ensure that the periodic task publishes and counts the scheduled posts whose publish date has passed
+        """
+        Post.objects.filter(pk=self.post2.pk).update(publish_date=timezone.now() - timedelta(minutes=1))
+        response = self.client.get('/1.0/posts/{0}/'.format(self.post2.pk))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        self.assertEqual(publish_scheduled_posts(), 1)
+        self.assertEqual(publish_scheduled_posts(), 0)
+        self.assertCounters(self.post2.blog, 2, 2)
+        self.assertCounters(self.category2, 2, 2)
+        self.assertCounters(self.post4.blog, 2, 1)
+        response = self.client.get('/1.0/posts/{0}/'.format(self.post2.pk))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_publish_flag_follows_publish_date(self):
+        """
+        Ensure that saving a post materializes whether it is published
+        """
+        self.assertEqual(
+            list(Post.objects.filter(is_published=True).order_by('pk')), [self.post1, self.post3]
+        )
+        self.post1.publish_date = timezone.now() + timedelta(days=1)
+        self.post1.save(update_fields=['publish_date'])
+        self.post1.refresh_from_db()
+        self.assertFalse(self.post1.is_published)
+
+
+class FragmentCacheTest(PostsAPITests):
+
+    def setUp(self):
+        super(FragmentCacheTest, self).setUp()
+        get_fragment_cache().clear()
+        fragment_cache_stats.reset()
+
+    def test_lru_cache_evicts_least_recently_used(self):
+        """
+        Ensure that the local memory LRU backend evicts the entry that was used least recently
+        """
+        cache = LRUCache('lru-test', {'OPTIONS': {'MAX_ENTRIES': 3}})
+        cache.clear()
+        for key in ('a', 'b', 'c'):
+            cache.set(key, key)
+        cache.get('a')
+        cache.set('d', 'd')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual([cache.get(key) for key in ('a', 'c', 'd')], ['a', 'c', 'd'])
+
+    @override_settings(ROOT_URLCONF='wordplease.urls')  # base.html needs the users URLs
+    def test_blog_fragments_are_invalidated_on_post_change(self):
+        """
+        Ensure that blog page fragments are served from cache until one of the blog posts changes
+        """
+        url = '/blogs/{0}/'.format(self.user.username)
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertContains(response, self.post3.title)
+        stats = fragment_cache_stats.as_dict()
+        self.assertEqual((stats['post_list']['hits'], stats['post_list']['misses']), (1, 1))
+        self.assertEqual((stats['blog_header']['hits'], stats['blog_header']['misses']), (1, 1))
+
+        self.post3.title = 'A brand new title'
+        self.post3.save()
+        response = self.client.get(url)
+        self.assertContains(response, 'A brand new title')
+        self.assertEqual(fragment_cache_stats.as_dict()['post_list']['misses'], 2)
+
+    def test_stats_are_reported_to_staff(self):
+        """
+        Ensure that only staff users can read and reset the fragment cache stats of the process
+        """
+        fragment_cache_stats.record('post_list', True)
+        fragment_cache_stats.record('post_list', False)
+        self.assertEqual(self.client.get('/1.0/stats/fragment-cache/').status_code, status.HTTP_403_FORBIDDEN)
+        self.client.login(username=self.user.username, password=self.user.raw_password)
+        self.assertEqual(self.client.get('/1.0/stats/fragment-cache/').status_code, status.HTTP_403_FORBIDDEN)
+        User.objects.create_user('staff', 'staff@wordplease', 'supersecretpassword', is_staff=True)
+        self.client.login(username='staff', password='supersecretpassword')
+        response = self.client.get('/1.0/stats/fragment-cache/')
+        self.assertEqual(response.data['pid'], os.getpid())
+        self.assertEqual(response.data['fragments']['post_list']['hit_ratio'], 0.5)
+        self.client.delete('/1.0/stats/fragment-cache/')
+        self.assertEqual(fragment_cache_stats.as_dict(), {})
+
+
+class FeedTest(PostsAPITests):
+
+    def setUp(self):
+        super(FeedTest, self).setUp()
+        get_fragment_cache().clear()
+
+    def test_blog_feed_is_cached_until_its_posts_change(self):
+        """
+        Ensure that the blog feed lists its published posts, is rendered once per change of the blog posts and
+        answers 304 for its ETag
+        """
+        url = '/blogs/{0}/feed'.format(self.user.username)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, self.post3.title)
+        self.assertNotContains(response, self.post4.title)
+        self.assertContains(response, '<category>Category Two</category>')
+        etag = response['ETag']
+
+        with self.assertNumQueries(2):  # the blog pk for its cache version, once per request
+            self.assertEqual(self.client.get(url).content, response.content)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.post4.publish_date = timezone.now() - timedelta(days=1)
+        self.post4.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, self.post4.title)
+        self.assertEqual(self.client.get('/blogs/nobody/feed').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_atom_and_category_feeds(self):
+        """
+        Ensure that the Atom feeds are served and the category feed only lists the category published posts
+        """
+        response = self.client.get('/blogs/{0}/feed/atom'.format(self.user.username))
+        self.assertEqual(response['Content-Type'], 'application/atom+xml; charset=utf-8')
+        self.assertContains(response, self.post3.title)
+
+        response = self.client.get('/categories/Category One/feed')
+        self.assertContains(response, self.post1.title)
+        self.assertNotContains(response, self.post3.title)
+        self.assertNotContains(response, self.post4.title)
+        self.assertEqual(self.client.get('/categories/Missing/feed').status_code, status.HTTP_404_NOT_FOUND)
+
+
+class SitemapTest(PostsAPITests):
+
+    def setUp(self):
+        super(SitemapTest, self).setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+
+    def update(self, **kwargs):
+        with self.settings(MEDIA_ROOT=self.media_root):
+            return update_sitemaps('http://testserver', sections=(BlogSitemap(2), PostSitemap(2)), **kwargs)
+
+    def test_only_changed_chunks_are_written(self):
+        """
+        Ensure that the sitemap files are split by pk ranges and only those of changed objects are written again
+        """
+        self.assertEqual(self.update(), (3, 3))
+        self.assertEqual(self.update(), (0, 3))
+        self.post3.title = 'A brand new title'
+        self.post3.save()
+        self.assertEqual(self.update(), (2, 3))  # the posts chunk and the blogs one, the post touched its blog
+
+        with self.settings(MEDIA_ROOT=self.media_root):
+            index = self.client.get('/sitemap.xml')
+            posts = self.client.get('/sitemap-posts-1.xml')
+        self.assertContains(index, '<loc>http://testserver/sitemap-posts-1.xml</loc>')
+        self.assertContains(posts, '<loc>http://testserver/blogs/mindundi/{0}</loc>'.format(self.post3.pk))
+        self.assertNotContains(posts, '/{0}</loc>'.format(self.post4.pk))  # not published yet
+
+    def test_sitemaps_are_precompressed(self):
+        """
+        Ensure that the gzipped copy is served to clients accepting gzip and files of emptied chunks are removed
+        """
+        self.update(gzip_min_bytes=0)
+        with self.settings(MEDIA_ROOT=self.media_root):
+            response = self.client.get('/sitemap-posts-0.xml', HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertIn(b'<urlset', zlib.decompress(b''.join(response.streaming_content), 16 + zlib.MAX_WBITS))
+
+            self.post1.delete()
+            self.update(gzip_min_bytes=0)
+            self.assertEqual(self.client.get('/sitemap-posts-0.xml').status_code, status.HTTP_404_NOT_FOUND)
+            self.assertEqual(sorted(os.listdir(os.path.join(self.media_root, 'sitemaps'))), [
+                'manifest.json', 'sitemap-blogs-0.xml', 'sitemap-blogs-0.xml.gz', 'sitemap-posts-1.xml',
+                'sitemap-posts-1.xml.gz', 'sitemap.xml', 'sitemap.xml.gz'
+            ])
+
+    def test_renamed_owners_rewrite_their_chunks(self):
+        """
+        Ensure that renaming a blog owner writes again the chunks listing the URLs of their blog and posts
+        """
+        self.update()
+        self.user.last_login = timezone.now()
+        self.user.save(update_fields=['last_login'])
+        self.assertEqual(self.update(), (1, 3))  # the blogs chunk, its owner data changed
+
+        self.user.username = 'renamed'
+        self.user.save()
+        self.assertEqual(self.update(), (2, 3))  # the blogs chunk and the chunk of its posts
+        with self.settings(MEDIA_ROOT=self.media_root):
+            posts = self.client.get('/sitemap-posts-1.xml')
+        self.assertContains(posts, '<loc>http://testserver/blogs/renamed/{0}</loc>'.format(self.post3.pk))
+
+
+class ConditionalGetAPITest(PostsAPITests):
+
+    def test_unchanged_posts_list_is_not_modified(self):
+        """
+        Ensure that polling an unchanged posts list answers 304 and that any post change refreshes it
+        """
+        response = self.client.get('/1.0/posts/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.has_header('Last-Modified'))
+        etag = response['ETag']
+
+        response = self.client.get('/1.0/posts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.post3.title = 'A brand new title'
+        self.post3.save()
+        response = self.client.get('/1.0/posts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_blog_detail_validators(self):
+        """
+        Ensure that the blog detail answers 304 for its ETag and 404 for missing blogs
+        """
+        url = '/1.0/blogs/{0}/'.format(self.post3.blog.pk)
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self.client.get('/1.0/blogs/0/').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_anonymous_responses_are_cached_server_side(self):
+        """
+        Ensure that repeated anonymous polls only run the validator queries
+        """
+        first = self.client.get('/1.0/posts/{0}/'.format(self.post3.pk))
+        with self.assertNumQueries(1):
+            second = self.client.get('/1.0/posts/{0}/'.format(self.post3.pk))
+        self.assertEqual(first.data, second.data)
+
+    def test_category_changes_refresh_the_post(self):
+        """
+        Ensure that changing only the categories of a post changes its validators and its list's
+        """
+        url = '/1.0/posts/{0}/'.format(self.post3.pk)
+        etag, list_etag = self.client.get(url)['ETag'], self.client.get('/1.0/posts/')['ETag']
+        self.post3.categories.add(Category.objects.create(name='Brand new'))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('Brand new', response.data['categories'])
+        self.assertEqual(self.client.get('/1.0/posts/', HTTP_IF_NONE_MATCH=list_etag).status_code, status.HTTP_200_OK)
+
+        etag = response['ETag']
+        Category.objects.get(name='Brand new').posts.clear()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+
+class PostExportAPITest(PostsAPITests):
+
+    def read_lines(self, response):
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+
+    def test_blog_posts_are_streamed_as_json_lines(self):
+        """
+        Ensure that the blog export streams its published posts, and the unpublished ones too to its owner
+        """
+        url = '/1.0/blogs/{0}/export/'.format(self.post3.blog.pk)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        posts = self.read_lines(response)
+        self.assertEqual([post['id'] for post in posts], [self.post3.pk])
+        self.assertEqual(posts[0]['type'], 'post')
+        self.assertEqual(posts[0]['blog'], 'mindundi')
+        self.assertEqual(posts[0]['categories'], ['Category Three', 'Category Two'])
+
+        self.client.login(username=self.user.username, password=self.user.raw_password)
+        self.assertEqual([post['id'] for post in self.read_lines(self.client.get(url))], [self.post3.pk, self.post4.pk])
+
+    def test_all_posts_are_exported_gzipped_to_superusers(self):
+        """
+        Ensure that only superusers export every blog and that the stream is gzipped if the client accepts it
+        """
+        self.client.login(username=self.user.username, password=self.user.raw_password)
+        self.assertEqual(self.client.get('/1.0/blogs/export/').status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.login(username=self.superuser.username, password=self.superuser.raw_password)
+        response = self.client.get('/1.0/blogs/export/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        lines = zlib.decompress(b''.join(response.streaming_content), 16 + zlib.MAX_WBITS).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 4)
+
+    def test_categories_are_loaded_once_per_chunk(self):
+        """
+        Ensure that exports read the categories with one query per chunk of posts, not per post
+        """
+        with self.assertNumQueries(3):
+            lines = list(export_posts(Post.objects.order_by('pk'), chunk_size=2))
+        self.assertEqual(len(lines), 4)
+
+class QueryBudgetTest(QueryBudgetTestMixin, PostsAPITests):
+
+    def setUp(self):
+        super(QueryBudgetTest, self).setUp()
+        for i in range(5):  # enough rows to reveal N+1 queries
+            post = Post.objects.create(
+                blog=self.post3.blog, title='Extra post {0}'.format(i), intro='Intro', body='Body',
+                publish_date=timezone.now() - timedelta(hours=i + 1)
+            )
+            post.categories.add(self.category1)
+        get_fragment_cache().clear()
+
+    def test_api_query_budget(self):
+        """
+        Ensure that the API endpoints run a fixed number of queries whatever the number of posts
+        """
+        with self.assertQueryBudget(4):
+            self.client.get('/1.0/posts/?search=post')
+        with self.assertQueryBudget(3):
+            self.client.get('/1.0/posts/{0}/'.format(self.post3.pk))
+        with self.assertQueryBudget(3):
+            self.client.get('/1.0/blogs/')
+        with self.assertQueryBudget(5):
+            self.client.get('/1.0/blogs/{0}/'.format(self.post3.blog.pk))
+
+    @override_settings(ROOT_URLCONF='wordplease.urls')  # base.html needs the users URLs
+    def test_pages_query_budget(self):
+        """
+        Ensure that the HTML pages run a fixed number of queries whatever the number of posts
+        """
+        with self.assertQueryBudget(1):
+            self.client.get('/')
+        with self.assertQueryBudget(3):
+            self.client.get('/blogs/{0}/'.format(self.user.username))
+        with self.assertQueryBudget(3):
+            self.client.get('/blogs/{0}/{1}'.format(self.user.username, self.post3.pk))
+
+    @override_settings(QUERY_BUDGET_ENABLED=True)
+    def test_query_budget_headers(self):
+        """
+        Ensure that the query budget middleware reports the queries of every request
+        """
+        response = self.client.get('/1.0/posts/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(0 < int(response['X-Query-Count']) <= 4)
+        self.assertIn('X-Query-Time', response)
+
+    def test_benchmark_regressions(self):
+        """
+        Ensure that benchmark stats use nearest-rank percentiles and extra queries or slower p95s fail the baseline
+        """
+        stats = summarize([i / 1000.0 for i in range(1, 101)], [3] * 100, 2, [200] * 100)
+        self.assertEqual((stats['p50_ms'], stats['p95_ms'], stats['p99_ms']), (50, 95, 99))
+        self.assertEqual(stats['throughput'], 50)
+        baseline = {'api_posts@10x10/c1': dict(stats), 'gone@10x10/c1': dict(stats)}
+        self.assertEqual(compare({'api_posts@10x10/c1': stats}, baseline, 0.25), [])
+
+        slower = dict(stats, p95_ms=200, queries=4)
+        self.assertEqual(compare({'api_posts@10x10/c1': slower}, baseline, 0.25), [
+            'api_posts@10x10/c1: 4 queries per request, baseline 3',
+            'api_posts@10x10/c1: p95 200ms, baseline 95.0ms',
+        ])
+
+    def test_benchmark_memory_is_sampled_per_run(self):
+        """
+        Ensure that the peak memory describes one run, not the largest run before it, and bigger peaks fail the baseline
+        """
+        result, peak = traced_peak_kb(lambda: len(bytearray(10 * 1024 * 1024)))
+        self.assertEqual(result, 10 * 1024 * 1024)
+        if peak is not None:  # tracemalloc is not available on Python 2
+            self.assertGreaterEqual(peak, 10 * 1024)
+            self.assertLess(traced_peak_kb(lambda: None)[1], 1024)
+
+        stats = summarize([0.01] * 10, [3] * 10, 1, [200] * 10)
+        baseline = {'api_posts@10x10/c1': dict(stats, peak_kb=1000)}
+        self.assertEqual(compare({'api_posts@10x10/c1': dict(stats, peak_kb=1200)}, baseline, 0.25), [])
+        self.assertEqual(compare({'api_posts@10x10/c1': dict(stats, peak_kb=2000)}, baseline, 0.25), [
+            'api_posts@10x10/c1: peak memory 2000 KB, baseline 1000 KB',
+        ])
+
+
+class SeedDataTest(BlogsModuleTests):
+
+    def test_seeded_data_is_deterministic_and_counted(self):
+        """
+        Ensure that the seeder bulk inserts posts with their categories, counters and sequences kept consistent and
+        the same seed generates the same content
+        """
+        call_command('seed_data', blogs=5, posts=60, batch_size=7, skip_index=True, stdout=StringIO())
+        self.assertEqual(Blog.objects.count(), 5)
+        self.assertEqual(Post.objects.count(), 60)
+        self.assertEqual(sum(Blog.objects.values_list('published_posts_count', flat=True)),
+                         Post.objects.filter(publish_date__lte=timezone.now()).count())
+        self.assertTrue(Post.categories.through.objects.exists())
+        self.assertTrue(Category.objects.get(name='Category 0').posts_count > 0)
+        self.assertTrue(User.objects.get(username='seed0').check_password('wordplease'))
+
+        titles = list(Post.objects.order_by('pk').values_list('title', flat=True))
+        call_command('seed_data', blogs=5, posts=60, prefix='again', skip_index=True, stdout=StringIO())
+        self.assertEqual(list(Post.objects.filter(blog__owner__username__startswith='again').order_by('pk').values_list(
+            'title', flat=True
+        )), titles)
+        post = Post.objects.create(blog=Blog.objects.first(), title='New', intro='Intro', body='Body')
+        self.assertEqual(post.pk, 121)
+
+
+
+class ImportJSONLinesTest(BlogsModuleTests):
+
+    def write_lines(self, *objects):
+        path = os.path.join(self.directory, 'import.jsonl')
+        with open(path, 'a') as f:
+            for obj in objects:
+                f.write((obj if isinstance(obj, str) else json.dumps(obj)) + '\n')
+        return path
+
+    def setUp(self):
+        super(ImportJSONLinesTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_lines_are_imported_in_chunks_and_errors_skipped(self):
+        """
+        Ensure that users, blogs, categories and posts are imported with their counters and bad lines are reported
+        without stopping the import
+        """
+        path = self.write_lines(
+            {'type': 'category', 'name': 'Python'},
+            {'type': 'user', 'username': 'ana', 'email': 'ana@example.com', 'blog': {'name': 'Ana writes'}},
+            {'type': 'post', 'blog': 'ana', 'title': 'One', 'body': 'Body', 'categories': ['Python', 'Django']},
+            'not json',
+            {'type': 'post', 'blog': 'nobody', 'title': 'Lost'},
+            {'type': 'user', 'username': 'bob'},
+            {'type': 'post', 'blog': 'ana', 'title': 'Two', 'publish_date': '2001-01-01T10:00:00'},
+            {'type': 'post', 'blog': 'bob', 'title': 'Later', 'publish_date': '2100-01-01T10:00:00Z'},
+            {'type': 'user', 'username': 'ana'},
+        )
+        stderr = StringIO()
+        call_command('import_jsonl', path, chunk_size=3, batch_size=2, stdout=StringIO(), stderr=stderr)
+
+        ana = Blog.objects.get(owner__username='ana')
+        self.assertEqual(ana.name, 'Ana writes')
+        self.assertFalse(ana.owner.has_usable_password())
+        self.assertEqual(Blog.objects.get(owner__username='bob').name, "bob's blog")
+        self.assertEqual(ana.published_posts_count, 2)
+        self.assertEqual(Blog.objects.get(owner__username='bob').published_posts_count, 0)
+        self.assertEqual(list(Post.objects.order_by('pk').values_list('title', 'is_published')), [
+            ('One', True), ('Two', True), ('Later', False)
+        ])
+        self.assertEqual(Category.objects.get(name='Django').posts_count, 1)
+        self.assertEqual(stderr.getvalue().count('Line at byte'), 3)
+        self.assertFalse(os.path.exists(path + '.checkpoint'))
+
+    def test_interrupted_imports_resume_after_the_checkpoint(self):
+        """
+        Ensure that a resumed import starts at the offset of the checkpoint, after the lines already imported
+        """
+        path = self.write_lines({'type': 'user', 'username': 'ana'}, {'type': 'post', 'blog': 'ana', 'title': 'One'})
+        call_command('import_jsonl', path, stdout=StringIO())
+        offset = os.path.getsize(path)
+        self.write_lines({'type': 'post', 'blog': 'ana', 'title': 'Two'})
+        write_checkpoint(path + '.checkpoint', {'offset': offset, 'first_post_pk': None})
+
+        call_command('import_jsonl', path, resume=True, stdout=StringIO())
+        self.assertEqual(list(Post.objects.order_by('pk').values_list('title', flat=True)), ['One', 'Two'])
+        self.assertEqual(Blog.objects.get().published_posts_count, 2)
+        self.assertFalse(os.path.exists(path + '.checkpoint'))
+
+    def test_files_without_lines_are_imported(self):
+        """
+        Ensure that empty files, blank lines and offsets at the end of the file import nothing without failing
+        """
+        path = self.write_lines()
+        call_command('import_jsonl', path, stdout=StringIO())
+        path = self.write_lines('', '  ')
+        call_command('import_jsonl', path, stdout=StringIO())
+        call_command('import_jsonl', path, offset=os.path.getsize(path), stdout=StringIO())
+        self.assertFalse(Post.objects.exists())
+        self.assertFalse(os.path.exists(path + '.checkpoint'))
+
+
+class ImageRenditionsTest(PostsAPITests):
+
+    def setUp(self):
+        super(ImageRenditionsTest, self).setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.source = os.path.join(self.media_root, 'source.png')
+        Image.new('RGBA', (1000, 800), (200, 100, 50, 255)).save(self.source)
+
+    def test_renditions_are_resized_from_one_decode(self):
+        """
+        Ensure that every rendition is written without upscaling and smaller sources share the rendition files
+        """
+        with self.settings(MEDIA_ROOT=self.media_root):
+            manifest = build_renditions(self.source, 'post', formats=['JPEG'])
+            small = os.path.join(self.media_root, 'small.jpg')
+            Image.new('RGB', (300, 200)).save(small)
+            small_manifest = build_renditions(small, 'small', formats=['JPEG'])
+
+        self.assertEqual(
+            dict((name, (rendition['width'], rendition['height'])) for name, rendition in manifest.items()),
+            {'card': (375, 300), 'detail': (750, 600), 'retina': (1000, 800)}
+        )
+        self.assertTrue(manifest['card']['jpeg'].endswith('/post-card.jpg'))
+        self.assertEqual(Image.open(os.path.join(self.media_root, 'post-card.jpg')).size, (375, 300))
+        self.assertEqual(small_manifest['card'], small_manifest['retina'])
+        self.assertEqual(sorted(os.listdir(self.media_root)), [
+            'post-card.jpg', 'post-detail.jpg', 'post-retina.jpg', 'small-retina.jpg', 'small.jpg', 'source.png'
+        ])
+
+    def test_huge_images_are_decoded_with_bounded_memory(self):
+        """
+        Ensure that JPEGs are decoded at a reduced scale and images over the limits are refused before decoding
+        """
+        source = os.path.join(self.media_root, 'huge.jpg')
+        Image.new('RGB', (4000, 3000), (10, 20, 30)).save(source, quality=50)
+        report = {}
+        with self.settings(MEDIA_ROOT=self.media_root):
+            manifest = build_renditions(source, 'huge', formats=['JPEG'], report=report)
+        self.assertEqual(report['source_size'], (4000, 3000))
+        self.assertEqual(report['decoded_size'], (2000, 1500))  # 1/2 scale still covers the 1600x1200 retina size
+        self.assertEqual(report['peak_bytes'], (2000 * 1500 + 1600 * 1200) * 4)  # the decode and its retina resize
+        self.assertEqual((manifest['retina']['width'], manifest['retina']['height']), (1600, 1200))
+
+        with self.assertRaises(ImageTooLarge):
+            open_bounded(source, (400, 300), max_pixels=1000 * 1000)
+        with self.assertRaises(ImageTooLarge):
+            open_bounded(self.source, (400, 300), max_decode_bytes=1000 * 800 * 4 - 1)  # PNGs have no reduced decode
+        self.assertEqual(open_bounded(source, (400, 300)).size, (500, 375))
+
+    def test_placeholders_describe_the_image(self):
+        """
+        Ensure that the BlurHash placeholder keeps the average color and the layout of the image
+        """
+        gradient = Image.new('RGB', (32, 24))
+        gradient.putdata([(x * 8, 100, 50) for y in range(24) for x in range(32)])
+        blurhash = encode_blurhash(gradient)
+        self.assertEqual(len(blurhash), 28)
+        pixels = decode_blurhash(blurhash, 16, 12)
+        self.assertLess(pixels[6, 0, 0], pixels[6, 15, 0])  # red grows from left to right
+        self.assertTrue(abs(int(pixels[6, 8, 1]) - 100) < 10)
+        self.assertTrue(placeholder_data_uri(blurhash).startswith('data:image/png;base64,'))
+
+    def test_api_serves_renditions_and_srcset(self):
+        """
+        Ensure that posts expose their renditions manifest and a srcset once the image is processed
+        """
+        with self.settings(MEDIA_ROOT=self.media_root):
+            manifest = build_renditions(self.source, self.post1.pk, formats=['JPEG'])
+        Post.objects.filter(pk=self.post1.pk).update(
+            image_url=manifest['detail']['jpeg'], image_renditions=json.dumps(manifest)
+        )
+        response = self.client.get('/1.0/posts/{0}/'.format(self.post1.pk))
+        self.assertEqual(response.data.get('image_renditions'), manifest)
+        self.assertIn('image_placeholder', self.client.get('/1.0/posts/').data['results'][0])
+        self.assertEqual(response.data.get('image_srcset'), '{0} 375w, {1} 750w, {2} 1000w'.format(
+            manifest['card']['jpeg'], manifest['detail']['jpeg'], manifest['retina']['jpeg']
+        ))
+
+        self.post1.refresh_from_db()
+        self.post1.image_url = 'http://example.com/other.jpg'
+        self.post1.save()
+        self.assertEqual(self.post1.get_image_renditions(), {})
+
+    def test_images_are_downloaded_in_batches(self):
+        """
+        Ensure that the batch task downloads and processes the images of the given posts
+        """
+        server = self.start_image_server()
+        for post in (self.post1, self.post3):
+            Post.objects.filter(pk=post.pk).update(image_url='{0}{1}.jpg'.format(server.url, post.pk))
+
+        with self.settings(MEDIA_ROOT=self.media_root):
+            self.assertEqual(download_post_images([self.post1.pk, self.post2.pk, self.post3.pk]), 2)
+
+        self.post3.refresh_from_db()
+        self.assertEqual(sorted(self.post3.get_image_renditions()), ['card', 'detail', 'retina'])
+        self.assertEqual(len(self.post3.image_placeholder), 28)  # 4x3 components BlurHash
+        self.assertEqual(self.post3.image_url, self.post3.get_image_url('detail'))
+        self.assertTrue(os.path.exists(os.path.join(
+            self.media_root, blob_path(self.post3.image_blob_id, '-card.jpg')
+        )))
+
+    def test_undecodable_images_do_not_stop_the_batch(self):
+        """
+        Ensure that an image Pillow fails to decode is skipped and the rest of the batch is processed
+        """
+        import blogs.tasks
+        build = blogs.tasks.build_renditions
+        calls = []
+
+        def failing_once(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                raise ValueError('broken image')
+            return build(*args, **kwargs)
+
+        blogs.tasks.build_renditions = failing_once
+        self.addCleanup(setattr, blogs.tasks, 'build_renditions', build)
+        server = self.start_image_server()
+        for post in (self.post1, self.post3):
+            Post.objects.filter(pk=post.pk).update(image_url='{0}{1}.jpg'.format(server.url, post.pk))
+
+        with self.settings(MEDIA_ROOT=self.media_root):
+            self.assertEqual(download_post_images([self.post1.pk, self.post3.pk]), 1)
+        self.assertEqual(len(calls), 2)
+
+    def test_repeated_images_are_stored_once(self):
+        """
+        Ensure that repeated URLs are downloaded once, identical bytes are stored once and unused images are removed
+        """
+        server = self.start_image_server()
+        Post.objects.filter(pk__in=[self.post1.pk, self.post2.pk]).update(image_url=server.url + 'same.jpg')
+        Post.objects.filter(pk=self.post3.pk).update(image_url=server.url + 'copy.jpg')
+
+        with self.settings(MEDIA_ROOT=self.media_root):
+            download_post_images([self.post1.pk, self.post2.pk, self.post3.pk])
+        self.assertEqual(server.requests, 2)
+        blob = ImageBlob.objects.get()
+        self.assertEqual(blob.refcount, 3)
+        self.assertEqual(RemoteImage.objects.filter(blob=blob).count(), 2)
+        files = os.listdir(os.path.join(self.media_root, os.path.dirname(blob_path(blob.digest))))
+        self.assertEqual(len(files), 4)  # original and 3 renditions
+
+        for post in Post.objects.filter(image_blob=blob):
+            post.delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.refcount, 0)
+        with self.settings(MEDIA_ROOT=self.media_root):
+            call_command('gc_image_blobs', grace=0, stdout=StringIO())
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertFalse(RemoteImage.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.media_root, os.path.dirname(blob_path(blob.digest)))), [])
+
+    def test_reused_images_are_not_collected(self):
+        """
+        Ensure that an old unused image is kept while a worker reuses it for a repeated URL
+        """
+        server = self.start_image_server()
+        Post.objects.filter(pk=self.post1.pk).update(image_url=server.url + 'image.jpg')
+        with self.settings(MEDIA_ROOT=self.media_root):
+            download_post_images([self.post1.pk])
+        Post.objects.filter(pk=self.post1.pk).update(image_blob=None)
+        long_ago = timezone.now() - timedelta(days=1)
+        ImageBlob.objects.update(refcount=0, created_at=long_ago)
+        RemoteImage.objects.update(fetched_at=long_ago)
+
+        blob = fetch_image_blob(None, server.url + 'image.jpg')  # reused before the post is assigned
+        with self.settings(MEDIA_ROOT=self.media_root):
+            call_command('gc_image_blobs', grace=3600, stdout=StringIO())
+        self.assertTrue(ImageBlob.objects.filter(pk=blob.pk).exists())
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, blob_path(blob.digest, '.' + blob.extension))))
+        self.assertEqual(server.requests, 1)
+
+    def test_stored_images_are_reprocessed_once(self):
+        """
+        Ensure that images made with other rendition settings are rebuilt, posts updated and done images skipped
+        """
+        server = self.start_image_server()
+        Post.objects.filter(pk=self.post1.pk).update(image_url=server.url + 'image.jpg')
+        checkpoint = os.path.join(self.media_root, 'reprocess.checkpoint')
+        with self.settings(MEDIA_ROOT=self.media_root):
+            download_post_images([self.post1.pk])
+            ImageBlob.objects.update(renditions_version='', renditions='', placeholder='')
+            Post.objects.filter(pk=self.post1.pk).update(image_renditions='', image_placeholder='')
+            blob = ImageBlob.objects.get()
+            store_dir = os.path.join(self.media_root, os.path.dirname(blob_path(blob.digest)))
+            inodes = {name: os.stat(os.path.join(store_dir, name)).st_ino for name in os.listdir(store_dir)}
+
+            output = StringIO()
+            call_command('reprocess_images', workers=1, chunk_size=1, checkpoint=checkpoint, stdout=output)
+            self.assertIn('Reprocessed 1 images, 0 errors', output.getvalue())
+            self.assertEqual(sorted(os.listdir(store_dir)), sorted(inodes))  # no temporary files left
+            for name, inode in inodes.items():  # the renditions being served are replaced, not rewritten in place
+                replaced = os.stat(os.path.join(store_dir, name)).st_ino != inode
+                self.assertEqual(replaced, name != blob_path(blob.digest, '.' + blob.extension).split('/')[-1])
+            blob = ImageBlob.objects.get()
+            self.assertEqual(blob.renditions_version, renditions_version())
+            self.assertEqual(len(blob.placeholder), 28)
+            self.post1.refresh_from_db()
+            self.assertEqual(self.post1.image_renditions, blob.renditions)
+            self.assertEqual(self.post1.image_placeholder, blob.placeholder)
+
+            output = StringIO()
+            call_command('reprocess_images', workers=1, checkpoint=checkpoint, stdout=output)
+            self.assertIn('0 images to reprocess', output.getvalue())
+
+    def test_legacy_images_are_stored_and_reprocessed(self):
+        """
+        Ensure that the posts processed before the image store get their original stored and reprocessed
+        """
+        media_url = settings.BASE_URL + settings.MEDIA_URL
+        for post in (self.post1, self.post2):
+            shutil.copyfile(self.source, os.path.join(self.media_root, '{0}.png'.format(post.pk)))
+        Post.objects.filter(pk=self.post1.pk).update(image_url='{0}{1}-thumbnail.png'.format(media_url, self.post1.pk))
+        Post.objects.filter(pk=self.post2.pk).update(image_url='{0}{1}.png'.format(media_url, self.post2.pk))
+        Post.objects.filter(pk=self.post3.pk).update(image_url='{0}{1}-thumbnail.png'.format(media_url, self.post3.pk))
+
+        with self.settings(MEDIA_ROOT=self.media_root):
+            output, errors = StringIO(), StringIO()
+            call_command(
+                'reprocess_images', workers=1, checkpoint=os.path.join(self.media_root, 'reprocess.checkpoint'),
+                stdout=output, stderr=errors
+            )
+        self.assertIn('2 legacy images stored, 1 errors', output.getvalue())
+        self.assertIn('Reprocessed 1 images, 0 errors', output.getvalue())
+        self.assertIn('Post {0}'.format(self.post3.pk), errors.getvalue())  # its original is missing
+        blob = ImageBlob.objects.get()
+        self.assertEqual((blob.refcount, blob.renditions_version), (2, renditions_version()))
+        self.post1.refresh_from_db()
+        self.assertEqual(self.post1.image_url, self.post1.get_image_url('detail'))
+        self.assertEqual(self.post1.image_placeholder, blob.placeholder)
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, '{0}.png'.format(self.post1.pk))))
+
+    def start_image_server(self):
+        server = ImageServer(make_jpeg(1000, 800)).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+
+class ImageFetcherTest(BlogsModuleTests):
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.filename = os.path.join(self.directory, 'image')
+
+    def start_image_server(self, delay=0):
+        server = ImageServer(make_jpeg(400, 300), delay).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def test_downloads_are_limited(self):
+        """
+        Ensure that downloads give up on slow hosts and on images over the size limit
+        """
+        session = requests.Session()
+        server = self.start_image_server()
+        with self.assertRaises(ImageTooLarge):
+            download_image(session, server.url + 'big.jpg', self.filename, max_bytes=1024)
+
+        slow_server = self.start_image_server(delay=1)
+        with self.assertRaises((requests.ConnectionError, requests.Timeout)):
+            download_image(session, slow_server.url + 'slow.jpg', self.filename, timeout=(1, 0.2))
+
+    def test_failing_hosts_are_skipped(self):
+        """
+        Ensure that the circuit opens after consecutive failures and the host stats record them
+        """
+        server = self.start_image_server()
+        url = server.url + 'image.jpg'
+        server.server_close()  # refuses connections from now on
+        guard = HostGuard(threshold=2, cooldown=60)
+        session = requests.Session()
+        for i in range(2):
+            with self.assertRaises(requests.ConnectionError):
+                guard.fetch(session, url, self.filename)
+        with self.assertRaises(HostUnavailable) as context:
+            guard.fetch(session, url, self.filename)
+        self.assertGreater(context.exception.retry_after, 50)
+
+        stats = guard.stats()['127.0.0.1:{0}'.format(server.server_address[1])]
+        self.assertEqual((stats['requests'], stats['failures'], stats['rejected']), (2, 2, 1))
+        self.assertTrue(stats['circuit_open'])
+
+    def test_host_concurrency_is_capped(self):
+        """
+        Ensure that a host only gets IMAGE_HOST_CONCURRENCY downloads at the same time
+        """
+        guard = HostGuard(concurrency=2)
+        with guard.slot('example.com'), guard.slot('example.com'):
+            with self.assertRaises(HostUnavailable):
+                with guard.slot('example.com'):
+                    pass
+            with guard.slot('other.example.com'):
+                pass
+        with guard.slot('example.com'):
+            pass
+
+
+class ResizedImageTest(BlogsModuleTests):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        os.makedirs(os.path.join(self.media_root, 'images'))
+        Image.new('RGB', (1000, 800), (200, 100, 50)).save(os.path.join(self.media_root, 'images', 'photo.png'))
+
+    def test_images_are_resized_once_and_cached(self):
+        """
+        Ensure that allowed sizes are resized on first request and then served from the disk cache
+        """
+        with self.settings(MEDIA_ROOT=self.media_root):
+            response = self.client.get('/media/r/400x300/images/photo.png', HTTP_ACCEPT='image/webp,image/*')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn(response['Content-Type'], ('image/webp', 'image/jpeg'))
+            self.assertIn('Accept', response['Vary'])
+            image = Image.open(io.BytesIO(b''.join(response.streaming_content)))
+            self.assertEqual(image.size, (375, 300))
+
+            cached = os.path.join(self.media_root, 'r', '400x300', 'images', 'photo.png.jpg')
+            self.assertTrue(os.path.exists(cached))
+            cached_at = os.path.getmtime(cached) + 10
+            os.utime(cached, (cached_at, cached_at))
+            response = self.client.get('/media/r/400x300/images/photo.png')
+            self.assertEqual(response['Content-Type'], 'image/jpeg')
+            self.assertEqual(os.path.getmtime(cached), cached_at)  # not resized again
+
+            response = self.client.get(
+                '/media/r/400x300/images/photo.png', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+            )
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_only_allowed_media_images_are_resized(self):
+        """
+        Ensure that sizes out of the allow-list, missing files and paths out of MEDIA_ROOT are not found
+        """
+        with self.settings(MEDIA_ROOT=self.media_root):
+            for path in ('/media/r/401x300/images/photo.png', '/media/r/400x300/images/missing.png',
+                         '/media/r/400x300/../images/photo.png', '/media/r/400x300/%2E%2E/%2E%2E/etc/passwd'):
+                self.assertEqual(self.client.get(path).status_code, status.HTTP_404_NOT_FOUND, path)
+
+    def test_private_images_are_only_resized_for_their_owner(self):
+        """
+        Ensure that uploaded files are resized only for their owner, and that their resizes are not cached publicly
+        """
+        owner = User.objects.create_user('owner', 'owner@wordplease', 'supersecretpassword')
+        source = os.path.join(self.media_root, 'secret.png')
+        Image.new('RGB', (1000, 800)).save(source)
+        with self.settings(MEDIA_ROOT=self.media_root):
+            File.objects.create(owner=owner, file=source)
+            self.assertEqual(self.client.get('/media/r/400x300/secret.png').status_code, status.HTTP_403_FORBIDDEN)
+            self.assertFalse(os.path.exists(os.path.join(self.media_root, 'r', '400x300', 'secret.png.jpg')))
+            self.client.login(username='owner', password='supersecretpassword')
+            response = self.client.get('/media/r/400x300/secret.png')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn('private', response['Cache-Control'])
+            self.assertNotIn('public', response['Cache-Control'])
+            self.assertIn('public', self.client.get('/media/r/400x300/images/photo.png')['Cache-Control'])
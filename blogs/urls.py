@@ -1,12 +1,30 @@
 # -*- coding: utf-8 -*-
-from .views import PostList, BlogList, BlogDetail, PostDetail, NewPost
+import re
+
+from .feeds import (
+    BlogPostsAtomFeed, BlogPostsFeed, CategoryPostsAtomFeed, CategoryPostsFeed, LatestPostsAtomFeed, LatestPostsFeed
+)
+from .views import PostList, BlogList, BlogDetail, PostDetail, NewPost, ResizedImage, SitemapFile
+from django.conf import settings
 from django.conf.urls import url
 from django.contrib.auth.decorators import login_required
 
 urlpatterns = (
     url(r'^$', PostList.as_view(), name="latest_posts"),
+    url(r'^feed/?$', LatestPostsFeed(), name="latest_posts_feed"),
+    url(r'^feed/atom/?$', LatestPostsAtomFeed(), name="latest_posts_atom_feed"),
+    url(r'^(?P<name>sitemap)\.xml$', SitemapFile.as_view(), name="sitemap_index"),
+    url(r'^(?P<name>sitemap-[a-z]+-[0-9]+)\.xml$', SitemapFile.as_view(), name="sitemap"),
     url(r'^new-post/?$', login_required(NewPost.as_view()), name="new_post"),
     url(r'^blogs/?$', BlogList.as_view(), name="blog_list"),
     url(r'^blogs/(?P<username>[a-zA-Z0-9_]+)/?$', BlogDetail.as_view(), name="blog_detail"),
+    url(r'^blogs/(?P<username>[a-zA-Z0-9_]+)/feed/?$', BlogPostsFeed(), name="blog_feed"),
+    url(r'^blogs/(?P<username>[a-zA-Z0-9_]+)/feed/atom/?$', BlogPostsAtomFeed(), name="blog_atom_feed"),
+    url(r'^categories/(?P<name>[^/]+)/feed/?$', CategoryPostsFeed(), name="category_feed"),
+    url(r'^categories/(?P<name>[^/]+)/feed/atom/?$', CategoryPostsAtomFeed(), name="category_atom_feed"),
     url(r'^blogs/(?P<username>[a-zA-Z0-9_]+)/(?P<pk>[0-9]+)/?$', PostDetail.as_view(), name="post_detail"),
+    url(
+        r'^{0}r/(?P<width>[0-9]+)x(?P<height>[0-9]+)/(?P<name>.+)$'.format(re.escape(settings.MEDIA_URL.lstrip('/'))),
+        ResizedImage.as_view(), name="resized_image"
+    ),
 )
\ No newline at end of file
@@ -1,11 +1,21 @@
+import os
+import re
+
 from blogs.filters import PostFilter
 from blogs.forms import PostForm
+from blogs.images import available_formats, get_resized_image
+from blogs.settings import IMAGE_RESIZE_DIR, IMAGE_RESIZE_MAX_AGE, IMAGE_RESIZE_SIZES, SITEMAP_DIR
+from django.conf import settings
 from django.core.urlresolvers import reverse
-from django.db.models import Count
+from django.http import FileResponse, Http404, HttpResponseNotModified
 from django.shortcuts import get_object_or_404
-from django.utils.datetime_safe import datetime
-from django.views.generic import ListView, DetailView, CreateView
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.views.generic import ListView, DetailView, CreateView, View
+from django.views.static import was_modified_since
+from wordplease.media import check_media_permission, get_media_path
 from .models import Post, Blog, Category
+from .pagination import KeysetPaginationMixin
 
 
 class PostQueryset(object):
@@ -15,7 +25,7 @@ class PostQueryset(object):
         Uses PostFilter to filter by category if needed
         """
         return PostFilter(
-            self.request.GET, Post.objects.filter(publish_date__lte=datetime.now())
+            self.request.GET, Post.objects.select_related('blog__owner').filter(is_published=True)
         ).qs.order_by('-publish_date')
 
 
@@ -44,7 +54,7 @@ class PostDetail(PostQueryset, DetailView):
         return context
 
 
-class PostList(PostQueryset, ListView):
+class PostList(PostQueryset, KeysetPaginationMixin, ListView):
     template_name = 'blogs/latest_posts.html'
     paginate_by = 12
 
@@ -65,9 +75,7 @@ class BlogDetail(PostList):
 
 class BlogList(ListView):
     template_name = 'blogs/blog_list.html'
-    queryset = Blog.objects.select_related('owner').annotate(
-        posts_count=Count('posts')  # add a 'posts_count' attribute to every blog object counting the
-    ).order_by('name')
+    queryset = Blog.objects.select_related('owner').order_by('name')  # posts_count is kept in the blog row
 
 
 class NewPost(CreateView):
@@ -92,3 +100,72 @@ class NewPost(CreateView):
             return form
         else:
             return super(NewPost, self).get_form(form_class)
+
+
+class ResizedImage(View):
+    """
+    Serves a media image resized to one of the IMAGE_RESIZE_SIZES, as WebP if the browser accepts it and this server
+    can encode it or as JPEG otherwise. Renditions are resized on first request and then served from the disk cache.
+    The source permissions are checked as in wordplease.media, so uploaded files are only resized for their owner
+    """
+
+    def get(self, request, width, height, name):
+        width, height = int(width), int(height)
+        if (width, height) not in set(tuple(size) for size in IMAGE_RESIZE_SIZES):
+            raise Http404('Size not allowed')
+
+        relative_path = get_media_path(name)[1]
+        if relative_path.startswith(IMAGE_RESIZE_DIR + os.sep):
+            raise Http404('Image not found')
+        private = check_media_permission(request, relative_path)  # resizes are as private as their source
+
+        webp = 'image/webp' in request.META.get('HTTP_ACCEPT', '') and 'WEBP' in available_formats()
+        image_format, content_type = ('WEBP', 'image/webp') if webp else ('JPEG', 'image/jpeg')
+        try:
+            path = get_resized_image(relative_path, width, height, image_format)
+        except (IOError, ValueError):  # not an image or over the decode limits
+            raise Http404('Image not found')
+
+        modified_at = os.stat(path).st_mtime
+        if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), modified_at):
+            response = HttpResponseNotModified()
+        else:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+            response['Content-Length'] = os.path.getsize(path)
+        response['Last-Modified'] = http_date(modified_at)
+        patch_vary_headers(response, ('Accept',))
+        if private:
+            patch_cache_control(response, private=True, max_age=IMAGE_RESIZE_MAX_AGE)
+        else:
+            patch_cache_control(response, public=True, max_age=IMAGE_RESIZE_MAX_AGE)
+        return response
+
+
+class SitemapFile(View):
+    """
+    Serves the sitemap index and files written by the update_sitemaps command, the precompressed copy if there is
+    one and the client accepts gzip. Web servers can serve them from MEDIA_ROOT/SITEMAP_DIR instead (nginx
+    gzip_static)
+    """
+
+    def get(self, request, name):
+        path = os.path.join(settings.MEDIA_ROOT, SITEMAP_DIR, name + '.xml')
+        if not os.path.isfile(path):
+            raise Http404('Sitemap not found')
+        gzipped = os.path.isfile(path + '.gz') and \
+            re.search(r'\bgzip\b', request.META.get('HTTP_ACCEPT_ENCODING', '')) is not None
+        if gzipped:
+            path += '.gz'
+
+        modified_at = os.stat(path).st_mtime
+        if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), modified_at):
+            response = HttpResponseNotModified()
+        else:
+            response = FileResponse(open(path, 'rb'), content_type='application/xml')
+            response['Content-Length'] = os.path.getsize(path)
+            if gzipped:
+                response['Content-Encoding'] = 'gzip'
+        response['Last-Modified'] = http_date(modified_at)
+        patch_vary_headers(response, ('Accept-Encoding',))
+        patch_cache_control(response, public=True, max_age=0, must_revalidate=True)
+        return response
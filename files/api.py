@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
-from files.models import File
+from files.models import File, StorageUsage, UploadSession
 from files.permissions import FilePermission
-from files.serializers import FileSerializer
-from rest_framework.viewsets import ModelViewSet
+from files.serializers import FileSerializer, StorageUsageSerializer, UploadSessionSerializer
+from files.uploads import OffsetConflict, UploadError, cancel_upload, finish_upload, start_upload, write_chunk
+from rest_framework import status
+from rest_framework.decorators import detail_route, list_route
+from rest_framework.mixins import CreateModelMixin, DestroyModelMixin, RetrieveModelMixin
+from rest_framework.response import Response
+from rest_framework.viewsets import GenericViewSet, ModelViewSet
 from rest_framework.permissions import IsAuthenticated
 
 
@@ -19,12 +24,87 @@ class FileViewSet(ModelViewSet):
 
     def perform_update(self, serializer):
         """
-        Force auth user to be the file's owner
+        Replaced files keep their owner, whose quota they were checked against (a superuser may replace any file)
         """
-        serializer.save(owner=self.request.user)
+        serializer.save(owner=serializer.instance.owner)
 
     def get_queryset(self):
         """
         Returns logged user files or all if is superuser
         """
         return self.queryset if self.request.user.is_superuser else self.queryset.filter(owner=self.request.user)
+
+    @list_route()
+    def usage(self, request):
+        """
+        Returns the bytes and files stored by the auth user and their quotas
+        """
+        return Response(StorageUsageSerializer(StorageUsage.get_for(request.user)).data)
+
+
+class UploadSessionViewSet(CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet):
+    """
+    Resumable chunked uploads:
+
+    - POST /files/uploads/ with the filename and size (and optionally its sha256) starts an upload
+    - PATCH /files/uploads/<id>/ with an Upload-Offset header and the raw bytes as body writes a chunk
+    - GET /files/uploads/<id>/ returns the offset to resume an interrupted upload from
+    - POST /files/uploads/<id>/finalize/ creates the File once every byte has been uploaded
+    - DELETE /files/uploads/<id>/ cancels the upload
+    """
+    queryset = UploadSession.objects.all()
+    serializer_class = UploadSessionSerializer
+    permission_classes = (IsAuthenticated, FilePermission)
+    lookup_value_regex = '[0-9a-f-]{32,36}'
+
+    def get_queryset(self):
+        """
+        Returns logged user uploads or all if is superuser
+        """
+        return self.queryset if self.request.user.is_superuser else self.queryset.filter(owner=self.request.user)
+
+    def perform_create(self, serializer):
+        start_upload(serializer.save(owner=self.request.user))
+
+    def perform_destroy(self, instance):
+        cancel_upload(instance)
+
+    def partial_update(self, request, *args, **kwargs):
+        """
+        Streams the request body to the partial file. The body is read from request.stream, never through
+        request.data, so neither DRF nor Django buffer it
+        """
+        session = self.get_object()
+        try:
+            offset = int(request.META['HTTP_UPLOAD_OFFSET'])
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except (KeyError, ValueError):
+            return Response(
+                {'detail': 'Upload-Offset and Content-Length headers are required.'}, status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            write_chunk(session, offset, request.stream, length)
+        except OffsetConflict as exc:
+            response = Response({'detail': str(exc), 'offset': exc.offset}, status=status.HTTP_409_CONFLICT)
+            response['Upload-Offset'] = exc.offset
+            return response
+        except UploadError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        response = Response(self.get_serializer(session).data)
+        response['Upload-Offset'] = session.offset
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        response = super(UploadSessionViewSet, self).retrieve(request, *args, **kwargs)
+        response['Upload-Offset'] = response.data['offset']
+        return response
+
+    @detail_route(methods=['post'])
+    def finalize(self, request, pk=None):
+        session = self.get_object()
+        try:
+            uploaded = finish_upload(session)
+        except UploadError as exc:
+            return Response({'detail': str(exc), 'offset': session.offset}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(FileSerializer(uploaded, context=self.get_serializer_context()).data,
+                        status=status.HTTP_201_CREATED)
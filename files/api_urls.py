@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 from django.conf.urls import url, include
 from rest_framework.routers import DefaultRouter
-from files.api import FileViewSet
+from files.api import FileViewSet, UploadSessionViewSet
 
 router = DefaultRouter()
+router.register('files/uploads', UploadSessionViewSet)  # before files, uploads is not a file pk
 router.register('files', FileViewSet)
 
 urlpatterns = (
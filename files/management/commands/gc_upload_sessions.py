@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+from files.settings import UPLOAD_SESSION_TTL
+from files.uploads import gc_upload_sessions
+
+
+class Command(BaseCommand):
+    help = 'Removes the chunked uploads not resumed for a while, with their partial files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl', type=int, default=UPLOAD_SESSION_TTL, help='seconds an idle upload is kept')
+
+    def handle(self, *args, **options):
+        removed, freed = gc_upload_sessions(options['ttl'])
+        self.stdout.write(self.style.SUCCESS('Removed {0} stale uploads ({1} KB)'.format(removed, freed // 1024)))
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+from files.models import File, StorageUsage
+
+
+class Command(BaseCommand):
+    help = 'Repairs the stored file sizes and the storage usage of every owner from the files in the storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='only report the differences')
+
+    def handle(self, *args, **options):
+        """
+        Files are streamed ordered by owner, so only the totals of the current owner are kept in memory
+        """
+        storage = File._meta.get_field('file').storage
+        usages = dict((pk, (size, files)) for pk, size, files in StorageUsage.objects.values_list(
+            'pk', 'bytes', 'files'
+        ).iterator())
+        checked = sizes_fixed = missing = usages_fixed = 0
+        owner, totals = None, [0, 0]
+        rows = File.objects.order_by('owner', 'pk').values_list('pk', 'owner', 'file', 'size').iterator()
+        for pk, owner_pk, name, size in rows:
+            if owner_pk != owner:
+                usages_fixed += self.fix_usage(owner, totals, usages, options['dry_run'])
+                owner, totals = owner_pk, [0, 0]
+            try:
+                actual = storage.size(name)
+            except (IOError, OSError):
+                self.stderr.write('File #{0} is missing from the storage: {1}'.format(pk, name))
+                missing += 1
+                actual = 0
+            if actual != size:
+                sizes_fixed += 1
+                if not options['dry_run']:
+                    File.objects.filter(pk=pk).update(size=actual)
+            totals[0] += actual
+            totals[1] += 1
+            checked += 1
+        usages_fixed += self.fix_usage(owner, totals, usages, options['dry_run'])
+        for owner_pk in list(usages):  # owners without files left
+            usages_fixed += self.fix_usage(owner_pk, [0, 0], usages, options['dry_run'])
+
+        self.stdout.write(self.style.SUCCESS('{0} files checked, {1} missing. {2} {3} file sizes and {4} usages'.format(
+            checked, missing, 'Would fix' if options['dry_run'] else 'Fixed', sizes_fixed, usages_fixed
+        )))
+
+    def fix_usage(self, owner_pk, totals, usages, dry_run):
+        """
+        Saves the owner's totals if they differ from its usage. Returns 1 if they did
+        """
+        if owner_pk is None:
+            return 0
+        if usages.pop(owner_pk, None) == tuple(totals):
+            return 0
+        if not dry_run:
+            StorageUsage.update_usage([owner_pk])
+        return 1
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+import django.db.models.deletion
+
+
+def populate_storage_usage(apps, schema_editor):
+    """
+    Takes the sizes of the files already stored from the storage (missing files count 0 bytes, see
+    reconcile_storage_usage) and sums them by owner
+    """
+    File = apps.get_model('files', 'File')
+    StorageUsage = apps.get_model('files', 'StorageUsage')
+    for pk, name in File.objects.values_list('pk', 'file').iterator():
+        try:
+            size = os.path.getsize(os.path.join(settings.MEDIA_ROOT, name))  # names may be absolute, see upload_to
+        except OSError:
+            continue
+        File.objects.filter(pk=pk).update(size=size)
+    StorageUsage.objects.bulk_create(
+        StorageUsage(owner_id=row['owner'], bytes=row['bytes'] or 0, files=row['files'])
+        for row in File.objects.values('owner').annotate(bytes=Sum('size'), files=Count('id')).order_by()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('files', '0004_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='size',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='StorageUsage',
+            fields=[
+                ('owner', models.OneToOneField(
+                    on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='storage_usage',
+                    serialize=False, to=settings.AUTH_USER_MODEL
+                )),
+                ('bytes', models.BigIntegerField(default=0, editable=False)),
+                ('files', models.PositiveIntegerField(default=0, editable=False)),
+                ('quota_bytes', models.BigIntegerField(blank=True, null=True)),
+                ('quota_files', models.PositiveIntegerField(blank=True, null=True)),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(populate_storage_usage, migrations.RunPython.noop),
+    ]
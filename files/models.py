@@ -1,11 +1,130 @@
+import os
+import uuid
+
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, Sum
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.conf import settings
 
+from files.settings import STORAGE_QUOTA_BYTES, STORAGE_QUOTA_FILES, UPLOAD_DIR
+
+
+class QuotaExceeded(ValueError):
+    pass
+
 
 class File(models.Model):
 
     owner = models.ForeignKey(User)
     file = models.FileField(upload_to=settings.MEDIA_ROOT)
+    size = models.BigIntegerField(default=0, editable=False)  # bytes, counted in the owner's StorageUsage
     created_at = models.DateTimeField(auto_now_add=True)
     modified_at = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remembers the loaded owner to update its usage too if the file changes hands
+        """
+        instance = super(File, cls).from_db(db, field_names, values)
+        instance._loaded_owner_id = instance.__dict__.get('owner_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        if self.file:
+            try:
+                self.size = self.file.size  # known for new uploads, a stat of the stored file otherwise
+            except (IOError, OSError):  # missing from the storage, see reconcile_storage_usage
+                pass
+        super(File, self).save(*args, **kwargs)
+        self._loaded_owner_id = self.owner_id  # post_save receivers have already seen the previous owner
+
+
+class StorageUsage(models.Model):
+    """
+    Denormalized bytes and number of files stored by an owner, so quotas are checked without walking the storage.
+    Kept by update_usage when files are saved or deleted, and repaired by the reconcile_storage_usage command
+    """
+    owner = models.OneToOneField(User, primary_key=True, related_name='storage_usage')
+    bytes = models.BigIntegerField(default=0, editable=False)
+    files = models.PositiveIntegerField(default=0, editable=False)
+    quota_bytes = models.BigIntegerField(blank=True, null=True)  # overrides STORAGE_QUOTA_BYTES, None for the default
+    quota_files = models.PositiveIntegerField(blank=True, null=True)  # overrides STORAGE_QUOTA_FILES
+    modified_at = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def update_usage(cls, owner_pks):
+        """
+        Recomputes the usage of the given owners
+        """
+        owner_pks = [pk for pk in set(owner_pks) if pk]
+        if not owner_pks:
+            return
+        usage = dict(
+            (row['owner'], row) for row in File.objects.filter(owner__in=owner_pks).values('owner').annotate(
+                bytes=Sum('size'), files=Count('id')
+            )
+        )
+        for pk in owner_pks:
+            values = {'bytes': usage.get(pk, {}).get('bytes') or 0, 'files': usage.get(pk, {}).get('files', 0)}
+            if not cls.objects.filter(pk=pk).update(**values):
+                cls.objects.get_or_create(owner_id=pk, defaults=values)
+
+    @classmethod
+    def get_for(cls, owner):
+        """
+        Returns the owner's usage, unsaved and empty if nothing was stored yet
+        """
+        return cls.objects.filter(owner=owner).first() or cls(owner=owner)
+
+    def get_quota_bytes(self):
+        return STORAGE_QUOTA_BYTES if self.quota_bytes is None else self.quota_bytes
+
+    def get_quota_files(self):
+        return STORAGE_QUOTA_FILES if self.quota_files is None else self.quota_files
+
+    def check_quota(self, size, files=1, exclude_upload=None):
+        """
+        Raises QuotaExceeded if storing files more files of size bytes (negative when replacing a larger file) would
+        exceed the owner's quotas. Unfinished chunked uploads count as stored, except exclude_upload
+        """
+        pending = UploadSession.objects.filter(owner=self.owner_id)
+        if exclude_upload is not None:
+            pending = pending.exclude(pk=exclude_upload.pk)
+        pending = pending.aggregate(bytes=Sum('size'), files=Count('pk'))
+        quota_bytes, quota_files = self.get_quota_bytes(), self.get_quota_files()
+        if quota_bytes is not None and size > 0 and self.bytes + (pending['bytes'] or 0) + size > quota_bytes:
+            raise QuotaExceeded('Storage quota exceeded: {0} of {1} bytes used.'.format(
+                self.bytes + (pending['bytes'] or 0), quota_bytes
+            ))
+        if quota_files is not None and files > 0 and self.files + pending['files'] + files > quota_files:
+            raise QuotaExceeded('Storage quota exceeded: {0} of {1} files used.'.format(
+                self.files + pending['files'], quota_files
+            ))
+
+
+class UploadSession(models.Model):
+    """
+    A file being uploaded in chunks (see files.uploads). Its bytes are appended to a partial file until offset
+    reaches size and the upload is finalized into a File. Idle sessions are removed by the gc_upload_sessions command
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()  # declared by the client
+    offset = models.BigIntegerField(default=0)  # bytes received
+    sha256 = models.CharField(max_length=64, blank=True, default='')  # checked on finalize if given
+    created_at = models.DateTimeField(auto_now_add=True)
+    modified_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def get_partial_path(self):
+        return os.path.join(settings.MEDIA_ROOT, UPLOAD_DIR, '{0}.part'.format(self.pk.hex))
+
+
+@receiver(post_save, sender=File)
+@receiver(post_delete, sender=File)
+def update_storage_usage_on_file_change(sender, instance, **kwargs):
+    with transaction.atomic():
+        StorageUsage.update_usage([instance.owner_id, getattr(instance, '_loaded_owner_id', None)])
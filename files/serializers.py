@@ -1,10 +1,56 @@
 # -*- coding: utf-8 -*-
-from files.models import File
+from files.models import File, QuotaExceeded, StorageUsage, UploadSession
+from files.settings import UPLOAD_MAX_BYTES
 from rest_framework import serializers
 
 
-class FileSerializer(serializers.ModelSerializer):
+class QuotaSerializerMixin(object):
+
+    def check_quota(self, size, files=1, owner=None):
+        """
+        Checks the owner's quotas (the auth user's by default) before the file is stored
+        """
+        try:
+            StorageUsage.get_for(owner or self.context['request'].user).check_quota(size, files)
+        except QuotaExceeded as exc:
+            raise serializers.ValidationError(str(exc))
+
+
+class FileSerializer(QuotaSerializerMixin, serializers.ModelSerializer):
 
     class Meta:
         model = File
         read_only_fields = ('owner',)
+
+    def validate_file(self, value):
+        """
+        The uploaded file is still a temporary file here: a file over the quotas is never stored
+        """
+        if self.instance is None:
+            self.check_quota(value.size)
+        else:  # replacing a file
+            self.check_quota(value.size - self.instance.size, files=0, owner=self.instance.owner)
+        return value
+
+
+class UploadSessionSerializer(QuotaSerializerMixin, serializers.ModelSerializer):
+
+    class Meta:
+        model = UploadSession
+        fields = ('id', 'filename', 'size', 'offset', 'sha256', 'created_at', 'modified_at')
+        read_only_fields = ('offset',)
+
+    def validate_size(self, value):
+        if not 0 <= value <= UPLOAD_MAX_BYTES:
+            raise serializers.ValidationError('Uploads can not be larger than {0} bytes.'.format(UPLOAD_MAX_BYTES))
+        self.check_quota(value)  # unfinished uploads count as stored until they are finalized or collected
+        return value
+
+
+class StorageUsageSerializer(serializers.ModelSerializer):
+    quota_bytes = serializers.ReadOnlyField(source='get_quota_bytes')
+    quota_files = serializers.ReadOnlyField(source='get_quota_files')
+
+    class Meta:
+        model = StorageUsage
+        fields = ('bytes', 'files', 'quota_bytes', 'quota_files')
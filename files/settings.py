@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+from django.conf import settings
+
+UPLOAD_DIR = getattr(settings, 'UPLOAD_DIR', 'uploads')  # partial chunked uploads, inside MEDIA_ROOT
+UPLOAD_MAX_BYTES = getattr(settings, 'UPLOAD_MAX_BYTES', 2 * 1024 * 1024 * 1024)  # declared size of an upload
+UPLOAD_BUFFER_SIZE = getattr(settings, 'UPLOAD_BUFFER_SIZE', 64 * 1024)  # bytes read from a chunk at a time
+UPLOAD_SESSION_TTL = getattr(settings, 'UPLOAD_SESSION_TTL', 24 * 60 * 60)  # seconds an idle upload is kept
+STORAGE_QUOTA_BYTES = getattr(settings, 'STORAGE_QUOTA_BYTES', None)  # per owner, None for no limit
+STORAGE_QUOTA_FILES = getattr(settings, 'STORAGE_QUOTA_FILES', None)  # per owner, None for no limit
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+from celery import shared_task
+from files import uploads
+
+
+@shared_task
+def gc_upload_sessions():
+    """
+    Removes the stale chunked uploads, see files.uploads. Returns the number of uploads removed
+    """
+    removed, freed = uploads.gc_upload_sessions()
+    return removed
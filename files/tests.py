@@ -1,3 +1,345 @@
-from django.test import TestCase
+# -*- coding: utf-8 -*-
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
 
-# Create your tests here.
+from blogs.images import resized_path
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.exceptions import PermissionDenied
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from django.utils.six import StringIO
+from files.models import File, StorageUsage, UploadSession
+from files.uploads import OffsetConflict, gc_upload_sessions, remove_partial_file, start_upload, write_chunk
+from PIL import Image
+from rest_framework import status
+from rest_framework.test import APITestCase
+from wordplease.media import check_media_permission
+
+
+@override_settings(ROOT_URLCONF='files.api_urls')
+class UploadSessionAPITest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('uploader', 'uploader@wordplease', 'supersecretpassword')
+        self.client.login(username='uploader', password='supersecretpassword')
+        self.content = os.urandom(3 * 1024 * 1024)  # over DATA_UPLOAD_MAX_MEMORY_SIZE, the body is never read whole
+        if not os.path.exists(settings.MEDIA_ROOT):  # File stores into the real MEDIA_ROOT (its upload_to)
+            self.addCleanup(shutil.rmtree, settings.MEDIA_ROOT, True)
+
+    def start(self, **data):
+        data.setdefault('filename', 'photos.zip')
+        data.setdefault('size', len(self.content))
+        response = self.client.post('/1.0/files/uploads/', data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        session = UploadSession.objects.get(pk=response.data['id'])
+        self.addCleanup(remove_partial_file, session.get_partial_path())
+        return '/1.0/files/uploads/{0}/'.format(session.pk)
+
+    def send(self, url, offset, data):
+        return self.client.patch(url, data, content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset))
+
+    def finalize(self, url):
+        response = self.client.post(url + 'finalize/')
+        if response.status_code == status.HTTP_201_CREATED:
+            uploaded = File.objects.get(pk=response.data['id'])
+            self.addCleanup(os.remove, uploaded.file.path)
+        return response
+
+    def test_chunks_are_resumed_from_the_upload_offset(self):
+        """
+        Ensure that chunks are written at the upload offset, out of place chunks answer the offset to resume from
+        and the finalized upload becomes a file of its owner
+        """
+        url = self.start(sha256=hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(self.send(url, 0, self.content[:100000]).data['offset'], 100000)
+        response = self.send(url, 50000, self.content[50000:200000])
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response['Upload-Offset'], '100000')
+        self.assertEqual(self.finalize(url).status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.assertEqual(self.client.get(url)['Upload-Offset'], '100000')
+        self.assertEqual(self.send(url, 100000, self.content[100000:]).data['offset'], len(self.content))
+        response = self.finalize(url)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        uploaded = File.objects.get(pk=response.data['id'])
+        self.assertEqual(uploaded.owner, self.user)
+        with open(uploaded.file.path, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_invalid_uploads_are_refused(self):
+        """
+        Ensure that chunks past the declared size, other users uploads and mismatching checksums are refused
+        """
+        url = self.start(size=10, sha256='0' * 64)
+        self.assertEqual(self.send(url, 0, b'x' * 11).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.send(url, 0, b'x' * 10).status_code, status.HTTP_200_OK)
+        response = self.finalize(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['offset'], 0)  # starts over
+
+        User.objects.create_user('other', 'other@wordplease', 'supersecretpassword')
+        self.client.login(username='other', password='supersecretpassword')
+        self.assertEqual(self.send(url, 0, b'x').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_stale_uploads_are_garbage_collected(self):
+        """
+        Ensure that uploads not resumed within the TTL are removed with their partial files
+        """
+        url = self.start()
+        self.send(url, 0, self.content[:1000])
+        session = UploadSession.objects.get()
+        self.assertEqual(gc_upload_sessions(ttl=60), (0, 0))
+        UploadSession.objects.update(modified_at=session.modified_at.replace(year=2000))
+        self.assertEqual(gc_upload_sessions(ttl=60), (1, 1000))
+        self.assertFalse(os.path.exists(session.get_partial_path()))
+
+        orphan = session.get_partial_path().replace(session.pk.hex, 'f' * 32)
+        open(orphan, 'wb').close()
+        os.utime(orphan, (time.time() - 120, time.time() - 120))
+        self.assertEqual(gc_upload_sessions(ttl=60), (0, 0))
+        self.assertFalse(os.path.exists(orphan))
+
+
+class ConcurrentChunksTest(TransactionTestCase):
+
+    def test_concurrent_chunks_at_the_same_offset_do_not_interleave(self):
+        """
+        Ensure that a chunk sent while another one at the same offset is being written waits for it and conflicts
+        """
+        if not os.path.exists(settings.MEDIA_ROOT):
+            self.addCleanup(shutil.rmtree, settings.MEDIA_ROOT, True)
+        user = User.objects.create_user('uploader', 'uploader@wordplease', 'supersecretpassword')
+        session = UploadSession.objects.create(owner=user, filename='photos.zip', size=10)
+        start_upload(session)
+        self.addCleanup(remove_partial_file, session.get_partial_path())
+        reading, resume, results = threading.Event(), threading.Event(), {}
+
+        class SlowStream(object):
+            def read(self, size):
+                reading.set()
+                resume.wait(5)
+                return b'a' * size
+
+        def send(name, stream):
+            try:
+                results[name] = write_chunk(UploadSession.objects.get(pk=session.pk), 0, stream, 10)
+            except OffsetConflict as exc:
+                results[name] = exc
+            finally:
+                connection.close()
+
+        slow = threading.Thread(target=send, args=('slow', SlowStream()))
+        slow.start()
+        reading.wait(5)
+        fast = threading.Thread(target=send, args=('fast', io.BytesIO(b'b' * 10)))
+        fast.start()
+        fast.join(0.2)
+        self.assertTrue(fast.is_alive())  # waiting for the lock
+        resume.set()
+        slow.join()
+        fast.join()
+
+        self.assertEqual(results['slow'], 10)
+        self.assertEqual(results['fast'].offset, 10)
+        with open(session.get_partial_path(), 'rb') as f:
+            self.assertEqual(f.read(), b'a' * 10)
+
+
+@override_settings(ROOT_URLCONF='wordplease.urls')
+class MediaServingTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', 'owner@wordplease', 'supersecretpassword')
+        if not os.path.exists(settings.MEDIA_ROOT):
+            os.makedirs(settings.MEDIA_ROOT)
+            self.addCleanup(shutil.rmtree, settings.MEDIA_ROOT, True)
+        self.content = os.urandom(1000)
+        self.path = os.path.join(settings.MEDIA_ROOT, 'media-serving-test.bin')
+        with open(self.path, 'wb') as f:
+            f.write(self.content)
+        self.addCleanup(os.remove, self.path)
+        File.objects.create(owner=self.user, file=self.path)
+        self.url = settings.MEDIA_URL + 'media-serving-test.bin'
+
+    def read(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_private_files_are_served_in_ranges(self):
+        """
+        Ensure that uploaded files are only served to their owner, with Range and conditional requests support
+        """
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+        self.client.login(username='owner', password='supersecretpassword')
+        response = self.client.get(self.url)
+        self.assertEqual(self.read(response), self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('private', response['Cache-Control'])
+        etag = response['ETag']
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1000')
+        self.assertEqual(self.read(response), self.content[10:20])
+        self.assertEqual(self.read(self.client.get(self.url, HTTP_RANGE='bytes=-5')), self.content[-5:])
+        self.assertEqual(self.read(self.client.get(self.url, HTTP_RANGE='bytes=990-')), self.content[990:])
+        response = self.client.get(self.url, HTTP_RANGE='bytes=1000-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response['Content-Range'], 'bytes */1000')
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"changed"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE=etag).status_code,
+                         status.HTTP_206_PARTIAL_CONTENT)
+
+    def test_transfers_are_offloaded_to_the_front_server(self):
+        """
+        Ensure that the front server headers are only sent once the permissions are checked, and that paths out of
+        MEDIA_ROOT and partial uploads are not served
+        """
+        self.client.login(username='owner', password='supersecretpassword')
+        with self.settings(MEDIA_SERVE_MODE='x-accel-redirect'):
+            response = self.client.get(self.url)
+            self.assertEqual(response['X-Accel-Redirect'], '/protected-media/media-serving-test.bin')
+            self.assertEqual(response.content, b'')
+        with self.settings(MEDIA_SERVE_MODE='x-sendfile'):
+            self.assertEqual(self.client.get(self.url)['X-Sendfile'], os.path.realpath(self.path))
+            self.client.logout()
+            self.assertFalse(self.client.get(self.url).has_header('X-Sendfile'))
+
+        self.assertEqual(self.client.get(settings.MEDIA_URL + '../manage.py').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(settings.MEDIA_URL + 'missing.bin').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_resizes_of_private_files_are_private(self):
+        """
+        Ensure that private images are only resized for their owner, and that their cached resizes are as private as
+        the image
+        """
+        path = os.path.join(settings.MEDIA_ROOT, 'media-serving-test.png')
+        Image.new('RGB', (1000, 800)).save(path)
+        self.addCleanup(os.remove, path)
+        File.objects.create(owner=self.user, file=path)
+        url = settings.MEDIA_URL + 'r/400x300/media-serving-test.png'
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+        self.client.login(username='owner', password='supersecretpassword')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        cached = os.path.join(settings.MEDIA_ROOT, resized_path('media-serving-test.png', 400, 300, 'JPEG'))
+        self.addCleanup(os.remove, cached)
+
+        relative_path = os.path.relpath(cached, settings.MEDIA_ROOT)
+        request = RequestFactory().get(settings.MEDIA_URL + relative_path)
+        request.user = AnonymousUser()
+        with self.assertRaises(PermissionDenied):
+            check_media_permission(request, relative_path)
+        request.user = self.user
+        self.assertTrue(check_media_permission(request, relative_path))
+
+    def test_media_without_file_is_not_served(self):
+        """
+        Ensure that media files are denied unless public, a legacy post image or allowed by their File, which is
+        matched by the name its upload_to stores even when MEDIA_ROOT is reached through a symlink
+        """
+        stray = os.path.join(settings.MEDIA_ROOT, 'media-serving-stray.bin')
+        legacy = os.path.join(settings.MEDIA_ROOT, '12345-thumbnail.png')
+        for path in (stray, legacy):
+            with open(path, 'wb') as f:
+                f.write(self.content)
+            self.addCleanup(os.remove, path)
+        self.assertEqual(self.client.get(settings.MEDIA_URL + 'media-serving-stray.bin').status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(settings.MEDIA_URL + '12345-thumbnail.png').status_code, status.HTTP_200_OK)
+
+        link = os.path.join(tempfile.mkdtemp(), 'media')
+        self.addCleanup(shutil.rmtree, os.path.dirname(link))
+        os.symlink(os.path.realpath(settings.MEDIA_ROOT), link)
+        with self.settings(MEDIA_ROOT=link):
+            File.objects.filter(file=self.path).update(file=os.path.join(link, 'media-serving-test.bin'))
+            self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+
+
+@override_settings(ROOT_URLCONF='files.api_urls')
+class StorageUsageTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', 'owner@wordplease', 'supersecretpassword')
+        self.client.login(username='owner', password='supersecretpassword')
+        if not os.path.exists(settings.MEDIA_ROOT):
+            self.addCleanup(shutil.rmtree, settings.MEDIA_ROOT, True)
+
+    def upload(self, size):
+        response = self.client.post('/1.0/files/', {'file': SimpleUploadedFile('usage.bin', b'x' * size)})
+        if response.status_code == status.HTTP_201_CREATED:
+            self.addCleanup(os.remove, File.objects.get(pk=response.data['id']).file.path)
+        return response
+
+    def test_usage_is_kept_and_quotas_are_enforced(self):
+        """
+        Ensure that uploads and deletions update the owner's usage and that uploads over the quotas are refused,
+        counting unfinished chunked uploads
+        """
+        first = self.upload(1000).data['id']
+        self.upload(500)
+        response = self.client.get('/1.0/files/usage/')
+        self.assertEqual((response.data['bytes'], response.data['files']), (1500, 2))
+
+        StorageUsage.objects.filter(owner=self.user).update(quota_bytes=2000)
+        self.assertEqual(self.upload(501).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/1.0/files/uploads/', {'filename': 'big.zip', 'size': 501})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/1.0/files/uploads/', {'filename': 'small.zip', 'size': 400})
+        self.addCleanup(remove_partial_file, UploadSession.objects.get(pk=response.data['id']).get_partial_path())
+        self.assertEqual(self.upload(101).status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.client.delete('/1.0/files/{0}/'.format(first))
+        response = self.client.get('/1.0/files/usage/')
+        self.assertEqual((response.data['bytes'], response.data['files'], response.data['quota_bytes']), (500, 1, 2000))
+        self.assertEqual(self.upload(1000).status_code, status.HTTP_201_CREATED)
+
+    def test_replacements_are_checked_against_the_owner_quota(self):
+        """
+        Ensure that a superuser replacing a file is checked against the quotas of the file's owner, who keeps it
+        """
+        uploaded = self.upload(1000).data['id']
+        StorageUsage.objects.filter(owner=self.user).update(quota_bytes=1500)
+        admin = User.objects.create_superuser('admin', 'admin@wordplease', 'supersecretpassword')
+        self.client.login(username='admin', password='supersecretpassword')
+        response = self.client.put('/1.0/files/{0}/'.format(uploaded), {
+            'file': SimpleUploadedFile('usage.bin', b'x' * 2000)
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.put('/1.0/files/{0}/'.format(uploaded), {
+            'file': SimpleUploadedFile('usage.bin', b'x' * 1200)
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        replaced = File.objects.get(pk=uploaded)
+        self.addCleanup(os.remove, replaced.file.path)
+        self.assertEqual(replaced.owner, self.user)
+        self.assertEqual(StorageUsage.objects.filter(owner=self.user).values_list('bytes', 'files').get(), (1200, 1))
+        self.assertFalse(StorageUsage.objects.filter(owner=admin, files__gt=0).exists())
+
+    def test_reconcile_repairs_drift_from_the_storage(self):
+        """
+        Ensure that the reconcile command takes file sizes from the storage and repairs the usages
+        """
+        self.upload(1000)
+        File.objects.update(size=0)
+        StorageUsage.objects.filter(owner=self.user).update(bytes=5, files=7)
+        other = User.objects.create_user('other', 'other@wordplease', 'supersecretpassword')
+        StorageUsage.objects.create(owner=other, bytes=10, files=1)
+
+        call_command('reconcile_storage_usage', dry_run=True, stdout=StringIO())
+        self.assertEqual(File.objects.get().size, 0)
+        call_command('reconcile_storage_usage', stdout=StringIO())
+        self.assertEqual(File.objects.get().size, 1000)
+        self.assertEqual(StorageUsage.objects.filter(owner=self.user).values_list('bytes', 'files').get(), (1000, 1))
+        self.assertEqual(StorageUsage.objects.filter(owner=other).values_list('bytes', 'files').get(), (0, 0))
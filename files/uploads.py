@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File as DjangoFile
+from django.db import transaction
+from django.utils import timezone
+
+from files.models import File, QuotaExceeded, StorageUsage, UploadSession
+from files.settings import UPLOAD_BUFFER_SIZE, UPLOAD_DIR, UPLOAD_SESSION_TTL
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+
+class UploadError(ValueError):
+    pass
+
+
+class OffsetConflict(UploadError):
+    """
+    The chunk does not start where the upload is, the client has to resume from offset
+    """
+
+    def __init__(self, offset):
+        super(OffsetConflict, self).__init__('The upload is at offset {0}.'.format(offset))
+        self.offset = offset
+
+
+class PartialFile(DjangoFile):
+    """
+    Lets the storage move the complete partial file into place instead of copying it
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def start_upload(session):
+    """
+    Creates the empty partial file of a new upload session
+    """
+    path = session.get_partial_path()
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    open(path, 'wb').close()
+
+
+def write_chunk(session, offset, stream, length):
+    """
+    Writes length bytes read from stream at offset, UPLOAD_BUFFER_SIZE bytes at a time, so chunks are never held in
+    memory. If the client disconnects, the bytes received are kept and the upload resumes after them. The partial
+    file is locked from the offset check to the offset update, so a concurrent chunk at the same offset waits and
+    gets a conflict instead of writing over this one. Returns the new offset
+    """
+    if offset + length > session.size:
+        raise UploadError('The chunk ends after the declared size ({0} bytes).'.format(session.size))
+
+    written = 0
+    with open(session.get_partial_path(), 'r+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)  # released when the file is closed
+        session.offset = UploadSession.objects.filter(pk=session.pk).values_list('offset', flat=True).first()
+        if session.offset is None:
+            raise UploadError('The upload does not exist.')
+        if offset != session.offset:
+            raise OffsetConflict(session.offset)
+        f.seek(offset)
+        f.truncate()  # bytes after offset come from a chunk that was never acknowledged
+        try:
+            while written < length:
+                data = stream.read(min(UPLOAD_BUFFER_SIZE, length - written))
+                if not data:
+                    break
+                f.write(data)
+                written += len(data)
+        except IOError:  # the client went away, keep what was received
+            pass
+
+        # where flock is not available, a concurrent chunk at the same offset may still have won the race
+        if not UploadSession.objects.filter(pk=session.pk, offset=offset).update(
+            offset=offset + written, modified_at=timezone.now()
+        ):
+            raise OffsetConflict(UploadSession.objects.filter(pk=session.pk).values_list('offset', flat=True).first())
+    session.offset = offset + written
+    return session.offset
+
+
+def get_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(UPLOAD_BUFFER_SIZE), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def finish_upload(session):
+    """
+    Turns a complete upload into a File of its owner, moving the partial file into the storage. If the client gave
+    a SHA-256, an upload with other bytes is started over instead. Returns the File
+    """
+    if session.offset != session.size:
+        raise UploadError('{0} of {1} bytes uploaded.'.format(session.offset, session.size))
+    path = session.get_partial_path()
+    if session.sha256 and get_sha256(path) != session.sha256.lower():
+        open(path, 'wb').close()
+        UploadSession.objects.filter(pk=session.pk).update(offset=0, modified_at=timezone.now())
+        session.offset = 0
+        raise UploadError('The uploaded bytes do not match the SHA-256, the upload starts over.')
+
+    try:  # checked again, other files may have been stored since the upload started
+        StorageUsage.get_for(session.owner).check_quota(session.size, exclude_upload=session)
+    except QuotaExceeded as exc:
+        raise UploadError(str(exc))
+
+    with transaction.atomic():
+        if not UploadSession.objects.filter(pk=session.pk).delete()[0]:  # finished by a concurrent request
+            raise UploadError('The upload does not exist.')
+        uploaded = File(owner=session.owner)
+        with open(path, 'rb') as f:
+            uploaded.file.save(os.path.basename(session.filename), PartialFile(f), save=True)
+    return uploaded
+
+
+def cancel_upload(session):
+    session.delete()
+    remove_partial_file(session.get_partial_path())
+
+
+def remove_partial_file(path):
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+    except OSError:
+        return 0
+    return size
+
+
+def gc_upload_sessions(ttl=UPLOAD_SESSION_TTL):
+    """
+    Removes the upload sessions idle for more than ttl seconds with their partial files, and partial files left
+    without a session. Returns the number of (sessions removed, bytes freed)
+    """
+    stale = UploadSession.objects.filter(modified_at__lt=timezone.now() - timedelta(seconds=ttl))
+    removed = freed = 0
+    for session in list(stale):
+        with transaction.atomic():
+            if not stale.filter(pk=session.pk).delete()[0]:  # resumed or finished meanwhile
+                continue
+        freed += remove_partial_file(session.get_partial_path())
+        removed += 1
+
+    directory = os.path.join(settings.MEDIA_ROOT, UPLOAD_DIR)
+    if os.path.isdir(directory):
+        sessions = set(pk.hex for pk in UploadSession.objects.values_list('pk', flat=True))
+        for filename in os.listdir(directory):
+            path = os.path.join(directory, filename)
+            if filename.split('.')[0] not in sessions and os.path.getmtime(path) < time.time() - ttl:
+                freed += remove_partial_file(path)
+    return removed, freed
@@ -10,6 +10,15 @@ class UserViewSet(ModelViewSet):
     serializer_class = UserSerializer
     permission_classes = (UserPermission,)
 
+    def get_queryset(self):
+        """
+        Prefetches the groups and permissions serialized with every user when reading them. Not when writing, since
+        their prefetched values would be returned after being changed
+        """
+        if self.action in ['list', 'retrieve']:
+            return self.queryset.prefetch_related('groups', 'user_permissions')
+        return self.queryset
+
     def get_serializer_class(self):
         """
         Returns SinupSerializer when trying to create a new user
@@ -3,6 +3,7 @@ from django.contrib.auth.models import User
 from django.test import override_settings
 from rest_framework import status
 from rest_framework.test import APITestCase
+from wordplease.queries import QueryBudgetTestMixin
 
 
 @override_settings(ROOT_URLCONF='users.api_urls')
@@ -323,3 +324,22 @@ class UserListAPITest(UserAPITestWithUsers):
         for user in response.data.get('results'):
             db_user = User.objects.get(pk=user.get('id'))
             self.assertIsNotNone(db_user)
+
+
+class UserQueryBudgetTest(QueryBudgetTestMixin, UserAPITestWithUsers):
+
+    def setUp(self):
+        super(UserQueryBudgetTest, self).setUp()
+        for i in range(5):  # enough rows to reveal N+1 queries
+            User.objects.create_user('extra{0}'.format(i), 'extra{0}@wordplease.com'.format(i), 'password')
+        self.client.login(username='django', password='dissilent')
+
+    def test_api_query_budget(self):
+        """
+        Ensure that the users endpoints run a fixed number of queries whatever the number of users
+        """
+        with self.assertQueryBudget(6):
+            self.client.get('/1.0/users/')
+        url = '/1.0/users/{0}/'.format(User.objects.get(username='calvin').pk)
+        with self.assertQueryBudget(5, allow_duplicates=True):  # the auth user and the profile share a fingerprint
+            self.client.get(url)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import math
+import threading
+import time
+
+from django.db import connection
+from django.test import Client
+
+try:
+    import tracemalloc
+except ImportError:  # Python < 3.4
+    tracemalloc = None
+
+
+def percentile(values, percent):
+    """
+    Returns the nearest-rank percentile of the values (percent from 0 to 100)
+    """
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[max(0, int(math.ceil(percent / 100.0 * len(values))) - 1)]
+
+
+def summarize(latencies, queries, elapsed, statuses):
+    """
+    Returns the stats of a run: latencies in ms, queries per request and requests per second
+    """
+    return {
+        'requests': len(latencies),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'max_ms': round(max(latencies) * 1000, 3) if latencies else 0,
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed else 0,
+        'queries': max(queries) if queries else 0,
+        'statuses': sorted(set(statuses)),
+    }
+
+
+def run_requests(path, requests, concurrency, user=None, warmup=0):
+    """
+    Sends requests GETs to path through the test client from concurrency threads, each with its own client and
+    database connection. Query counts come from the X-Query-Count header, so QUERY_BUDGET_ENABLED must be set.
+    Returns the summarize() stats of the measured requests (warmup requests are not measured)
+    """
+    latencies, queries, statuses = [], [], []
+    lock = threading.Lock()
+    counter = {'left': requests}
+
+    def worker():
+        client = Client()
+        if user is not None:
+            client.force_login(user)
+        try:
+            while True:
+                with lock:
+                    if counter['left'] <= 0:
+                        return
+                    counter['left'] -= 1
+                started = time.time()
+                response = client.get(path)
+                latency = time.time() - started
+                with lock:
+                    latencies.append(latency)
+                    queries.append(int(response.get('X-Query-Count', 0)))
+                    statuses.append(response.status_code)
+        finally:
+            connection.close()  # the thread's own connection
+
+    warmup_client = Client()
+    if user is not None:
+        warmup_client.force_login(user)
+    for i in range(warmup):
+        warmup_client.get(path)
+
+    threads = [threading.Thread(target=worker) for i in range(concurrency)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, queries, time.time() - started, statuses)
+
+
+def traced_peak_kb(func, *args, **kwargs):
+    """
+    Calls func and returns (its result, the peak KB of Python memory allocated while it ran), the peak being None
+    where tracemalloc is not available. Unlike the process peak RSS, it only describes this call. Tracing slows every
+    allocation, so runs measured for latency should not be traced
+    """
+    if tracemalloc is None:
+        return func(*args, **kwargs), None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()  # starting again resets the peak
+    tracemalloc.start()
+    try:
+        result = func(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, peak // 1024
+
+
+def compare(results, baseline, tolerance, min_slack_ms=1.0):
+    """
+    Returns the regressions of results against baseline (both {key: stats}) as readable strings: a p95 latency over
+    tolerance (a fraction, plus min_slack_ms so sub-millisecond noise does not count), a throughput under it, a peak
+    memory over it or any extra query per request. Keys missing from either side are ignored
+    """
+    regressions = []
+    for key in sorted(set(results) & set(baseline)):
+        current, expected = results[key], baseline[key]
+        if current['queries'] > expected['queries']:
+            regressions.append('{0}: {1} queries per request, baseline {2}'.format(
+                key, current['queries'], expected['queries']
+            ))
+        if current['p95_ms'] > expected['p95_ms'] * (1 + tolerance) + min_slack_ms:
+            regressions.append('{0}: p95 {1}ms, baseline {2}ms'.format(key, current['p95_ms'], expected['p95_ms']))
+        if current['throughput'] < expected['throughput'] * (1 - tolerance):
+            regressions.append('{0}: {1} requests/s, baseline {2}'.format(
+                key, current['throughput'], expected['throughput']
+            ))
+        if current.get('peak_kb') and expected.get('peak_kb') and \
+                current['peak_kb'] > expected['peak_kb'] * (1 + tolerance):
+            regressions.append('{0}: peak memory {1} KB, baseline {2} KB'.format(
+                key, current['peak_kb'], expected['peak_kb']
+            ))
+    return regressions
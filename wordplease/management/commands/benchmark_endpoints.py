@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from blogs.bulk import Seeder
+from blogs.models import Blog, Category, Post
+from blogs.search import get_search_backend
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import override_settings
+from files.models import File
+from wordplease.benchmark import compare, run_requests, traced_peak_kb
+
+# (name, path builder, whether it needs the superuser) of every benchmarked route
+ROUTES = (
+    ('latest_posts', lambda data: reverse('latest_posts'), False),
+    ('blog_list', lambda data: reverse('blog_list'), False),
+    ('blog_detail', lambda data: reverse('blog_detail', args=[data['username']]), False),
+    ('post_detail', lambda data: reverse('post_detail', args=[data['username'], data['post_pk']]), False),
+    ('api_posts', lambda data: reverse('post-list'), False),
+    ('api_blogs', lambda data: reverse('blog-list'), False),
+    ('api_users', lambda data: reverse('user-list'), True),
+    ('api_files', lambda data: reverse('file-list'), True),
+)
+
+
+def parse_list(value, cast=int):
+    return [cast(item) for item in value.split(',') if item]
+
+
+def seed(blogs, posts_per_blog, seed_value=0):
+    """
+    Fills the (empty) database with blogs blogs of posts_per_blog posts on average (see blogs.bulk.Seeder), a
+    superuser and one file per user, then rebuilds the counters and the search index the Seeder leaves stale.
+    Returns the data the route paths need
+    """
+    superuser = User.objects.create_superuser('benchmark', 'benchmark@wordplease.com', 'benchmark')
+    Seeder(seed=seed_value, categories=5, prefix='user').run(blogs, blogs * posts_per_blog)
+    File.objects.bulk_create([
+        File(owner_id=pk, file='benchmark/{0}.txt'.format(pk))
+        for pk in User.objects.filter(username__startswith='user').values_list('pk', flat=True)
+    ])
+    Blog.update_counters(Blog.objects.values_list('pk', flat=True))
+    Category.update_counters(Category.objects.values_list('pk', flat=True))
+    get_search_backend().rebuild()
+    post = Post.objects.select_related('blog__owner').filter(is_published=True).order_by('pk').first()
+    return {'superuser': superuser, 'username': post.blog.owner.username, 'post_pk': post.pk}
+
+
+class Command(BaseCommand):
+    help = 'Measures the latency, throughput, queries and memory of the public routes on a throwaway database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scales', default='10x10,100x20', help='comma separated BLOGSxPOSTS_PER_BLOG datasets to seed'
+        )
+        parser.add_argument('--concurrency', default='1,4', help='comma separated numbers of concurrent clients')
+        parser.add_argument('--requests', type=int, default=100, help='measured requests per route and run')
+        parser.add_argument('--warmup', type=int, default=5, help='requests per route sent before measuring')
+        parser.add_argument(
+            '--memory-requests', type=int, default=20, help='requests per route and run sent to sample the peak memory'
+        )
+        parser.add_argument('--routes', default='', help='comma separated route names, all by default')
+        parser.add_argument('--output', help='JSON file where the results are written')
+        parser.add_argument('--baseline', help='JSON results to compare with, fails on regressions')
+        parser.add_argument('--tolerance', type=float, default=0.25, help='latency and throughput slack, 0.25 = 25%%')
+        parser.add_argument('--update-baseline', action='store_true', help='writes the results to --baseline')
+
+    def handle(self, *args, **options):
+        try:
+            scales = [tuple(int(value) for value in scale.split('x')) for scale in parse_list(options['scales'], str)]
+            concurrencies = parse_list(options['concurrency'])
+        except ValueError:
+            raise CommandError('--scales must be BLOGSxPOSTS,... and --concurrency N,...')
+        names = parse_list(options['routes'], str)
+        routes = [route for route in ROUTES if not names or route[0] in names]
+        if not routes:
+            raise CommandError('No route named {0}, choose from {1}'.format(
+                options['routes'], ', '.join(route[0] for route in ROUTES)
+            ))
+        baseline = None
+        if options['baseline'] and not options['update_baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        results = {}
+        logging.getLogger('wordplease.queries').disabled = True  # over budget warnings would flood the output
+        try:
+            with override_settings(QUERY_BUDGET_ENABLED=True, DEBUG=False, ALLOWED_HOSTS=['testserver']):
+                for blogs, posts_per_blog in scales:
+                    results.update(self.run_scale(blogs, posts_per_blog, routes, concurrencies, options))
+        finally:
+            logging.getLogger('wordplease.queries').disabled = False
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        if options['update_baseline'] and options['baseline']:
+            with open(options['baseline'], 'w') as f:
+                f.write(output)
+            self.stdout.write(self.style.SUCCESS('Baseline written to {0}'.format(options['baseline'])))
+        if baseline is not None:
+            regressions = compare(results, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('{0} regressions against {1}:\n{2}'.format(
+                    len(regressions), options['baseline'], '\n'.join(regressions)
+                ))
+            self.stdout.write(self.style.SUCCESS('No regressions against {0}'.format(options['baseline'])))
+
+    def run_scale(self, blogs, posts_per_blog, routes, concurrencies, options):
+        """
+        Seeds a new test database with the scale's data and runs every route at every concurrency on it
+        """
+        results = {}
+        test_settings = connection.settings_dict.setdefault('TEST', {})
+        test_name = test_settings.get('NAME')
+        if connection.vendor == 'sqlite' and not test_name:
+            # a file instead of the shared in-memory database, which the client threads' connections would keep alive
+            test_settings['NAME'] = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            for alias in ('default', 'fragments'):
+                caches[alias].clear()
+            data = seed(blogs, posts_per_blog)
+            self.stdout.write('{0} blogs x {1} posts'.format(blogs, posts_per_blog))
+            for name, path, as_superuser in routes:
+                for concurrency in concurrencies:
+                    key = '{0}@{1}x{2}/c{3}'.format(name, blogs, posts_per_blog, concurrency)
+                    stats = run_requests(
+                        path(data), options['requests'], concurrency, data['superuser'] if as_superuser else None,
+                        options['warmup']
+                    )
+                    # memory is sampled in a run of its own, tracing would skew the latencies
+                    stats['peak_kb'] = traced_peak_kb(
+                        run_requests, path(data), options['memory_requests'], concurrency,
+                        data['superuser'] if as_superuser else None
+                    )[1]
+                    results[key] = stats
+                    self.stdout.write(
+                        '  {0:<32} p50 {p50_ms:>8.2f}ms  p95 {p95_ms:>8.2f}ms  p99 {p99_ms:>8.2f}ms  '
+                        '{throughput:>8.1f} req/s  {queries:>3} queries  {peak_kb} KB  {statuses}'.format(
+                            key, **stats
+                        )
+                    )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            if test_settings.get('NAME') != test_name:
+                shutil.rmtree(os.path.dirname(test_settings['NAME']))
+                test_settings['NAME'] = test_name
+        return results
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+import mimetypes
+import os
+import re
+
+from blogs.images import LEGACY_IMAGE
+from blogs.settings import IMAGE_RESIZE_DIR, IMAGE_STORE_DIR, SITEMAP_DIR
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.encoding import force_bytes
+from django.utils.http import http_date, parse_http_date_safe, quote_etag, urlquote
+from files.models import File
+from files.permissions import FilePermission
+from files.settings import UPLOAD_DIR
+
+# media directories anyone may read without looking for a File: post images and the sitemaps. Resizes in
+# IMAGE_RESIZE_DIR are as private as their source, any other media is only served as allowed by its File
+PUBLIC_MEDIA_DIRS = (IMAGE_STORE_DIR, SITEMAP_DIR)
+
+_range = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeFile(object):
+    """
+    The length bytes of a file from start, for FileResponse to stream only a range of it
+    """
+
+    def __init__(self, f, start, length):
+        self.file = f
+        self.file.seek(start)
+        self.remaining = length
+
+    def read(self, size=-1):
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def get_media_path(path):
+    """
+    Returns the (absolute, MEDIA_ROOT relative) paths of a media file, raising Http404 for paths out of MEDIA_ROOT,
+    missing files and partial uploads
+    """
+    media_root = os.path.realpath(settings.MEDIA_ROOT)
+    full_path = os.path.realpath(os.path.join(media_root, path))
+    if not full_path.startswith(media_root + os.sep) or not os.path.isfile(full_path):
+        raise Http404('File not found')
+    relative_path = os.path.relpath(full_path, media_root)
+    if relative_path.startswith(UPLOAD_DIR + os.sep):
+        raise Http404('File not found')
+    return full_path, relative_path
+
+
+def check_media_permission(request, relative_path):
+    """
+    Uploaded files are private to their owner (see FilePermission), post images and sitemaps public, and any other
+    media file raises Http404. Returns whether the file is private. File names are stored as their upload_to makes
+    them, MEDIA_ROOT (not resolved) joined with the name, or relative to MEDIA_ROOT
+    """
+    parts = relative_path.split(os.sep)
+    if parts[0] == IMAGE_RESIZE_DIR and len(parts) > 2:  # <dir>/<w>x<h>/<source>.<ext>, see blogs.images.resized_path
+        relative_path = os.path.splitext(os.sep.join(parts[2:]))[0]
+    if relative_path.split(os.sep)[0] in PUBLIC_MEDIA_DIRS:
+        return False
+    uploaded = File.objects.select_related('owner').filter(
+        file__in=[relative_path, os.path.join(os.path.normpath(settings.MEDIA_ROOT), relative_path)]
+    ).first()
+    if uploaded is None:
+        if LEGACY_IMAGE.match(relative_path):  # linked by the posts processed before the image store
+            return False
+        raise Http404('File not found')
+    if not FilePermission().has_object_permission(request, None, uploaded):
+        raise PermissionDenied()
+    return True
+
+
+def parse_range(header, size):
+    """
+    Returns the (start, length) of a single byte range header, None to serve the whole file (no header or several
+    ranges, which may be answered in full) or raises ValueError if it can not be satisfied
+    """
+    match = _range.match(header.replace(' ', ''))
+    if not match or not any(match.groups()):
+        return None
+    start, end = match.groups()
+    if not start:  # the last bytes
+        length = min(int(end), size)
+        if not length:
+            raise ValueError(header)
+        return size - length, length
+    start, end = int(start), min(int(end) if end else size - 1, size - 1)
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, end - start + 1
+
+
+def serve_media(request, path):
+    """
+    Serves a media file after checking its permissions. With MEDIA_SERVE_MODE = 'x-accel-redirect' (nginx) or
+    'x-sendfile' (Apache, lighttpd) the response has no body, only the header for the front server to send the file
+    (nginx reads it from MEDIA_ACCEL_PREFIX, an internal location aliasing MEDIA_ROOT). Otherwise the file is streamed
+    by Django, answering conditional requests with 304 or 412 and Range requests with 206, without reading the rest
+    of the file
+    """
+    full_path, relative_path = get_media_path(path)
+    private = check_media_permission(request, relative_path)
+
+    mode = getattr(settings, 'MEDIA_SERVE_MODE', None)
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+    if mode in ('x-accel-redirect', 'x-sendfile'):
+        response = HttpResponse(content_type=content_type)
+        if mode == 'x-accel-redirect':
+            prefix = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/')
+            response['X-Accel-Redirect'] = prefix + urlquote(relative_path.replace(os.sep, '/'))
+        else:
+            response['X-Sendfile'] = force_bytes(full_path)
+    else:
+        response = serve_file(request, full_path, content_type)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    if private:
+        patch_cache_control(response, private=True)
+    return response
+
+
+def serve_file(request, full_path, content_type):
+    stat = os.stat(full_path)
+    size, modified_at = stat.st_size, int(stat.st_mtime)
+    etag = '{0:x}-{1:x}'.format(modified_at, size)
+    response = get_conditional_response(request, etag=etag, last_modified=modified_at)
+    if response is None:
+        byte_range = None
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if 'HTTP_RANGE' in request.META and (
+            not if_range or if_range == quote_etag(etag) or parse_http_date_safe(if_range) == modified_at
+        ):
+            try:
+                byte_range = parse_range(request.META['HTTP_RANGE'], size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = 'bytes */{0}'.format(size)
+                return response
+
+        f = open(full_path, 'rb')
+        if byte_range is None:
+            response = FileResponse(f, content_type=content_type)  # may be sent with the WSGI server's sendfile
+            response['Content-Length'] = size
+        else:
+            start, length = byte_range
+            response = FileResponse(RangeFile(f, start, length), status=206, content_type=content_type)
+            response['Content-Length'] = length
+            response['Content-Range'] = 'bytes {0}-{1}/{2}'.format(start, start + length - 1, size)
+        response['Accept-Ranges'] = 'bytes'
+    if response.status_code in (200, 206, 304):
+        response['ETag'] = quote_etag(etag)
+        response['Last-Modified'] = http_date(modified_at)
+    return response
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+import logging
+import re
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.deprecation import MiddlewareMixin
+
+logger = logging.getLogger('wordplease.queries')
+
+_literals = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),  # strings
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),  # numbers
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),  # IN lists of any length
+)
+
+
+def fingerprint(sql):
+    """
+    Returns the SQL with its literals replaced, so the queries of a N+1 loop share the same fingerprint
+    """
+    for regex, replacement in _literals:
+        sql = regex.sub(replacement, sql)
+    return sql
+
+
+class QueryReport(object):
+
+    def __init__(self, queries):
+        self.queries = queries
+        self.count = len(queries)
+        self.time = sum(float(query.get('time') or 0) for query in queries)
+        fingerprints = Counter(fingerprint(query.get('sql', '')) for query in queries)
+        self.duplicates = dict((sql, times) for sql, times in fingerprints.items() if times > 1)
+
+
+class QueryStats(object):
+    """
+    Per view query counters of this process
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.views = defaultdict(lambda: {'requests': 0, 'queries': 0, 'time': 0.0, 'over_budget': 0})
+
+    def record(self, view_name, report, over_budget):
+        with self._lock:
+            stats = self.views[view_name]
+            stats['requests'] += 1
+            stats['queries'] += report.count
+            stats['time'] += report.time
+            stats['over_budget'] += int(over_budget)
+
+    def as_dict(self):
+        with self._lock:
+            return dict((view_name, dict(stats)) for view_name, stats in self.views.items())
+
+
+query_stats = QueryStats()
+
+
+def get_query_budget(view_name):
+    """
+    Returns the max queries allowed for the view: QUERY_BUDGETS[view_name] or QUERY_BUDGET by default
+    """
+    return getattr(settings, 'QUERY_BUDGETS', {}).get(view_name, getattr(settings, 'QUERY_BUDGET', 20))
+
+
+class QueryBudgetMiddleware(MiddlewareMixin):
+    """
+    Records the number of queries, SQL time and repeated query fingerprints of every request when
+    QUERY_BUDGET_ENABLED is set, adds them as X-Query-* headers and logs a warning if the view's budget is exceeded
+    """
+
+    def process_request(self, request):
+        if getattr(settings, 'QUERY_BUDGET_ENABLED', False):
+            request._query_capture = CaptureQueriesContext(connection)
+            request._query_capture.__enter__()
+
+    def process_response(self, request, response):
+        capture = getattr(request, '_query_capture', None)
+        if capture is None:
+            return response
+        capture.__exit__(None, None, None)
+        del request._query_capture
+
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else request.path
+        report = QueryReport(capture.captured_queries)
+        budget = get_query_budget(view_name)
+        over_budget = report.count > budget
+        query_stats.record(view_name, report, over_budget)
+
+        response['X-Query-Count'] = str(report.count)
+        response['X-Query-Time'] = '{0:.3f}'.format(report.time)
+        if over_budget or report.duplicates:
+            logger.warning(
+                '%s ran %d queries in %.3fs (budget %d), repeated: %s',
+                view_name, report.count, report.time, budget,
+                '; '.join('{0}x {1}'.format(times, sql) for sql, times in report.duplicates.items()) or 'none',
+                extra={'request': request}
+            )
+        return response
+
+
+class QueryBudgetTestMixin(object):
+    """
+    TestCase mixin to pin the queries run by an endpoint:
+
+        with self.assertQueryBudget(3):
+            self.client.get('/1.0/posts/')
+    """
+
+    def assertQueryBudget(self, max_queries, allow_duplicates=False):
+        return _AssertQueryBudgetContext(self, max_queries, allow_duplicates)
+
+
+class _AssertQueryBudgetContext(CaptureQueriesContext):
+
+    def __init__(self, test_case, max_queries, allow_duplicates):
+        self.test_case = test_case
+        self.max_queries = max_queries
+        self.allow_duplicates = allow_duplicates
+        super(_AssertQueryBudgetContext, self).__init__(connection)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super(_AssertQueryBudgetContext, self).__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return
+        report = QueryReport(self.captured_queries)
+        self.test_case.assertLessEqual(
+            report.count, self.max_queries, '{0} queries executed, {1} allowed:\n{2}'.format(
+                report.count, self.max_queries, '\n'.join(query['sql'] for query in self.captured_queries)
+            )
+        )
+        if not self.allow_duplicates:
+            self.test_case.assertFalse(report.duplicates, 'Repeated queries (N+1?):\n{0}'.format(
+                '\n'.join('{0}x {1}'.format(times, sql) for sql, times in report.duplicates.items())
+            ))
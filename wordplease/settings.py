@@ -1,5 +1,7 @@
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 import os
+import sys
+from datetime import timedelta
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -42,8 +44,18 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'wordplease.queries.QueryBudgetMiddleware',
 )
 
+# SQL queries per request, see wordplease.queries
+QUERY_BUDGET_ENABLED = DEBUG and 'test' not in sys.argv
+QUERY_BUDGET = 20  # default max queries per view
+QUERY_BUDGETS = {  # max queries by view name
+    'latest_posts': 6,
+    'blog_detail': 8,
+    'post_detail': 8,
+}
+
 ROOT_URLCONF = 'wordplease.urls'
 
 TEMPLATES = [
@@ -76,6 +88,24 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/1.10/topics/cache/
+# Use a shared backend (memcached, redis...) in production so every process sees the same fragment versions
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'fragments': {  # rendered template fragments, see blogs.cache
+        'BACKEND': 'blogs.cache.LRUCache',
+        'LOCATION': 'fragments',
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.8/topics/i18n/
 
@@ -105,7 +135,25 @@ REST_FRAMEWORK = {
 BASE_URL = 'http://127.0.0.1:8000'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
+# None streams media from Django, 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache, lighttpd) hands the transfer
+# to the front server once Django has checked the permissions, see wordplease.media
+MEDIA_SERVE_MODE = None
+MEDIA_ACCEL_PREFIX = '/protected-media/'  # nginx internal location aliasing MEDIA_ROOT
 
 # Celery
 USE_CELERY = True
 BROKER_URL = 'django://'
+CELERYBEAT_SCHEDULE = {
+    'publish-scheduled-posts': {  # flips scheduled posts live once their publish date passes
+        'task': 'blogs.tasks.publish_scheduled_posts',
+        'schedule': timedelta(minutes=1),
+    },
+    'update-sitemaps': {  # rewrites the sitemap files of the changed posts and blogs
+        'task': 'blogs.tasks.update_sitemaps',
+        'schedule': timedelta(minutes=30),
+    },
+    'gc-upload-sessions': {  # removes the chunked uploads not resumed for UPLOAD_SESSION_TTL
+        'task': 'files.tasks.gc_upload_sessions',
+        'schedule': timedelta(hours=1),
+    },
+}
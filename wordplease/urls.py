@@ -1,10 +1,12 @@
+import re
+
 from django.conf import settings
 from django.conf.urls import include, url
 from django.contrib import admin
 from blogs import urls as blogs_urls, api_urls as blogs_api_urls
-from django.conf.urls.static import static
 from users import urls as users_urls, api_urls as users_api_urls
 from files import api_urls as files_api_urls
+from wordplease.media import serve_media
 
 urlpatterns = [
     # Django admin URLs
@@ -19,5 +21,8 @@ urlpatterns = [
     # API URLs
     url(r'^api/', include(blogs_api_urls)),
     url(r'^api/', include(users_api_urls)),
-    url(r'^api/', include(files_api_urls))
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)  # support for media files
+    url(r'^api/', include(files_api_urls)),
+
+    # Media files, after checking their permissions (see wordplease.media)
+    url(r'^{0}(?P<path>.+)$'.format(re.escape(settings.MEDIA_URL.lstrip('/'))), serve_media, name='media'),
+]